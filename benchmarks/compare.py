@@ -0,0 +1,62 @@
+"""Compare two benchmark results
+
+    python -m benchmarks.compare old.json new.json [--threshold 0.1]
+
+Prints the median time of every benchmark in both runs and their ratio, and
+exits with status 1 if any benchmark got slower by more than the threshold.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark results.")
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="relative slowdown counted as a regression",
+    )
+    args = parser.parse_args()
+
+    old = json.loads(args.old.read_text())
+    new = json.loads(args.new.read_text())
+    if old["config"] != new["config"]:
+        sys.stderr.write("Warning: the runs used different settings.\n")
+
+    rows = [("benchmark", "old", "new", "ratio", "")]
+    regressions = 0
+    for name, result in new["benchmarks"].items():
+        if name not in old["benchmarks"]:
+            rows.append((name, "-", f"{result['median']:.4f}", "-", "new"))
+            continue
+        old_median = old["benchmarks"][name]["median"]
+        ratio = result["median"] / old_median if old_median else float("inf")
+        flag = ""
+        if ratio > 1 + args.threshold:
+            flag = "slower"
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = "faster"
+        rows.append(
+            (name, f"{old_median:.4f}", f"{result['median']:.4f}", f"{ratio:.2f}", flag)
+        )
+
+    widths = [max(len(row[column]) for row in rows) for column in range(5)]
+    for row in rows:
+        line = "  ".join(
+            cell.ljust(width) if column == 0 else cell.rjust(width)
+            for column, (cell, width) in enumerate(zip(row, widths, strict=True))
+        )
+        sys.stdout.write(line.rstrip() + "\n")
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+"""Stand-in Volumio for benchmarks
+
+Serves the parts of Volumio volco talks to, REST and socket.io on one port
+like the real thing, from a synthetic catalog:
+
+- every `soundcloud/tracks@userId=...` source is a paged feed of
+  `tracks_per_source` shows, newest first,
+- `playlists` playlists start with `playlist_tracks` shows each.
+
+Every request and socket.io call is delayed by `latency` seconds. Feeds and
+playlists are generated from a seed, so runs with the same settings see the
+same data. `POST /_publish?count=n` adds n new shows to the top of every
+feed, `POST /_reset` restores the initial feeds and playlists and clears
+request counts, `GET /_stats` returns them.
+
+Run it on its own with `python -m benchmarks.fake_volumio`.
+"""
+
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from typing import Any, NamedTuple
+
+import socketio
+import uvicorn
+from fastapi import FastAPI, Request
+
+GENRES = (
+    "ambient", "jazz", "techno", "house", "dub", "reggae", "soul", "funk",
+    "disco", "electro", "jungle", "garage", "grime", "drill", "dancehall",
+    "afrobeat", "highlife", "cumbia", "salsa", "samba", "bossa", "folk",
+    "drone", "noise", "industrial", "post-punk", "krautrock", "psych",
+    "library", "soundtrack", "classical", "minimal", "footwork", "juke",
+    "ballroom", "kuduro", "gqom", "amapiano", "rai", "gnawa",
+)  # fmt: skip
+HOSTS = (
+    "Ada", "Bo", "Cleo", "Dev", "Eli", "Fox", "Gil", "Hana", "Ivo", "Jun",
+    "Kai", "Lou", "Mo", "Noor", "Oli", "Pia", "Quin", "Rae", "Sol", "Tam",
+)  # fmt: skip
+# User ids of the NTS feeds in volco's TRACK_SOURCES, playlists are made of their shows
+SOURCE_IDS = (
+    "995174173",
+    "995174689",
+    "995898355",
+    "995897410",
+    "995888653",
+    "995579326",
+    "995580424",
+)
+STATE = {
+    "status": "play",
+    "title": "Show",
+    "artist": "NTS",
+    "album": "",
+    "albumart": "/albumart",
+    "uri": "mixcloud/user@username=NTSRadio/cloudcast@cloudcastId=show",
+    "trackType": "mixcloud",
+    "seek": 60000,
+    "duration": 3600,
+    "service": "mixcloud",
+    "volume": 50,
+    "mute": False,
+    "random": False,
+    "repeat": False,
+    "repeatSingle": False,
+    "consume": False,
+    "stream": False,
+    "updatedb": False,
+    "volatile": False,
+    "disableVolumeControl": False,
+}
+
+
+class FakeVolumioConfig(NamedTuple):
+    port: int = 3000
+    latency: float = 0.0
+    tracks_per_source: int = 1000
+    page_size: int = 20
+    playlists: int = 40
+    playlist_tracks: int = 200
+    seed: int = 0
+
+
+def show_title(source_id: str, index: int) -> str:
+    """Title of the `index`-th show of a source, the same in every run"""
+    rng = random.Random(f"{source_id}-{index}")
+    genres = " & ".join(rng.sample(GENRES, 2))
+    return f"{rng.choice(HOSTS)} w/ {rng.choice(HOSTS)} - {genres} #{index}"
+
+
+def show_item(source_id: str, index: int) -> dict[str, Any]:
+    return {
+        "service": "soundcloud",
+        "type": "song",
+        "title": show_title(source_id, index),
+        "artist": "NTS",
+        "uri": f"soundcloud/nts/track@trackId={source_id}{index:06d}",
+        "albumart": f"https://i1.sndcdn.com/{source_id}{index}.jpg",
+        "duration": 7200,
+    }
+
+
+def playlist_name(index: int) -> str:
+    return f"{GENRES[index % len(GENRES)]} {index}"
+
+
+def playlist_patterns(n_playlists: int) -> dict[str, list[str]]:
+    """Patterns for the playlists, in all three styles the matcher supports"""
+    patterns: dict[str, list[str]] = {}
+    for index in range(n_playlists):
+        genre = GENRES[index % len(GENRES)]
+        host = HOSTS[index % len(HOSTS)].lower()
+        if index % 3 == 0:
+            patterns[playlist_name(index)] = [genre, f"w/ {host}"]
+        elif index % 3 == 1:
+            patterns[playlist_name(index)] = [f"word:{genre}"]
+        else:
+            patterns[playlist_name(index)] = [rf"re:\b{genre}\b.*#\d+0$"]
+    return patterns
+
+
+class FakeVolumio:
+    def __init__(self, config: FakeVolumioConfig):
+        self.config = config
+        self.requests: Counter[str] = Counter()
+        self.published = 0
+        self.playlists: dict[str, list[dict[str, Any]]] = {}
+        self.reset()
+
+        self.sio = socketio.AsyncServer(async_mode="asgi")
+        self.rest = FastAPI()
+        self.app = socketio.ASGIApp(self.sio, other_asgi_app=self.rest)
+        self._add_routes()
+        self._add_handlers()
+
+    def reset(self) -> None:
+        self.requests.clear()
+        self.published = 0
+        rng = random.Random(self.config.seed)
+        n = self.config.tracks_per_source
+        self.playlists = {
+            playlist_name(index): [
+                show_item(rng.choice(SOURCE_IDS), rng.randrange(n))
+                for _ in range(self.config.playlist_tracks)
+            ]
+            for index in range(self.config.playlists)
+        }
+
+    def browse(self, uri: str) -> dict[str, Any]:
+        if uri.startswith("playlists/"):
+            name = uri.removeprefix("playlists/")
+            items = [
+                {**entry, "type": "song"} for entry in self.playlists.get(name, [])
+            ]
+            return _browse_response(uri, items)
+
+        base, _, page = uri.partition("@page=")
+        page = int(page or 0)
+        source_id = base.rsplit("=", 1)[-1]
+        size = self.config.page_size
+        n_tracks = self.config.tracks_per_source + self.published
+        newest = n_tracks - 1
+        items = [
+            show_item(source_id, index)
+            for index in range(newest - page * size, newest - (page + 1) * size, -1)
+            if index >= 0
+        ]
+        if (page + 1) * size < n_tracks:
+            items.append(
+                {
+                    "service": "soundcloud",
+                    "type": "soundcloudNextPageItem",
+                    "title": "Next page",
+                    "uri": f"{base}@page={page + 1}",
+                }
+            )
+        return _browse_response(uri, items)
+
+    async def _delay(self, name: str) -> None:
+        self.requests[name] += 1
+        if self.config.latency:
+            await asyncio.sleep(self.config.latency)
+
+    def _add_routes(self) -> None:
+        rest = self.rest
+
+        @rest.get("/")
+        async def root() -> str:
+            return "Fake Volumio"
+
+        @rest.get("/api/v1/browse")
+        async def browse(uri: str) -> dict[str, Any]:
+            await self._delay("browse")
+            return self.browse(uri)
+
+        @rest.get("/api/v1/getState")
+        async def get_state() -> dict[str, Any]:
+            await self._delay("getState")
+            return STATE
+
+        @rest.post("/api/v1/replaceAndPlay")
+        async def replace_and_play(request: Request) -> dict[str, str]:
+            await request.json()
+            await self._delay("replaceAndPlay")
+            return {"response": "success"}
+
+        @rest.get("/api/v1/commands/")
+        async def commands(cmd: str) -> dict[str, Any]:
+            await self._delay(f"commands/{cmd}")
+            return {"time": int(time.time() * 1000), "response": f"{cmd} Success"}
+
+        @rest.post("/_publish")
+        async def publish(count: int = 1) -> str:
+            self.published += count
+            return "OK"
+
+        @rest.post("/_reset")
+        async def reset() -> str:
+            self.reset()
+            return "OK"
+
+        @rest.get("/_stats")
+        async def stats() -> dict[str, int]:
+            return dict(self.requests)
+
+    def _add_handlers(self) -> None:
+        sio = self.sio
+
+        @sio.on("listPlaylist")
+        async def list_playlists(sid, *_):
+            await self._delay("listPlaylist")
+            await sio.emit("pushListPlaylist", list(self.playlists), to=sid)
+
+        @sio.on("browseLibrary")
+        async def browse_library(sid, data):
+            await self._delay("browseLibrary")
+            await sio.emit("pushBrowseLibrary", self.browse(data["uri"]), to=sid)
+
+        @sio.on("addToPlaylist")
+        async def add_to_playlist(sid, data):
+            await self._delay("addToPlaylist")
+            entry = {"service": data["service"], "uri": data["uri"], "title": ""}
+            self.playlists.setdefault(data["name"], []).append(entry)
+            await _toast(sid, "Added", data["uri"])
+
+        @sio.on("removeFromPlaylist")
+        async def remove_from_playlist(sid, data):
+            await self._delay("removeFromPlaylist")
+            self.playlists[data["name"]] = [
+                entry
+                for entry in self.playlists.get(data["name"], [])
+                if (entry["service"], entry["uri"]) != (data["service"], data["uri"])
+            ]
+            await _toast(sid, "Removed", data["uri"])
+
+        @sio.on("createPlaylist")
+        async def create_playlist(sid, data):
+            await self._delay("createPlaylist")
+            self.playlists.setdefault(data["name"], [])
+            await sio.emit("pushCreatePlaylist", {"success": True}, to=sid)
+
+        @sio.on("deletePlaylist")
+        async def delete_playlist(sid, data):
+            await self._delay("deletePlaylist")
+            self.playlists.pop(data["name"], None)
+            await sio.emit("pushDeletePlaylist", {"success": True}, to=sid)
+
+        @sio.on("getState")
+        async def get_state(sid, *_):
+            await self._delay("getState")
+            await sio.emit("pushState", STATE, to=sid)
+
+        @sio.on("play")
+        async def play(_sid, *_):
+            await self._delay("play")
+
+        @sio.on("pause")
+        async def pause(_sid, *_):
+            await self._delay("pause")
+
+        async def _toast(sid: str, title: str, message: str) -> None:
+            await sio.emit(
+                "pushToastMessage",
+                {"type": "success", "title": title, "message": message},
+                to=sid,
+            )
+
+
+def _browse_response(uri: str, items: list[dict[str, Any]]) -> dict[str, Any]:
+    return {
+        "navigation": {
+            "prev": {"uri": "/"},
+            "info": {"service": "mpd", "type": "folder", "title": uri, "uri": uri},
+            "lists": [{"availableListViews": ["list"], "items": items}],
+        }
+    }
+
+
+def serve(config: FakeVolumioConfig) -> None:
+    fake = FakeVolumio(config)
+    uvicorn.run(fake.app, host="127.0.0.1", port=config.port, log_level="warning")
+
+
+def main():
+    defaults = FakeVolumioConfig()
+    parser = argparse.ArgumentParser(description="Run a stand-in Volumio.")
+    for field, default in defaults._asdict().items():
+        parser.add_argument(
+            f"--{field.replace('_', '-')}", type=type(default), default=default
+        )
+    serve(FakeVolumioConfig(**vars(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
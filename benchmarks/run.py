@@ -0,0 +1,153 @@
+"""Run the benchmarks against a stand-in Volumio
+
+    python -m benchmarks.run --output benchmarks/results/$(git rev-parse --short HEAD).json
+
+The fake Volumio is started on port 3000, where volco expects Volumio, so
+nothing else may listen there. Benchmarks run in a temporary working
+directory with copies of the templates and static files. Results are written
+as JSON, with timings in seconds and the Volumio requests each benchmark made;
+compare two runs with `python -m benchmarks.compare`.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any
+
+from .fake_volumio import FakeVolumioConfig, serve
+
+logger = logging.getLogger(__name__)
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+# Seconds to wait for the fake Volumio to accept connections
+STARTUP_TIMEOUT = 10
+
+
+def main():
+    defaults = FakeVolumioConfig()
+    parser = argparse.ArgumentParser(description="Benchmark volco.")
+    parser.add_argument("--output", type=Path, help="write results here, not stdout")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark")
+    parser.add_argument("--only", help="comma-separated names of the benchmarks to run")
+    parser.add_argument(
+        "--state-lines",
+        type=int,
+        default=2_000_000,
+        help="lines of the synthetic state log",
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=defaults.latency,
+        help="seconds the fake Volumio takes to answer",
+    )
+    parser.add_argument(
+        "--tracks-per-source", type=int, default=defaults.tracks_per_source
+    )
+    parser.add_argument("--playlists", type=int, default=defaults.playlists)
+    parser.add_argument("--playlist-tracks", type=int, default=defaults.playlist_tracks)
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the working directory"
+    )
+    args = parser.parse_args()
+
+    # Progress of the benchmarks only, refresh and socket.io are chatty
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    logging.getLogger("benchmarks").setLevel(logging.INFO)
+    config = defaults._replace(
+        latency=args.latency,
+        tracks_per_source=args.tracks_per_source,
+        playlists=args.playlists,
+        playlist_tracks=args.playlist_tracks,
+    )
+    if _accepts_connections(config.port):
+        sys.exit(f"Port {config.port} is in use, the fake Volumio needs it.")
+
+    started_at = datetime.datetime.now().isoformat(timespec="seconds")
+    workdir = Path(tempfile.mkdtemp(prefix="volco-bench-"))
+    for directory in ("templates", "static"):
+        shutil.copytree(REPO_DIR / directory, workdir / directory)
+
+    fake = multiprocessing.Process(target=serve, args=(config,), daemon=True)
+    fake.start()
+    try:
+        _wait_for(config.port)
+        os.chdir(workdir)
+        # volco finds its files relative to the working directory and probes
+        # for Volumio when imported, so only import it now
+        from .suite import Environment, run_benchmarks
+
+        env = Environment(config, args.state_lines)
+        try:
+            only = set(args.only.split(",")) if args.only else None
+            results = run_benchmarks(env, args.repeat, only)
+        finally:
+            env.close()
+    finally:
+        fake.terminate()
+        fake.join()
+        os.chdir(REPO_DIR)
+        if args.keep:
+            logger.info(f"Working directory kept at {workdir}.")
+        else:
+            shutil.rmtree(workdir)
+
+    report = {
+        "commit": _commit(),
+        "started_at": started_at,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {
+            **config._asdict(),
+            "state_lines": args.state_lines,
+            "repeat": args.repeat,
+        },
+        "benchmarks": results,
+    }
+    output = json.dumps(report, indent=2) + "\n"
+    if args.output is None:
+        sys.stdout.write(output)
+    else:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(output)
+
+
+def _commit() -> dict[str, Any]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=REPO_DIR, capture_output=True, text=True
+        ).stdout.strip()
+
+    return {
+        "sha": git("rev-parse", "HEAD"),
+        "subject": git("log", "-1", "--format=%s"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def _wait_for(port: int) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while not _accepts_connections(port):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Fake Volumio didn't start on port {port}.")
+        time.sleep(0.1)
+
+
+def _accepts_connections(port: int) -> bool:
+    with socket.socket() as s:
+        return s.connect_ex(("127.0.0.1", port)) == 0
+
+
+if __name__ == "__main__":
+    main()
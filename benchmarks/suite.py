@@ -0,0 +1,316 @@
+"""Benchmarks of refresh and its parts
+
+Imported by `benchmarks.run` once the fake Volumio is up and the working
+directory is set, since volco looks for both on import.
+"""
+
+import asyncio
+import inspect
+import json
+import logging
+import mmap
+import random
+import shutil
+import statistics
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import AsyncExitStack
+from functools import partial
+from pathlib import Path
+from typing import Any, NamedTuple
+
+import httpx
+
+from volco.catalog import Catalog
+from volco.constants import (
+    CACHE_DIR,
+    PAGE_HASHES_PATH,
+    PLAYLIST_HTML_DIR,
+    PLAYLIST_PATTERN_PATH,
+    TRACK_SOURCES,
+)
+from volco.controller import VolumioController
+from volco.matcher import PlaylistMatcher
+from volco.models import BrowseResponse, ListItem, strip_uri
+from volco.renderer import extract_progress
+from volco.scraper import StopOnMaxTracks, browse_sources, browse_tracks
+from volco.statelog import CompactStateLog, Sample, aggregate_state_log
+from volco.updater import filter_tracks, generate_html_files
+from volco.updater import main as refresh_main
+
+from .fake_volumio import (
+    SOURCE_IDS,
+    FakeVolumio,
+    FakeVolumioConfig,
+    playlist_patterns,
+    show_item,
+)
+
+logger = logging.getLogger(__name__)
+
+# Shows per source used for filtering
+FILTER_SHOWS_PER_SOURCE = 3000
+# Tracks browsed from one source, and from each source when browsing all
+BROWSE_MAX_TRACKS = 500
+# Samples per listening session in the synthetic state log
+SESSION_LENGTH = 60
+# Kept apart from the logs refresh reads, which it compacts
+BENCH_STATE_LOG_PATH = Path("bench/state.log")
+BENCH_COMPACT_STATE_LOG_PATH = Path("bench/state.dat")
+
+Setup = Callable[[], Awaitable[None] | None]
+
+
+class Benchmark(NamedTuple):
+    name: str
+    run: Callable[[], Any]
+    # Runs before every repetition, not timed
+    setup: Setup | None = None
+
+
+class Environment:
+    """Shared state of the benchmarks: the fake, its data and a Volumio connection"""
+
+    def __init__(self, config: FakeVolumioConfig, state_lines: int):
+        self.config = config
+        self.state_lines = state_lines
+        self.url = f"http://localhost:{config.port}"
+        self.loop = asyncio.new_event_loop()
+        self._exit_stack = AsyncExitStack()
+        self._vc: VolumioController | None = None
+        self._refreshed = False
+
+    def run(self, result: Any) -> Any:
+        if inspect.isawaitable(result):
+            return self.loop.run_until_complete(result)
+        return result
+
+    async def vc(self) -> VolumioController:
+        if self._vc is None:
+            self._vc = await self._exit_stack.enter_async_context(
+                VolumioController.connect(self.url)
+            )
+        return self._vc
+
+    def close(self) -> None:
+        self.loop.run_until_complete(self._exit_stack.aclose())
+        # The socket.io client's tasks wind down after it disconnects
+        pending = asyncio.all_tasks(self.loop)
+        if pending:
+            self.loop.run_until_complete(asyncio.wait(pending, timeout=1))
+        for task in pending:
+            task.cancel()
+        self.loop.close()
+
+    def request_counts(self) -> dict[str, int]:
+        return httpx.get(f"{self.url}/_stats").json()
+
+    def reset_fake(self) -> None:
+        httpx.post(f"{self.url}/_reset").raise_for_status()
+
+    def publish(self, count: int = 1) -> None:
+        httpx.post(f"{self.url}/_publish", params={"count": count}).raise_for_status()
+
+    def reset_workdir(self) -> None:
+        """Forget everything refresh wrote, as if it never ran"""
+        for directory in (CACHE_DIR, PLAYLIST_HTML_DIR, Path("logs")):
+            shutil.rmtree(directory, ignore_errors=True)
+            directory.mkdir(parents=True)
+        PLAYLIST_PATTERN_PATH.write_text(
+            json.dumps(playlist_patterns(self.config.playlists))
+        )
+
+    def write_state_logs(self) -> None:
+        """Synthetic JSON and compact state logs, kept across benchmarks"""
+        BENCH_STATE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+        if not BENCH_STATE_LOG_PATH.exists():
+            _write_state_log(BENCH_STATE_LOG_PATH, self.state_lines, self.config)
+        if not BENCH_COMPACT_STATE_LOG_PATH.exists():
+            _write_compact_state_log(
+                BENCH_COMPACT_STATE_LOG_PATH, self.state_lines, self.config
+            )
+
+    def reset(self) -> None:
+        self.reset_fake()
+        self.reset_workdir()
+        self._refreshed = True
+
+    def prime(self) -> None:
+        """Make sure refresh ran once, so later runs only see changes"""
+        if not self._refreshed:
+            self.reset()
+            refresh_main(backend="socketio")
+
+
+def benchmarks(env: Environment) -> list[Benchmark]:
+    config = env.config
+    tracks = [
+        ListItem.parse_obj(show_item(source_id, index))
+        for source_id in SOURCE_IDS
+        for index in range(FILTER_SHOWS_PER_SOURCE)
+    ]
+    matcher = PlaylistMatcher(playlist_patterns(config.playlists))
+    fake = FakeVolumio(config)
+    browse_pages = [
+        fake.browse(f"{source}@page={page}")
+        for source in TRACK_SOURCES
+        for page in range(config.tracks_per_source // config.page_size)
+    ]
+    stop_condition = partial(StopOnMaxTracks, max_tracks=BROWSE_MAX_TRACKS)
+
+    def extract_mapped_log() -> dict[str, int]:
+        with (
+            BENCH_STATE_LOG_PATH.open("rb") as f,
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm,
+        ):
+            return extract_progress(mm)
+
+    async def render_pages() -> None:
+        with Catalog() as catalog:
+            await generate_html_files(await env.vc(), catalog, _track_progress(config))
+
+    def render_pages_once() -> None:
+        env.prime()
+        env.run(render_pages())
+
+    def remove_pages() -> None:
+        shutil.rmtree(PLAYLIST_HTML_DIR)
+        PLAYLIST_HTML_DIR.mkdir(parents=True)
+        PAGE_HASHES_PATH.unlink(missing_ok=True)
+
+    return [
+        Benchmark("filter_tracks", lambda: filter_tracks(tracks, matcher)),
+        Benchmark(
+            "parse_browse_pages",
+            lambda: [BrowseResponse.parse_obj(page) for page in browse_pages],
+        ),
+        Benchmark(
+            "browse_tracks",
+            lambda: browse_tracks(TRACK_SOURCES[0], stop_condition),
+        ),
+        Benchmark(
+            "browse_sources",
+            lambda: browse_sources(TRACK_SOURCES, stop_condition),
+        ),
+        Benchmark(
+            "extract_progress",
+            extract_mapped_log,
+            setup=env.write_state_logs,
+        ),
+        Benchmark(
+            "aggregate_state_log",
+            lambda: aggregate_state_log(CompactStateLog(BENCH_COMPACT_STATE_LOG_PATH)),
+            setup=env.write_state_logs,
+        ),
+        Benchmark(
+            "generate_html_files_cold",
+            render_pages,
+            setup=lambda: (env.prime(), remove_pages()),
+        ),
+        Benchmark(
+            "generate_html_files_unchanged", render_pages, setup=render_pages_once
+        ),
+        Benchmark("refresh_cold", partial(refresh_main, backend="socketio"), env.reset),
+        Benchmark(
+            "refresh_unchanged", partial(refresh_main, backend="socketio"), env.prime
+        ),
+        Benchmark(
+            "refresh_new_uploads",
+            partial(refresh_main, backend="socketio"),
+            setup=lambda: (env.prime(), env.publish()),
+        ),
+    ]
+
+
+def run_benchmarks(
+    env: Environment, repeat: int, only: set[str] | None = None
+) -> dict[str, dict[str, Any]]:
+    results: dict[str, dict[str, Any]] = {}
+    for benchmark in benchmarks(env):
+        if only and benchmark.name not in only:
+            continue
+
+        times: list[float] = []
+        requests: dict[str, int] = {}
+        for _ in range(repeat):
+            if benchmark.setup is not None:
+                env.run(benchmark.setup())
+            before = env.request_counts()
+            start = time.perf_counter()
+            env.run(benchmark.run())
+            times.append(time.perf_counter() - start)
+            after = env.request_counts()
+            requests = {
+                name: count - before.get(name, 0)
+                for name, count in after.items()
+                if count != before.get(name, 0)
+            }
+
+        results[benchmark.name] = {
+            "times": times,
+            "min": min(times),
+            "median": statistics.median(times),
+            "mean": statistics.mean(times),
+            "stdev": statistics.stdev(times) if len(times) > 1 else 0.0,
+            # Of the last repetition
+            "requests": requests,
+        }
+        logger.info(
+            f"{benchmark.name}: median {results[benchmark.name]['median']:.4f} s"
+        )
+    return results
+
+
+def _track_progress(config: FakeVolumioConfig) -> dict[str, int]:
+    rng = random.Random(config.seed)
+    return {
+        strip_uri(show_item(rng.choice(SOURCE_IDS), index)["uri"]): rng.randrange(101)
+        for index in range(config.tracks_per_source)
+    }
+
+
+def _sessions(n_lines: int, config: FakeVolumioConfig):
+    """Listening sessions of the synthetic state logs, oldest first"""
+    rng = random.Random(config.seed)
+    ts = int(time.time()) - n_lines * 60
+    for _ in range(0, n_lines, SESSION_LENGTH):
+        source_id = rng.choice(SOURCE_IDS)
+        index = rng.randrange(config.tracks_per_source)
+        item = show_item(source_id, index)
+        seek = 0
+        for _ in range(SESSION_LENGTH):
+            yield ts, item, seek
+            ts += 60
+            seek += 60000
+
+
+def _write_state_log(path: Path, n_lines: int, config: FakeVolumioConfig) -> None:
+    logger.info(f"Writing {n_lines} state log lines.")
+    with path.open("w") as f:
+        for ts, item, seek in _sessions(n_lines, config):
+            state = {
+                "status": "play",
+                "service": item["service"],
+                "uri": item["uri"],
+                "title": item["title"],
+                "artist": item["artist"],
+                "seek": seek,
+                "duration": item["duration"],
+            }
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+            f.write(json.dumps({"ts": timestamp, "state": state}) + "\n")
+
+
+def _write_compact_state_log(
+    path: Path, n_lines: int, config: FakeVolumioConfig
+) -> None:
+    log = CompactStateLog(path)
+    batch: list[Sample] = []
+    for ts, item, seek in _sessions(n_lines, config):
+        batch.append(
+            Sample(ts, item["service"], item["uri"], seek, item["duration"], "play")
+        )
+        if len(batch) == 100_000:
+            log.append(batch)
+            batch = []
+    log.append(batch)
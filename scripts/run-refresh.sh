@@ -1,6 +1,10 @@
 #!/bin/bash
+# One-off full refresh: crawls every source and renders all pages, e.g. after
+# editing playlist patterns. The app schedules refresh by itself (see
+# SCHEDULE_REFRESH_IN_APP), so don't run this from cron: remove the old
+# crontab entry. If both run, one skips through the refresh lock anyway.
 
 cd /home/volumio/volco
 source venv/bin/activate
 
-refresh
+refresh "$@"
@@ -1,61 +1,185 @@
+import asyncio
 import json
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 import httpx
 import pydantic
-from fastapi import Depends, FastAPI, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+import socketio
+from fastapi import Depends, FastAPI, Form, HTTPException, Query, Request
+from fastapi.responses import (
+    HTMLResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
+from starlette.middleware import Middleware
 from starlette.routing import Mount
 
+from volco.clients import HttpClients
 from volco.constants import (
+    GZIP_MIN_SIZE,
     INDEX_PATH,
+    MAX_TRACK_PAGE_SIZE,
     PLAYLIST_PATTERN_PATH,
+    SCHEDULE_REFRESH_IN_APP,
     TEMPLATE_DIR,
+    TRACK_PAGE_SIZE,
     VOLUMIO_API_URL,
 )
-from volco.models import PlayerResponse, PlaylistRules, State
-from volco.tracklist import get_tracklist_link
+from volco.controller import VolumioController
+from volco.matcher import InvalidPatternError, PlaylistMatcher
+from volco.metrics import (
+    CONTENT_TYPE,
+    RequestTimingMiddleware,
+    load_summary,
+    render_metrics,
+)
+from volco.models import PlayerResponse, PlaylistRules, State, TrackPage
+from volco.pages import InvalidCursorError, PlaylistPages, ReloadingFile
+from volco.recorder import StateRecorder
+from volco.scheduler import RefreshScheduler
+from volco.static_files import CachedStaticFiles, JSONGZipMiddleware, etag_matches
+from volco.status import StatusCache
+from volco.tracklist import get_tracklist_link, prefetch_tracklist_links
 
 Path("static/playlists").mkdir(parents=True, exist_ok=True)
 Path("logs").mkdir(parents=True, exist_ok=True)
 Path("static").mkdir(parents=True, exist_ok=True)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    clients = HttpClients()
+    app.state.clients = clients
+
+    status_cache = StatusCache(clients.volumio)
+    app.state.status_cache = status_cache
+
+    vc = VolumioController(socketio.AsyncClient())
+    vc.on("pushState", status_cache.publish)
+    app.state.vc = vc
+
+    pages = PlaylistPages()
+    app.state.pages = pages
+    app.state.index = ReloadingFile(INDEX_PATH)
+
+    recorder = StateRecorder(vc)
+    recorder.add_flush_listener(pages.add_progress)
+    recorder.start()
+    app.state.recorder = recorder
+
+    scheduler = None
+    if SCHEDULE_REFRESH_IN_APP:
+        scheduler = RefreshScheduler(vc, clients.volumio)
+        scheduler.start()
+
+    connect_task = asyncio.create_task(vc.ensure_connected())
+    prefetch_task = asyncio.create_task(
+        prefetch_tracklist_links(status_cache.subscribe(), clients)
+    )
+
+    yield
+
+    connect_task.cancel()
+    prefetch_task.cancel()
+    if scheduler is not None:
+        await scheduler.stop()
+    await recorder.stop()
+    await vc.disconnect()
+    await clients.aclose()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     routes=[
-        Mount(
-            "/playlists",
-            app=StaticFiles(directory="static/playlists"),
-            name="playlists",
-        ),
         Mount(
             "/logs",
-            app=StaticFiles(directory="logs"),
+            app=CachedStaticFiles(directory="logs"),
             name="logs",
         ),
         Mount(
             "/static",
-            app=StaticFiles(directory="static"),
+            app=CachedStaticFiles(
+                directory="static", asset_cache_control="public, max-age=3600"
+            ),
             name="static",
         ),
-    ]
+    ],
+    middleware=[
+        Middleware(RequestTimingMiddleware),
+        Middleware(JSONGZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=6),
+    ],
 )
 templates = Jinja2Templates(directory=TEMPLATE_DIR)
-index_html = INDEX_PATH.read_text()
+# Pages written by refresh, for playlists not in the catalog
+playlist_static_files = CachedStaticFiles(directory="static/playlists")
+
+
+def get_clients(request: Request) -> HttpClients:
+    return request.app.state.clients
+
+
+def get_volumio_client(request: Request) -> httpx.AsyncClient:
+    return request.app.state.clients.volumio
+
+
+def get_status_cache(request: Request) -> StatusCache:
+    return request.app.state.status_cache
 
 
-async def get_client():
-    # create a new client for each request
-    async with httpx.AsyncClient() as client:
-        # yield the client to the endpoint function
-        yield client
-        # close the client when the request is done
+def get_pages(request: Request) -> PlaylistPages:
+    return request.app.state.pages
 
 
 @app.get("/", response_class=HTMLResponse)
-async def get_index():
-    return index_html
+async def get_index(request: Request):
+    return request.app.state.index.read()
+
+
+@app.get("/playlists/{name}", response_class=HTMLResponse)
+async def get_playlist_page(
+    name: str,
+    request: Request,
+    pages: PlaylistPages = Depends(get_pages),  # noqa: B008
+) -> Response:
+    # Reading the catalog and rendering block, so they run in a thread
+    playlist = await asyncio.to_thread(pages.resolve, name)
+    if playlist is None:
+        return await playlist_static_files.get_response(name, request.scope)
+
+    page = await asyncio.to_thread(pages.get, playlist)
+    use_gzip = "gzip" in request.headers.get("accept-encoding", "")
+    etag = f'{page.etag[:-1]}-gzip"' if use_gzip else page.etag
+    headers = {"etag": etag, "cache-control": "no-cache", "vary": "Accept-Encoding"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    if use_gzip:
+        headers["content-encoding"] = "gzip"
+        return Response(page.gzipped, media_type="text/html", headers=headers)
+    return Response(page.content, media_type="text/html", headers=headers)
+
+
+# Not async, so FastAPI runs it in a thread: it may read the catalog
+@app.get("/api/playlists/{name}/tracks")
+def get_playlist_tracks(
+    name: str,
+    cursor: str | None = None,
+    limit: int = Query(TRACK_PAGE_SIZE, ge=1, le=MAX_TRACK_PAGE_SIZE),
+    pages: PlaylistPages = Depends(get_pages),  # noqa: B008
+) -> TrackPage:
+    playlist = pages.resolve(name)
+    if playlist is None:
+        raise HTTPException(404, f"Unknown playlist `{name}`")
+
+    try:
+        return pages.track_page(playlist, cursor, limit)
+    except InvalidCursorError as e:
+        raise HTTPException(400, str(e)) from e
 
 
 @app.get("/patterns", response_class=HTMLResponse)
@@ -83,6 +207,11 @@ async def submit_patterns(
             status_code=400, detail=f"Wrong format. Full message: {e}."
         ) from e
 
+    try:
+        PlaylistMatcher(parsed_rules.__root__)
+    except InvalidPatternError as e:
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
     new_rules_json = json.dumps(parsed_rules.__root__, indent=2)
     PLAYLIST_PATTERN_PATH.write_text(new_rules_json)
 
@@ -94,11 +223,24 @@ async def get_health():
     return "OK"
 
 
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    return Response(render_metrics(load_summary()), media_type=CONTENT_TYPE)
+
+
+@app.get("/metrics/refresh")
+async def get_last_refresh() -> dict:
+    summary = load_summary()
+    if summary is None:
+        raise HTTPException(404, "No refresh has run yet")
+    return summary
+
+
 @app.post("/playback/replace")
 async def play_track(
     uri: str = Form(),
     service: str = Form(),
-    client: httpx.AsyncClient = Depends(get_client),  # noqa: B008
+    client: httpx.AsyncClient = Depends(get_volumio_client),  # noqa: B008
 ) -> dict[str, str]:
     """Used to accept form data input."""
     # This needs localhost as the call is made on server side
@@ -112,7 +254,7 @@ async def play_track(
 # play, post, status redirected to stay on the same port (volumio API runs on port 3000)
 @app.post("/playback/play")
 async def play(
-    client: httpx.AsyncClient = Depends(get_client),  # noqa: B008
+    client: httpx.AsyncClient = Depends(get_volumio_client),  # noqa: B008
 ) -> PlayerResponse:
     # This needs localhost as the call is made on server side
     r = await client.get(
@@ -123,7 +265,7 @@ async def play(
 
 @app.post("/playback/pause")
 async def pause(
-    client: httpx.AsyncClient = Depends(get_client),  # noqa: B008
+    client: httpx.AsyncClient = Depends(get_volumio_client),  # noqa: B008
 ) -> PlayerResponse:
     # This needs localhost as the call is made on server side
     r = await client.get(
@@ -134,23 +276,33 @@ async def pause(
 
 @app.get("/playback/status")
 async def get_status(
-    client: httpx.AsyncClient = Depends(get_client),  # noqa: B008
+    status_cache: StatusCache = Depends(get_status_cache),  # noqa: B008
 ) -> State:
-    # This needs localhost as the call is made on server side
-    r = await client.get(
-        f"http://{VOLUMIO_API_URL}/api/v1/getState",
-    )
-    return State.parse_obj(r.json())
+    return await status_cache.get()
+
+
+@app.get("/playback/events")
+async def get_status_events(
+    status_cache: StatusCache = Depends(get_status_cache),  # noqa: B008
+) -> StreamingResponse:
+    """Server-sent events with the playback state on every change"""
+
+    async def events() -> AsyncIterator[str]:
+        async for state in status_cache.subscribe():
+            yield f"data: {state.json()}\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
 
 
 @app.get("/tracklist", response_model=None)
 async def get_tracklist(
-    client: httpx.AsyncClient = Depends(get_client),  # noqa: B008
+    clients: HttpClients = Depends(get_clients),  # noqa: B008
+    status_cache: StatusCache = Depends(get_status_cache),  # noqa: B008
 ) -> RedirectResponse:
-    state = await get_status(client)
+    state = await status_cache.get()
 
     if "NTS" not in state.artist:
         raise HTTPException(400, "Not an NTS track")
 
-    tracklist_link = await get_tracklist_link(state, client)
+    tracklist_link = await get_tracklist_link(state, clients)
     return RedirectResponse(tracklist_link)
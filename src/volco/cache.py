@@ -0,0 +1,70 @@
+"""Small persistent cache
+
+Entries expire after a TTL, the least recently used ones are evicted once
+the cache is full, and the contents are mirrored to a JSON file so they
+survive restarts.
+"""
+
+import json
+import logging
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+
+class PersistentCache:
+    def __init__(self, path: Path, ttl: float, max_size: int = 256):
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+        # Key -> (expiry timestamp, value)
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._load()
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        expires_at, value = entry
+        if expires_at < time.time():
+            self.delete(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        self._save()
+
+    def delete(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self._save()
+
+    def _load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            entries = json.loads(self.path.read_text())
+        except ValueError:
+            logger.warning(f"Could not read cache {self.path}, starting empty.")
+            return
+
+        now = time.time()
+        for key, (expires_at, value) in entries.items():
+            if expires_at >= now:
+                self._entries[key] = (expires_at, value)
+
+    def _save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text(json.dumps(self._entries))
+        tmp_path.replace(self.path)
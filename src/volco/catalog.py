@@ -0,0 +1,197 @@
+"""Local track catalog
+
+An SQLite copy of every track seen in the feeds and of the contents of each
+playlist, indexed by stripped URI. It lets a refresh tell new tracks from
+known ones and look up playlist contents without browsing Volumio.
+"""
+
+import sqlite3
+from collections.abc import Iterable
+from datetime import datetime
+from pathlib import Path
+from types import TracebackType
+
+from .constants import CATALOG_PATH
+from .models import ListItem
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracks (
+    stripped_uri TEXT PRIMARY KEY,
+    source TEXT NOT NULL,
+    item TEXT NOT NULL,
+    first_seen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlists (
+    name TEXT PRIMARY KEY,
+    synced_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS playlist_tracks (
+    playlist TEXT NOT NULL REFERENCES playlists (name) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    stripped_uri TEXT NOT NULL,
+    item TEXT NOT NULL,
+    PRIMARY KEY (playlist, position)
+);
+CREATE INDEX IF NOT EXISTS playlist_tracks_uri ON playlist_tracks (stripped_uri);
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    high_water_uri TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_source ON tracks (source, first_seen);
+"""
+
+
+class Catalog:
+    def __init__(self, path: Path = CATALOG_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Used from worker threads, one at a time, to keep it off the event loop
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+        self._migrate()
+
+    def __enter__(self) -> "Catalog":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        traceback: TracebackType | None,
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _migrate(self) -> None:
+        # Catalogs from before feed fingerprints
+        columns = {
+            row[1] for row in self.connection.execute("PRAGMA table_info(sources)")
+        }
+        if "fingerprint" not in columns:
+            with self.connection:
+                self.connection.execute(
+                    "ALTER TABLE sources ADD COLUMN fingerprint TEXT"
+                )
+
+    def known_uris(self) -> set[str]:
+        rows = self.connection.execute("SELECT stripped_uri FROM tracks")
+        return {uri for (uri,) in rows}
+
+    def add_tracks(self, source: str, tracks: Iterable[ListItem]) -> list[ListItem]:
+        """Record tracks seen in a source, return the ones not seen before"""
+        now = datetime.now().isoformat()
+        new_tracks: list[ListItem] = []
+        with self.connection:
+            for track in tracks:
+                cursor = self.connection.execute(
+                    "INSERT OR IGNORE INTO tracks VALUES (?, ?, ?, ?)",
+                    (track.stripped_uri, source, track.json(), now),
+                )
+                if cursor.rowcount:
+                    new_tracks.append(track)
+        return new_tracks
+
+    def high_water_mark(self, source: str) -> str | None:
+        """Stripped URI of the newest track seen in a source"""
+        row = self.connection.execute(
+            "SELECT high_water_uri FROM sources WHERE source = ?", (source,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_high_water_mark(self, source: str, stripped_uri: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO sources (source, high_water_uri, updated_at) "
+                "VALUES (?, ?, ?) ON CONFLICT (source) DO UPDATE SET "
+                "high_water_uri = excluded.high_water_uri, "
+                "updated_at = excluded.updated_at",
+                (source, stripped_uri, datetime.now().isoformat()),
+            )
+
+    def fingerprint(self, source: str) -> str | None:
+        """Fingerprint of the first tracks of a source when last crawled"""
+        row = self.connection.execute(
+            "SELECT fingerprint FROM sources WHERE source = ?", (source,)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def set_fingerprint(self, source: str, fingerprint: str) -> None:
+        """Set the fingerprint of a source, after its high water mark"""
+        with self.connection:
+            self.connection.execute(
+                "UPDATE sources SET fingerprint = ?, updated_at = ? WHERE source = ?",
+                (fingerprint, datetime.now().isoformat(), source),
+            )
+
+    def first_seen_times(self, source: str, limit: int = 100) -> list[datetime]:
+        """Distinct times new tracks of a source were seen, newest first"""
+        rows = self.connection.execute(
+            "SELECT DISTINCT first_seen FROM tracks WHERE source = ? "
+            "ORDER BY first_seen DESC LIMIT ?",
+            (source, limit),
+        )
+        return [datetime.fromisoformat(first_seen) for (first_seen,) in rows]
+
+    def playlists(self) -> list[str]:
+        """Names of all synced playlists"""
+        rows = self.connection.execute("SELECT name FROM playlists ORDER BY name")
+        return [name for (name,) in rows]
+
+    def playlist_tracks(self, playlist: str) -> list[ListItem] | None:
+        """Tracks in a playlist, or None if the playlist was never synced"""
+        synced = self.connection.execute(
+            "SELECT 1 FROM playlists WHERE name = ?", (playlist,)
+        ).fetchone()
+        if synced is None:
+            return None
+
+        rows = self.connection.execute(
+            "SELECT item FROM playlist_tracks WHERE playlist = ? ORDER BY position",
+            (playlist,),
+        )
+        return [ListItem.parse_raw(item) for (item,) in rows]
+
+    def set_playlist_tracks(self, playlist: str, tracks: Iterable[ListItem]) -> None:
+        """Replace the recorded contents of a playlist"""
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO playlists VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET synced_at = excluded.synced_at",
+                (playlist, datetime.now().isoformat()),
+            )
+            self.connection.execute(
+                "DELETE FROM playlist_tracks WHERE playlist = ?", (playlist,)
+            )
+            self.connection.executemany(
+                "INSERT INTO playlist_tracks VALUES (?, ?, ?, ?)",
+                (
+                    (playlist, position, track.stripped_uri, track.json())
+                    for position, track in enumerate(tracks)
+                ),
+            )
+
+    def add_to_playlist(self, playlist: str, track: ListItem) -> None:
+        # Unsynced playlists are left alone, they'll be browsed in full first
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO playlist_tracks "
+                "SELECT ?, COALESCE(MAX(position), -1) + 1, ?, ? "
+                "FROM playlist_tracks WHERE playlist = ? "
+                "HAVING EXISTS (SELECT 1 FROM playlists WHERE name = ?)",
+                (playlist, track.stripped_uri, track.json(), playlist, playlist),
+            )
+
+    def remove_from_playlist(self, playlist: str, track: ListItem) -> None:
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM playlist_tracks WHERE playlist = ? AND stripped_uri = ?",
+                (playlist, track.stripped_uri),
+            )
+
+    def delete_playlist(self, playlist: str) -> None:
+        with self.connection:
+            self.connection.execute("DELETE FROM playlists WHERE name = ?", (playlist,))
@@ -0,0 +1,44 @@
+"""Shared HTTP clients
+
+One pooled `httpx.AsyncClient` per upstream, so requests from the app reuse
+kept-alive connections instead of connecting (and doing TLS) every time.
+"""
+
+import asyncio
+
+import httpx
+
+from .constants import (
+    HTTP_KEEPALIVE_EXPIRY,
+    HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    MIXCLOUD_TIMEOUT,
+    SOUNDCLOUD_TIMEOUT,
+    VOLUMIO_TIMEOUT,
+)
+from .metrics import TimedTransport
+
+
+def create_client(timeout: float, upstream: str) -> httpx.AsyncClient:
+    """Client for one upstream, its requests timed under that name"""
+    limits = httpx.Limits(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+    )
+    transport = TimedTransport(httpx.AsyncHTTPTransport(limits=limits), upstream)
+    return httpx.AsyncClient(transport=transport, timeout=timeout)
+
+
+class HttpClients:
+    def __init__(self):
+        self.volumio = create_client(VOLUMIO_TIMEOUT, "volumio")
+        self.soundcloud = create_client(SOUNDCLOUD_TIMEOUT, "soundcloud")
+        self.mixcloud = create_client(MIXCLOUD_TIMEOUT, "mixcloud")
+
+    async def aclose(self) -> None:
+        await asyncio.gather(
+            self.volumio.aclose(),
+            self.soundcloud.aclose(),
+            self.mixcloud.aclose(),
+        )
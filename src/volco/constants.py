@@ -9,6 +9,11 @@ PLAYLIST_HTML_DIR = Path("static/playlists/")  # TODO: auto mkdir
 PLAYLIST_PATTERN_PATH = Path("static/playlist_patterns.json")
 INDEX_PATH = Path("static/index.html")
 PLAYLIST_TEMPLATE_HTML = "list.html"
+# Tracks per playlist API page, the first page is part of the playlist page
+TRACK_PAGE_SIZE = 50
+MAX_TRACK_PAGE_SIZE = 500
+# Smallest JSON response in bytes worth compressing
+GZIP_MIN_SIZE = 1024
 INDEX_TEMPLATE_HTML = "index.html"
 
 if not PLAYLIST_PATTERN_PATH.exists():
@@ -17,8 +22,18 @@ if not PLAYLIST_PATTERN_PATH.exists():
 LATEST_50_NAME = "- latest 50"
 N_LATEST = 50
 
+# JSON lines log written before the compact log, still read for progress
 STATE_LOG_PATH = Path("logs/state.log")
+COMPACT_STATE_LOG_PATH = Path("logs/state.dat")
+# Seconds after which listening sessions are collapsed to their furthest sample
+STATE_COMPACT_AGE = 30 * 24 * 60 * 60
 TRACK_PROGRESS_PATH = Path("logs/track_progress.json")
+PROGRESS_CHECKPOINT_PATH = Path("logs/progress_checkpoint.json")
+# Seconds between playback state polls and between state log writes
+STATE_POLL_INTERVAL = 15
+STATE_FLUSH_INTERVAL = 300
+# Seconds a fetched playback status is reused for
+STATUS_CACHE_TTL = 2
 
 TRACK_SOURCES = [
     "soundcloud/tracks@userId=995174173",  # NTS Monday
@@ -30,7 +45,42 @@ TRACK_SOURCES = [
     "soundcloud/tracks@userId=995580424",  # NTS Sunday
 ]
 
+CACHE_DIR = Path("cache")
+SC_CLIENT_ID_CACHE_PATH = CACHE_DIR / "sc_client_id.json"
+SC_CLIENT_ID_TTL = 7 * 24 * 60 * 60
+CATALOG_PATH = CACHE_DIR / "catalog.sqlite3"
+PAGE_HASHES_PATH = CACHE_DIR / "page_hashes.json"
+TRACKLIST_CACHE_PATH = CACHE_DIR / "tracklist_links.json"
+# Found links don't change, missing ones may show up once the episode is online
+TRACKLIST_LINK_TTL = 90 * 24 * 60 * 60
+TRACKLIST_MISS_TTL = 6 * 60 * 60
+# Maximum number of browse requests in flight when crawling sources
+BROWSE_CONCURRENCY = 4
+# Feeds whose first tracks are unchanged since the last crawl aren't paged through
+FEED_FINGERPRINT_SIZE = 5
+
+# Refresh runs in the app, each source checked when it's likely to have published.
+# It replaces the cron job, scripts/run-refresh.sh is only for one-off runs.
+SCHEDULE_REFRESH_IN_APP = True
+REFRESH_LOCK_PATH = Path("logs/refresh.lock")
+# Stages and call timings of the last refresh, served by the app
+LAST_REFRESH_PATH = Path("logs/last_refresh.json")
+# Seconds between checks of a source: until it has some history, at least and at most
+SOURCE_DEFAULT_INTERVAL = 60 * 60
+SOURCE_MIN_INTERVAL = 15 * 60
+SOURCE_MAX_INTERVAL = 12 * 60 * 60
+# Seconds before a source's expected publication to start checking it
+SOURCE_EARLY_CHECK = 2 * 60 * 60
+# Past publications used to estimate when a source publishes next, new tracks
+# seen less than PUBLICATION_GAP seconds apart count as one publication
+PUBLICATION_HISTORY = 8
+PUBLICATION_GAP = 6 * 60 * 60
+
 SOCKETIO_PORT = 3000
+# Seconds to wait for Volumio to answer a socket.io call
+VOLUMIO_RESPONSE_TIMEOUT = 10
+# Maximum number of socket.io calls in flight at once
+VOLUMIO_MAX_CONCURRENCY = 8
 try:
     response = urllib.request.urlopen(f"http://localhost:{SOCKETIO_PORT}")
     VOLUMIO_URL = "localhost"
@@ -38,3 +88,18 @@ except urllib.error.URLError:
     VOLUMIO_URL = "192.168.2.22"
 
 VOLUMIO_API_URL = f"{VOLUMIO_URL}:3000"
+
+VOLUMIO_PLAYLIST_DIR = Path("/data/playlist")
+# Playlists are edited via socket.io. Writing Volumio's playlist files directly
+# ("files") takes one write per playlist instead of a call per track, but only
+# works on the Volumio box, so it's opt-in: `--backend files` or set it here.
+PLAYLIST_BACKEND = "socketio"
+
+# Connection pool limits shared by all outbound HTTP clients
+HTTP_MAX_CONNECTIONS = 10
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 5
+HTTP_KEEPALIVE_EXPIRY = 60
+# Request timeouts in seconds per upstream
+VOLUMIO_TIMEOUT = 5
+SOUNDCLOUD_TIMEOUT = 10
+MIXCLOUD_TIMEOUT = 10
@@ -1,59 +1,167 @@
-from collections.abc import Callable
+import asyncio
+import contextlib
+import logging
+from collections import defaultdict, deque
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
 from typing import Any
 
+import socketio
 from pydantic import BaseModel
-from socketIO_client import SocketIO
 
+from .constants import (
+    SOCKETIO_PORT,
+    VOLUMIO_MAX_CONCURRENCY,
+    VOLUMIO_RESPONSE_TIMEOUT,
+    VOLUMIO_URL,
+)
+from .metrics import time_volumio_call
 from .models import BrowseResponse, ListItem, ResultList, ToastMessage, VolumioResponse
 
+logger = logging.getLogger(__name__)
 
-class VolumioController:
-    def __init__(self, socketio: SocketIO):
-        self.socketio = socketio
-        self.responses: dict[str, Any] = {}
-
-    def _create_callback(self, message: str) -> Callable[[Any], None]:
-        def inner(*args):
-            self.responses[message] = args
+DEFAULT_URL = f"http://{VOLUMIO_URL}:{SOCKETIO_PORT}"
+# Seconds to wait between attempts to reach Volumio
+CONNECT_RETRY_DELAY = 10
 
-        return inner
+# Decides whether a reply belongs to a call
+ReplyMatcher = Callable[[tuple], bool]
 
-    def _listen_for(self, message: str):
-        self.socketio.once(message, self._create_callback(message))
 
-    def _emit(self, *args):
-        self.socketio.emit(*args)
+class VolumioTimeoutError(TimeoutError):
+    pass
 
-    def _get_response(self, message: str) -> tuple | None:
-        self.socketio.wait(0.5)
-        response = self.responses.get(message)
-        return response
 
-    def call(
+class VolumioController:
+    """Volumio socket.io client.
+
+    Calls can be made concurrently over one connection, up to
+    `max_concurrency` at a time. Volumio replies don't identify the request
+    they answer, so each reply goes to the oldest call waiting for that
+    event whose matcher (if any) accepts it. Calls whose replies can't be
+    matched, like toasts, are `exclusive`: one at a time waits for the event.
+    Toasts don't name the playlist, so playlist edits are never pipelined,
+    not even edits to different playlists.
+    """
+
+    def __init__(
+        self,
+        sio: socketio.AsyncClient,
+        timeout: float = VOLUMIO_RESPONSE_TIMEOUT,
+        max_concurrency: int = VOLUMIO_MAX_CONCURRENCY,
+    ):
+        self.sio = sio
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._exclusive: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._subscribed: set[str] = set()
+        self._waiting: defaultdict[
+            str, deque[tuple[asyncio.Future[tuple], ReplyMatcher | None]]
+        ] = defaultdict(deque)
+        self._listeners: defaultdict[str, list[Callable[..., None]]] = defaultdict(list)
+
+    @classmethod
+    @asynccontextmanager
+    async def connect(
+        cls, url: str = DEFAULT_URL, **kwargs: Any
+    ) -> AsyncIterator["VolumioController"]:
+        controller = cls(socketio.AsyncClient(), **kwargs)
+        await controller.sio.connect(url)
+        try:
+            yield controller
+        finally:
+            await controller.disconnect()
+
+    @property
+    def connected(self) -> bool:
+        return self.sio.connected
+
+    async def ensure_connected(
+        self, url: str = DEFAULT_URL, retry_delay: float = CONNECT_RETRY_DELAY
+    ) -> None:
+        """Connect, retrying until Volumio is reachable.
+
+        Once connected, the client reconnects by itself if the connection drops.
+        """
+        while not self.connected:
+            try:
+                await self.sio.connect(url)
+            except socketio.exceptions.ConnectionError as e:
+                logger.warning(f"Could not connect to Volumio: {e}")
+                await asyncio.sleep(retry_delay)
+
+    async def disconnect(self) -> None:
+        await self.sio.disconnect()
+
+    def on(self, message: str, listener: Callable[..., None]) -> None:
+        """Call `listener` with every `message` event, e.g. `pushState`"""
+        self._subscribe(message)
+        self._listeners[message].append(listener)
+
+    def _subscribe(self, message: str) -> None:
+        if message in self._subscribed:
+            return
+        self._subscribed.add(message)
+
+        async def handler(*args):
+            self._dispatch(message, args)
+
+        self.sio.on(message, handler)
+
+    def _dispatch(self, message: str, args: tuple) -> None:
+        waiting = self._waiting[message]
+        for entry in waiting:
+            future, matcher = entry
+            if future.done() or (matcher is not None and not matcher(args)):
+                continue
+            future.set_result(args)
+            waiting.remove(entry)
+            break
+
+        # A failing listener must not keep the event from the others
+        for listener in self._listeners.get(message, []):
+            try:
+                listener(*args)
+            except Exception:
+                logger.exception(f"`{message}` listener {listener!r} failed")
+
+    async def call(
         self,
         message_out: str,
         message_in: str | None = None,
         data: Any = None,
         response_model: BaseModel | None = None,
+        matcher: ReplyMatcher | None = None,
+        exclusive: bool = False,
     ) -> BaseModel | tuple | None:
-        if message_in:
-            self._listen_for(message_in)
-
-        if data is None:
-            self._emit(message_out)
-        else:
-            self._emit(message_out, data)
+        # Waiting for the lock doesn't take one of the concurrent calls
+        lock = self._exclusive[message_in] if exclusive else contextlib.nullcontext()
+        async with lock, self._semaphore:
+            with time_volumio_call(message_out):
+                if not message_in:
+                    await self.sio.emit(message_out, data)
+                    return None
+
+                self._subscribe(message_in)
+                entry = (asyncio.get_running_loop().create_future(), matcher)
+                self._waiting[message_in].append(entry)
+                try:
+                    await self.sio.emit(message_out, data)
+                    response = await asyncio.wait_for(entry[0], self.timeout)
+                except asyncio.TimeoutError as e:  # noqa: UP041 - not an alias on 3.10
+                    raise VolumioTimeoutError(
+                        f"No `{message_in}` response from Volumio within {self.timeout} s."
+                    ) from e
+                finally:
+                    if entry in self._waiting[message_in]:
+                        self._waiting[message_in].remove(entry)
 
-        if not message_in:
-            return None
-
-        response = self._get_response(message_in)
         if response_model is not None:
             return response_model.parse_obj(response[0])
         return response
 
-    def list_playlists(self) -> list[str]:
-        result_obj: ResultList = self.call(
+    async def list_playlists(self) -> list[str]:
+        result_obj: ResultList = await self.call(
             message_out="listPlaylist",
             message_in="pushListPlaylist",
             response_model=ResultList,
@@ -61,36 +169,41 @@ class VolumioController:
         playlists = result_obj.__root__
         return playlists
 
-    def add_to_playlist(self, playlist: str, service: str, uri: str) -> ToastMessage:
-        return self.call(
+    async def add_to_playlist(
+        self, playlist: str, service: str, uri: str
+    ) -> ToastMessage:
+        return await self.call(
             message_out="addToPlaylist",
             message_in="pushToastMessage",
             data={"name": playlist, "service": service, "uri": uri},
             response_model=ToastMessage,
+            # Toasts don't say which call they answer
+            exclusive=True,
         )
 
-    def remove_from_playlist(
+    async def remove_from_playlist(
         self, playlist: str, service: str, uri: str
     ) -> ToastMessage:
-        return self.call(
+        return await self.call(
             message_out="removeFromPlaylist",
             message_in="pushToastMessage",
             data={"name": playlist, "service": service, "uri": uri},
             response_model=ToastMessage,
+            exclusive=True,
         )
 
     # TODO: use volumio REST API instead
-    def play(self):
-        return self.call(message_out="play")
+    async def play(self):
+        return await self.call(message_out="play")
 
     # also volumio REST API
-    def pause(self):
-        return self.call(message_out="pause")
+    async def pause(self):
+        return await self.call(message_out="pause")
 
     # also volumio REST API
     # TODO: model for response?
-    def get_state(self):
-        return self.call(message_out="getState", message_in="pushState")
+    async def get_state(self):
+        return await self.call(message_out="getState", message_in="pushState")
 
     # # also volumio REST API
     # def queue_track(self, track_spec: TrackSpec) -> ToastMessage:
@@ -102,29 +215,39 @@ class VolumioController:
 
     # also volumio REST API
     # TODO: other lists
-    def list_tracks(self, playlist: str) -> list[ListItem]:
-        result_obj: BrowseResponse = self.call(
+    async def list_tracks(self, playlist: str) -> list[ListItem]:
+        uri = f"playlists/{playlist}"
+        result_obj: BrowseResponse = await self.call(
             message_out="browseLibrary",
             message_in="pushBrowseLibrary",
-            data={"uri": f"playlists/{playlist}"},
+            data={"uri": uri},
             response_model=BrowseResponse,
+            matcher=lambda args: _browsed_uri(args) == uri,
         )
-        tracks = result_obj.navigation.lists[-1].items
+        tracks = result_obj.lists[-1]
         return tracks
 
     # Playlists are also created by adding a track to a non-existent playlist
-    def create_playlist(self, name: str):
-        return self.call(
+    async def create_playlist(self, name: str):
+        return await self.call(
             message_out="createPlaylist",
             message_in="pushCreatePlaylist",
             data={"name": name},
             response_model=VolumioResponse,
         )
 
-    def delete_playlist(self, name: str):
-        return self.call(
+    async def delete_playlist(self, name: str):
+        return await self.call(
             message_out="deletePlaylist",
             message_in="pushDeletePlaylist",
             data={"name": name},
             # response_model=VolumioResponse,
         )
+
+
+def _browsed_uri(args: tuple) -> str | None:
+    """URI of the list in a browse reply, if it says"""
+    try:
+        return args[0]["navigation"]["info"]["uri"]
+    except (IndexError, KeyError, TypeError):
+        return None
@@ -0,0 +1,128 @@
+"""Playlist rule matching
+
+All playlist patterns are compiled into one matcher, so each track title is
+scanned once to find every playlist it belongs to.
+
+Plain patterns match as substrings of the lowercased title. Patterns
+prefixed with `re:` are regular expressions and patterns prefixed with
+`word:` only match whole words; both ignore case.
+"""
+
+import re
+from collections.abc import Collection, Iterable, Mapping
+
+from .models import ListItem
+
+REGEX_PREFIX = "re:"
+WORD_PREFIX = "word:"
+
+
+class InvalidPatternError(ValueError):
+    pass
+
+
+class PlaylistMatcher:
+    def __init__(self, playlist_patterns: Mapping[str, Collection[str]]):
+        self.playlists = list(playlist_patterns)
+        self._automaton = _Automaton()
+        self._regexes: list[tuple[str, re.Pattern[str]]] = []
+
+        for playlist, patterns in playlist_patterns.items():
+            regex_parts: list[str] = []
+            for pattern in patterns:
+                if pattern.startswith(REGEX_PREFIX):
+                    regex = pattern.removeprefix(REGEX_PREFIX)
+                    try:
+                        re.compile(regex)
+                    except re.error as e:
+                        raise InvalidPatternError(
+                            f"Invalid pattern `{pattern}` for playlist "
+                            f"`{playlist}`: {e}."
+                        ) from e
+                    regex_parts.append(f"(?:{regex})")
+                elif pattern.startswith(WORD_PREFIX):
+                    word = pattern.removeprefix(WORD_PREFIX)
+                    regex_parts.append(rf"\b{re.escape(word)}\b")
+                else:
+                    self._automaton.add(pattern, playlist)
+
+            if regex_parts:
+                self._regexes.append(
+                    (playlist, re.compile("|".join(regex_parts), re.IGNORECASE))
+                )
+
+        self._automaton.build()
+
+    def match(self, title: str) -> set[str]:
+        """Get all playlists a title belongs to"""
+        playlists = self._automaton.search(title.lower())
+        for playlist, regex in self._regexes:
+            if playlist not in playlists and regex.search(title):
+                playlists.add(playlist)
+        return playlists
+
+    def filter(self, tracks: Iterable[ListItem]) -> dict[str, list[ListItem]]:
+        """Group tracks by the playlists they match, keeping their order"""
+        matches: dict[str, list[ListItem]] = {
+            playlist: [] for playlist in self.playlists
+        }
+        for track in tracks:
+            for playlist in self.match(track.title):
+                matches[playlist].append(track)
+        return matches
+
+
+class _Automaton:
+    """Aho-Corasick automaton finding all substring patterns in one pass"""
+
+    def __init__(self):
+        self.transitions: list[dict[str, int]] = [{}]
+        self.outputs: list[frozenset[str]] = [frozenset()]
+        self._pending_outputs: list[set[str]] = [set()]
+
+    def add(self, pattern: str, label: str) -> None:
+        state = 0
+        for char in pattern:
+            next_state = self.transitions[state].get(char)
+            if next_state is None:
+                next_state = len(self.transitions)
+                self.transitions.append({})
+                self._pending_outputs.append(set())
+                self.transitions[state][char] = next_state
+            state = next_state
+        self._pending_outputs[state].add(label)
+
+    def build(self) -> None:
+        """Compute failure links and merge outputs along them"""
+        n_states = len(self.transitions)
+        self.failures = [0] * n_states
+        outputs = self._pending_outputs
+
+        # Breadth-first, so failure targets are always finished before use
+        queue = list(self.transitions[0].values())
+        for state in queue:
+            for char, next_state in self.transitions[state].items():
+                failure = self.failures[state]
+                while failure and char not in self.transitions[failure]:
+                    failure = self.failures[failure]
+                target = self.transitions[failure].get(char, 0)
+                self.failures[next_state] = target if target != next_state else 0
+                outputs[next_state] |= outputs[self.failures[next_state]]
+                queue.append(next_state)
+
+        self.outputs = [frozenset(output) for output in outputs]
+
+    def search(self, text: str) -> set[str]:
+        transitions = self.transitions
+        failures = self.failures
+        outputs = self.outputs
+
+        found = set(outputs[0])
+        state = 0
+        for char in text:
+            while state and char not in transitions[state]:
+                state = failures[state]
+            state = transitions[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
@@ -0,0 +1,325 @@
+"""Timing metrics
+
+Latencies of Volumio, SoundCloud and Mixcloud calls, app requests and refresh
+stages are kept in histograms and served on `/metrics` in the Prometheus text
+format. Refresh usually runs in its own process, so each run also writes a
+summary with the duration of every stage to LAST_REFRESH_PATH, which the app
+serves next to the histograms.
+"""
+
+import contextvars
+import json
+import math
+import time
+from collections.abc import Iterator, Mapping, Sequence
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import httpx
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .constants import LAST_REFRESH_PATH
+
+# Upper bounds in seconds, from a cached page to a full crawl
+DEFAULT_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, math.inf,
+)  # fmt: skip
+# Starlette adds the charset
+CONTENT_TYPE = "text/plain; version=0.0.4"
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label values: count per bucket, sum and count
+        self._series: dict[tuple[str, ...], tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * len(self.buckets), [0.0, 0])
+        bucket_counts, totals = series
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                bucket_counts[index] += 1
+                break
+        totals[0] += value
+        totals[1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe how long the block takes, labelled with its outcome"""
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(time.perf_counter() - start, **labels, outcome=outcome)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, (bucket_counts, (total, count)) in sorted(self._series.items()):
+            labels = dict(zip(self.labelnames, key, strict=True))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts, strict=True):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                lines.append(
+                    f"{self.name}_bucket{_labels({**labels, 'le': le})} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+        return lines
+
+
+UPSTREAM_SECONDS = Histogram(
+    "volco_upstream_request_seconds",
+    "HTTP requests to Volumio, SoundCloud and Mixcloud.",
+    ["upstream", "outcome"],
+)
+VOLUMIO_CALL_SECONDS = Histogram(
+    "volco_volumio_call_seconds",
+    "Volumio socket.io calls, until their reply.",
+    ["call", "outcome"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "volco_http_request_seconds",
+    "App requests, until the response starts.",
+    ["route", "method", "status"],
+)
+REFRESH_STAGE_SECONDS = Histogram(
+    "volco_refresh_stage_seconds",
+    "Refresh stages, some per source or playlist.",
+    ["stage", "target", "outcome"],
+)
+HISTOGRAMS = (
+    UPSTREAM_SECONDS,
+    VOLUMIO_CALL_SECONDS,
+    HTTP_REQUEST_SECONDS,
+    REFRESH_STAGE_SECONDS,
+)
+
+
+class RefreshSummary:
+    """Stages and calls of one refresh run"""
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.stages: list[dict[str, Any]] = []
+        self.calls: dict[str, dict[str, float]] = {}
+
+    def add_call(self, name: str, seconds: float) -> None:
+        call = self.calls.setdefault(name, {"count": 0, "seconds": 0.0})
+        call["count"] += 1
+        call["seconds"] += seconds
+
+    def to_dict(self, duration: float, error: BaseException | None) -> dict[str, Any]:
+        return {
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration": duration,
+            "outcome": "ok" if error is None else "error",
+            "error": None if error is None else repr(error),
+            "stages": self.stages,
+            "calls": self.calls,
+        }
+
+
+_summary: contextvars.ContextVar[RefreshSummary | None] = contextvars.ContextVar(
+    "refresh_summary", default=None
+)
+
+
+@contextmanager
+def refresh_run(path: Path = LAST_REFRESH_PATH) -> Iterator[RefreshSummary]:
+    """Collect the stages of a refresh and write their summary at the end"""
+    summary = RefreshSummary()
+    token = _summary.set(summary)
+    start = time.perf_counter()
+    error: BaseException | None = None
+    try:
+        with span("refresh"):
+            yield summary
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        _summary.reset(token)
+        write_summary(summary.to_dict(time.perf_counter() - start, error), path)
+
+
+@contextmanager
+def span(stage: str, target: str = "") -> Iterator[None]:
+    """Time a refresh stage, `target` is the source or playlist it's about"""
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        REFRESH_STAGE_SECONDS.observe(
+            seconds, stage=stage, target=target, outcome=outcome
+        )
+        summary = _summary.get()
+        if summary is not None:
+            summary.stages.append(
+                {
+                    "stage": stage,
+                    "target": target,
+                    "seconds": seconds,
+                    "outcome": outcome,
+                }
+            )
+
+
+@contextmanager
+def time_volumio_call(call: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        with VOLUMIO_CALL_SECONDS.time(call=call):
+            yield
+    finally:
+        summary = _summary.get()
+        if summary is not None:
+            summary.add_call(call, time.perf_counter() - start)
+
+
+def write_summary(summary: Mapping[str, Any], path: Path = LAST_REFRESH_PATH) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(json.dumps(summary, indent=2))
+    tmp_path.replace(path)
+
+
+def load_summary(path: Path = LAST_REFRESH_PATH) -> dict[str, Any] | None:
+    try:
+        return json.loads(path.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def render_metrics(summary: Mapping[str, Any] | None = None) -> str:
+    """All histograms, and gauges for the last refresh if there's a summary"""
+    lines: list[str] = []
+    for histogram in HISTOGRAMS:
+        lines += histogram.render()
+
+    if summary is not None:
+        started_at = datetime.fromisoformat(summary["started_at"]).timestamp()
+        lines += [
+            "# HELP volco_last_refresh_timestamp_seconds Start of the last refresh.",
+            "# TYPE volco_last_refresh_timestamp_seconds gauge",
+            f"volco_last_refresh_timestamp_seconds {started_at}",
+            "# HELP volco_last_refresh_duration_seconds Duration of the last refresh.",
+            "# TYPE volco_last_refresh_duration_seconds gauge",
+            f"volco_last_refresh_duration_seconds {summary['duration']}",
+            "# HELP volco_last_refresh_success Whether the last refresh succeeded.",
+            "# TYPE volco_last_refresh_success gauge",
+            f"volco_last_refresh_success {int(summary['outcome'] == 'ok')}",
+            "# HELP volco_last_refresh_stage_seconds Stages of the last refresh.",
+            "# TYPE volco_last_refresh_stage_seconds gauge",
+        ]
+        # Stages that ran several times for the same target are added up
+        stage_seconds: dict[tuple[str, str], float] = {}
+        for stage in summary["stages"]:
+            key = (stage["stage"], stage["target"])
+            stage_seconds[key] = stage_seconds.get(key, 0.0) + stage["seconds"]
+        for (stage, target), seconds in sorted(stage_seconds.items()):
+            labels = _labels({"stage": stage, "target": target})
+            lines.append(f"volco_last_refresh_stage_seconds{labels} {seconds}")
+
+    return "\n".join(lines) + "\n"
+
+
+class TimedTransport(httpx.AsyncBaseTransport):
+    """Transport recording the latency of every request to an upstream"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, upstream: str):
+        self.transport = transport
+        self.upstream = upstream
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.perf_counter()
+        outcome = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            outcome = f"{response.status_code // 100}xx"
+            return response
+        finally:
+            UPSTREAM_SECONDS.observe(
+                time.perf_counter() - start, upstream=self.upstream, outcome=outcome
+            )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+class RequestTimingMiddleware:
+    """Time app requests until their response starts.
+
+    Event streams stay open for as long as a client listens, so the time
+    until the response starts is what's measured.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+
+        async def send_timed(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                HTTP_REQUEST_SECONDS.observe(
+                    time.perf_counter() - start,
+                    route=_route(scope),
+                    method=scope["method"],
+                    status=str(message["status"]),
+                )
+            await send(message)
+
+        await self.app(scope, receive, send_timed)
+
+
+def _route(scope: Scope) -> str:
+    """Path template of the route that handled a request, not the path itself"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Mounted apps extend the root path by their mount point
+    if scope.get("root_path"):
+        return f"{scope['root_path']}/{{path}}"
+    return "unmatched"
+
+
+def _labels(labels: Mapping[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
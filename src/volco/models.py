@@ -1,18 +1,28 @@
 import datetime
+import json
 import re
+import sys
+from collections.abc import Mapping
+from typing import Any, NamedTuple
 
 from pydantic import BaseModel, Extra
 
+# Fields every list item has
+_STR_FIELDS = ("service", "type", "title", "uri")
 
-class UriItem(BaseModel):
-    uri: str
 
+class ListItem(NamedTuple):
+    """Track or folder in a Volumio list.
+
+    Crawls and playlists make thousands of these, so they are tuples rather
+    than models. Build them with `parse_obj`, which strips the URI once.
+    """
 
-class ListItem(BaseModel):
     service: str
     type: str
     title: str
     uri: str
+    stripped_uri: str
     duration: int | None = None
     album: str | None = None
     artist: str | None = None
@@ -20,45 +30,72 @@ class ListItem(BaseModel):
     year: str | int | None = None
     icon: str | None = None
 
-    def __hash__(self):
-        return hash(self.service + self.uri)
-
-    @property
-    def stripped_uri(self):
-        return strip_uri(self.uri)
-
-    def strip_mixcloud_uri(self):
-        return
+    @classmethod
+    def parse_obj(cls, obj: Mapping[str, Any]) -> "ListItem":
+        try:
+            service, item_type, title, uri = (obj[field] for field in _STR_FIELDS)
+            # Anything else would only fail later, far from the reply
+            if not all(
+                type(value) is str for value in (service, item_type, title, uri)
+            ):
+                raise TypeError(f"{', '.join(_STR_FIELDS)} must be strings")
+            duration = obj.get("duration")
+            return cls(
+                # Few distinct values, shared by every item
+                sys.intern(service),
+                sys.intern(item_type),
+                title,
+                uri,
+                strip_uri(uri),
+                None if duration is None else int(duration),
+                obj.get("album"),
+                obj.get("artist"),
+                obj.get("albumart"),
+                obj.get("year"),
+                obj.get("icon"),
+            )
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            raise ValueError(f"Invalid list item {obj!r}: {e}") from e
+
+    @classmethod
+    def parse_raw(cls, data: str | bytes) -> "ListItem":
+        return cls.parse_obj(json.loads(data))
+
+    def json(self) -> str:
+        """Fields as JSON, without the stripped URI `parse_raw` recomputes"""
+        fields = self._asdict()
+        del fields["stripped_uri"]
+        return json.dumps(fields)
+
+
+_MIXCLOUD_URI = re.compile(r"^(mixcloud/)(.+)?(cloudcast@cloudcastId=[^@]+)(@.+)?$")
+_SOUNDCLOUD_URI = re.compile(r"^(soundcloud/)(.+)?(track@trackId=[^@]+)(@.+)?$")
 
 
 def strip_uri(uri):
     if uri is None:
         return None
     if uri.startswith("mixcloud"):
-        return re.sub(
-            r"^(mixcloud/)(.+)?(cloudcast@cloudcastId=[^@]+)(@.+)?$",
-            r"\1\3",
-            uri,
-        )
+        return _MIXCLOUD_URI.sub(r"\1\3", uri)
     if uri.startswith("soundcloud"):
-        return re.sub(r"^(soundcloud/)(.+)?(track@trackId=[^@]+)(@.+)?$", r"\1\3", uri)
+        return _SOUNDCLOUD_URI.sub(r"\1\3", uri)
     return uri
 
 
-class ListContainer(BaseModel):
-    title: str | None = None
-    availableListViews: list[str]
-    items: list[ListItem]
+class BrowseResponse(NamedTuple):
+    """Item lists of a Volumio browse response, the rest isn't used"""
 
+    lists: list[list[ListItem]]
 
-class Navigation(BaseModel):
-    prev: UriItem
-    lists: list[ListContainer]
-    info: ListItem
-
-
-class BrowseResponse(BaseModel):
-    navigation: Navigation
+    @classmethod
+    def parse_obj(cls, obj: Mapping[str, Any]) -> "BrowseResponse":
+        try:
+            lists = obj["navigation"]["lists"]
+            return cls(
+                [[ListItem.parse_obj(item) for item in lst["items"]] for lst in lists]
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError("Invalid browse response") from e
 
 
 class VolumioResponse(BaseModel):
@@ -91,6 +128,30 @@ class StateLog(BaseModel):
     state: State
 
 
+class ProgressCheckpoint(BaseModel):
+    """Aggregated state log contents up to a byte offset."""
+
+    offset: int = 0
+    inode: int | None = None
+    head_size: int = 0
+    head_digest: str = ""
+    max_seek_positions: dict[str, int] = {}
+    durations: dict[str, int] = {}
+
+
+class PlaylistTrack(BaseModel):
+    title: str
+    service: str
+    uri: str
+    progress: int
+
+
+class TrackPage(BaseModel):
+    tracks: list[PlaylistTrack]
+    next_cursor: str | None
+    total: int
+
+
 class PlaylistRules(BaseModel):
     __root__: dict[str, list[str]]
 
@@ -0,0 +1,260 @@
+"""Pages rendered by the app on request
+
+Playlist pages are rendered from the catalog and track progress, and kept in
+memory until their inputs change. Refresh runs in its own process, so its
+changes are noticed by the modification times of the catalog and progress
+files. Progress recorded by the app itself is merged in as it's written.
+
+Pages are rendered in worker threads, off the event loop, so requests go
+through a lock. Progress comes from the event loop and is only queued, to be
+merged by the next request.
+
+Long playlists are served in pages: the playlist page holds the first one and
+loads the rest from the tracks API as the list is scrolled.
+"""
+
+import base64
+import binascii
+import gzip
+import json
+import threading
+from collections import deque
+from collections.abc import Iterable
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+import jinja2
+
+from .catalog import Catalog
+from .constants import (
+    CATALOG_PATH,
+    PLAYLIST_TEMPLATE_HTML,
+    TEMPLATE_DIR,
+    TRACK_PAGE_SIZE,
+    TRACK_PROGRESS_PATH,
+)
+from .models import ListItem, PlaylistTrack, TrackPage, strip_uri
+from .renderer import (
+    aggregate_fields,
+    calculate_progress,
+    generate_filename,
+    playlist_page_digest,
+    render_playlist_page,
+)
+from .statelog import Sample
+
+
+class InvalidCursorError(ValueError):
+    pass
+
+
+class RenderedPage(NamedTuple):
+    content: bytes
+    gzipped: bytes
+    etag: str
+
+
+class ReloadingFile:
+    """File contents, read again once the file changes"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._mtime_ns: int | None = None
+        self._content = ""
+
+    def read(self) -> str:
+        mtime_ns = _mtime_ns(self.path)
+        if mtime_ns != self._mtime_ns:
+            self._content = self.path.read_text() if mtime_ns is not None else ""
+            self._mtime_ns = mtime_ns
+        return self._content
+
+    def invalidate(self) -> None:
+        self._mtime_ns = None
+
+
+class PlaylistPages:
+    def __init__(
+        self,
+        catalog_path: Path = CATALOG_PATH,
+        progress_path: Path = TRACK_PROGRESS_PATH,
+        template_dir: Path = TEMPLATE_DIR,
+    ):
+        self.catalog_path = catalog_path
+        self.progress_path = progress_path
+
+        # Templates only change with a new release, so compile them once
+        environment = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(template_dir), auto_reload=False
+        )
+        self.template = environment.get_template(PLAYLIST_TEMPLATE_HTML)
+
+        self._catalog_mtime_ns: int | None = None
+        self._progress_mtime_ns: int | None = None
+        self._playlists: dict[str, str] = {}
+        self._tracks: dict[str, list[ListItem]] = {}
+        self._progress: dict[str, int] = {}
+        self._pages: dict[str, RenderedPage] = {}
+        self._track_lists: dict[str, list[PlaylistTrack]] = {}
+        self._new_progress: deque[dict[str, int]] = deque()
+        self._lock = threading.Lock()
+
+    def resolve(self, name: str) -> str | None:
+        """Playlist shown at `name`, a playlist name or its page filename"""
+        with self._lock:
+            self._check_inputs()
+            return self._playlists.get(name)
+
+    def get(self, playlist: str) -> RenderedPage:
+        with self._lock:
+            self._check_inputs()
+            page = self._pages.get(playlist)
+            if page is None:
+                page = self._render(playlist)
+                self._pages[playlist] = page
+            return page
+
+    def track_page(
+        self, playlist: str, cursor: str | None = None, limit: int = TRACK_PAGE_SIZE
+    ) -> TrackPage:
+        with self._lock:
+            self._check_inputs()
+            track_list = self._track_list(playlist)
+        start = _decode_cursor(cursor, track_list) if cursor else 0
+        end = start + limit
+        return TrackPage(
+            tracks=track_list[start:end],
+            next_cursor=_encode_cursor(end, track_list),
+            total=len(track_list),
+        )
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._catalog_mtime_ns = self._progress_mtime_ns = None
+
+    def add_progress(self, samples: Iterable[Sample]) -> None:
+        """Queue progress from newly recorded samples, without waiting for renders"""
+        max_seek_positions, durations = aggregate_fields(
+            (sample.service, sample.uri, sample.seek, sample.duration)
+            for sample in samples
+        )
+        self._new_progress.append(calculate_progress(max_seek_positions, durations))
+
+    def _check_inputs(self) -> None:
+        catalog_mtime_ns = _mtime_ns(self.catalog_path)
+        if catalog_mtime_ns != self._catalog_mtime_ns:
+            self._load_catalog()
+            self._catalog_mtime_ns = catalog_mtime_ns
+            self._clear_rendered()
+
+        progress_mtime_ns = _mtime_ns(self.progress_path)
+        if progress_mtime_ns != self._progress_mtime_ns:
+            progress = self._load_progress()
+            # Keep live progress refresh hasn't picked up yet
+            for uri, value in self._progress.items():
+                progress[uri] = max(progress.get(uri, 0), value)
+            if progress != self._progress:
+                self._progress = progress
+                self._clear_rendered()
+            self._progress_mtime_ns = progress_mtime_ns
+
+        changed = False
+        while self._new_progress:
+            for uri, progress in self._new_progress.popleft().items():
+                if progress > self._progress.get(uri, 0):
+                    self._progress[uri] = progress
+                    changed = True
+        if changed:
+            self._clear_rendered()
+
+    def _load_catalog(self) -> None:
+        self._playlists.clear()
+        self._tracks.clear()
+        with Catalog(self.catalog_path) as catalog:
+            for playlist in catalog.playlists():
+                self._playlists[playlist] = playlist
+                self._playlists[generate_filename(playlist)] = playlist
+
+    def _load_tracks(self, playlist: str) -> list[ListItem]:
+        tracks = self._tracks.get(playlist)
+        if tracks is None:
+            with Catalog(self.catalog_path) as catalog:
+                tracks = catalog.playlist_tracks(playlist) or []
+            self._tracks[playlist] = tracks
+        return tracks
+
+    def _clear_rendered(self) -> None:
+        self._pages.clear()
+        self._track_lists.clear()
+
+    def _track_list(self, playlist: str) -> list[PlaylistTrack]:
+        track_list = self._track_lists.get(playlist)
+        if track_list is None:
+            track_list = [
+                # Built from validated tracks, so validation is skipped
+                PlaylistTrack.construct(
+                    title=track.title,
+                    service=track.service,
+                    uri=track.uri,
+                    progress=self._progress.get(track.stripped_uri, 0),
+                )
+                for track in self._load_tracks(playlist)
+            ]
+            self._track_lists[playlist] = track_list
+        return track_list
+
+    def _load_progress(self) -> dict[str, int]:
+        try:
+            return json.loads(self.progress_path.read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _render(self, playlist: str) -> RenderedPage:
+        tracks = self._load_tracks(playlist)
+        updated = datetime.fromtimestamp((self._catalog_mtime_ns or 0) / 1e9)
+        content = render_playlist_page(
+            title=playlist,
+            tracks=tracks[:TRACK_PAGE_SIZE],
+            track_progress=self._progress,
+            template=self.template,
+            ts=updated,
+            total=len(tracks),
+            next_cursor=_encode_cursor(TRACK_PAGE_SIZE, self._track_list(playlist)),
+        ).encode()
+
+        digest = playlist_page_digest(playlist, tracks, self._progress, "")
+        etag = f'"{digest[:32]}-{self._catalog_mtime_ns or 0:x}"'
+        return RenderedPage(content, gzip.compress(content, mtime=0), etag)
+
+
+def _encode_cursor(position: int, track_list: list[PlaylistTrack]) -> str | None:
+    """Cursor for the tracks from `position` on, None past the end"""
+    if position >= len(track_list):
+        return None
+    # The track is kept too, so paging continues right if the playlist changes
+    cursor = json.dumps([position, strip_uri(track_list[position].uri)])
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def _decode_cursor(cursor: str, track_list: list[PlaylistTrack]) -> int:
+    try:
+        position, uri = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor `{cursor}`.") from e
+    if not isinstance(position, int) or position < 0:
+        raise InvalidCursorError(f"Invalid cursor `{cursor}`.")
+
+    if position < len(track_list) and strip_uri(track_list[position].uri) == uri:
+        return position
+    for moved_position, track in enumerate(track_list):
+        if strip_uri(track.uri) == uri:
+            return moved_position
+    return min(position, len(track_list))
+
+
+def _mtime_ns(path: Path) -> int | None:
+    try:
+        return path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
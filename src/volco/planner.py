@@ -0,0 +1,158 @@
+"""Playlist sync planning
+
+A refresh decides what each playlist should contain, and the planner finds
+the fewest Volumio calls that get it there. Volumio can only append a track
+to a playlist or remove every entry with a given URI. So a playlist keeps
+the longest prefix of its target that is left once the other URIs are
+removed, and the rest of the target is appended. When deleting the playlist
+and adding the whole target takes fewer calls, the playlist is rewritten.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Sequence
+
+from .catalog import Catalog
+from .controller import VolumioController
+from .models import ListItem
+
+logger = logging.getLogger(__name__)
+
+
+class PlaylistPlan:
+    def __init__(
+        self,
+        playlist: str,
+        target: Sequence[ListItem],
+        remove: Sequence[ListItem] = (),
+        add: Sequence[ListItem] = (),
+        rewrite: bool = False,
+    ):
+        self.playlist = playlist
+        self.target = list(target)
+        self.remove = list(remove)
+        self.add = list(add)
+        self.rewrite = rewrite
+
+    @property
+    def call_count(self) -> int:
+        """Number of Volumio calls needed to apply the plan"""
+        return int(self.rewrite) + len(self.remove) + len(self.add)
+
+    def describe(self) -> str:
+        if self.rewrite:
+            summary = f"rewrite with {len(self.add)} tracks"
+        else:
+            summary = f"remove {len(self.remove)}, add {len(self.add)}"
+        lines = [f"Playlist `{self.playlist}`: {summary} ({self.call_count} calls)"]
+        lines += [f"  - {track.title}" for track in self.remove]
+        lines += [f"  + {track.title}" for track in self.add]
+        return "\n".join(lines)
+
+
+def plan_playlist(
+    playlist: str, current: Sequence[ListItem], target: Sequence[ListItem]
+) -> PlaylistPlan:
+    """Plan the calls turning `current` playlist contents into `target`"""
+    target_uris = [track.stripped_uri for track in target]
+    current_uris = [track.stripped_uri for track in current]
+
+    kept = _kept_prefix_length(current_uris, target_uris)
+    kept_uris = set(target_uris[:kept])
+    remove = _distinct(
+        track for track in current if track.stripped_uri not in kept_uris
+    )
+
+    add = target[kept:]
+    if target and 1 + len(target) < len(remove) + len(add):
+        return PlaylistPlan(playlist, target, add=target, rewrite=True)
+    return PlaylistPlan(playlist, target, remove=remove, add=add)
+
+
+def append_new(
+    current: Iterable[ListItem], tracks: Iterable[ListItem]
+) -> list[ListItem]:
+    """Tracks not in `current` yet, without duplicates"""
+    seen_uris = {track.stripped_uri for track in current}
+    new_tracks: list[ListItem] = []
+    for track in tracks:
+        if track.stripped_uri not in seen_uris:
+            seen_uris.add(track.stripped_uri)
+            new_tracks.append(track)
+    return new_tracks
+
+
+def deduplicate(tracks: Iterable[ListItem]) -> list[ListItem]:
+    """Keep the first copy of every track"""
+    return append_new([], tracks)
+
+
+async def apply_plan(
+    plan: PlaylistPlan, vc: VolumioController, catalog: Catalog | None = None
+) -> None:
+    # Calls stay sequential, Volumio rewrites the whole playlist file each time
+    try:
+        if plan.rewrite:
+            logger.info(f"Rewriting playlist `{plan.playlist}`.")
+            await vc.delete_playlist(plan.playlist)
+
+        for track in plan.remove:
+            logger.info(f"Removing `{track.title}` from playlist `{plan.playlist}`.")
+            await vc.remove_from_playlist(
+                plan.playlist, service=track.service, uri=track.uri
+            )
+
+        for track in plan.add:
+            logger.info(f"Adding `{track.title}` to playlist `{plan.playlist}`.")
+            await vc.add_to_playlist(
+                plan.playlist, service=track.service, uri=track.uri
+            )
+    except BaseException:
+        # The playlist is in an unknown state, browse it again next time
+        if catalog is not None:
+            catalog.delete_playlist(plan.playlist)
+        raise
+
+    if catalog is not None and (plan.remove or plan.add):
+        catalog.set_playlist_tracks(plan.playlist, plan.target)
+
+
+def _kept_prefix_length(current_uris: list[str], target_uris: list[str]) -> int:
+    """Length of the longest target prefix left by removing other URIs.
+
+    Removing a URI drops all its copies, so a prefix is kept when it takes
+    every copy of its URIs, in the order they are in the playlist.
+    """
+    positions: defaultdict[str, list[int]] = defaultdict(list)
+    for position, uri in enumerate(current_uris):
+        positions[uri].append(position)
+
+    # Copies of each prefix URI taken so far, and URIs with copies left over
+    taken: Counter[str] = Counter()
+    incomplete = 0
+    kept = 0
+    last_position = -1
+    for length, uri in enumerate(target_uris, start=1):
+        copies = positions.get(uri, ())
+        if taken[uri] == len(copies) or copies[taken[uri]] < last_position:
+            break
+        last_position = copies[taken[uri]]
+        if taken[uri] == 0:
+            incomplete += 1
+        taken[uri] += 1
+        if taken[uri] == len(copies):
+            incomplete -= 1
+        if not incomplete:
+            kept = length
+    return kept
+
+
+def _distinct(tracks: Iterable[ListItem]) -> list[ListItem]:
+    """One track per removal call, each call drops all copies"""
+    seen: set[tuple[str, str]] = set()
+    distinct: list[ListItem] = []
+    for track in tracks:
+        if (track.service, track.uri) not in seen:
+            seen.add((track.service, track.uri))
+            distinct.append(track)
+    return distinct
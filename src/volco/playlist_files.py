@@ -0,0 +1,115 @@
+"""Direct access to Volumio playlist files
+
+Volumio keeps every playlist as a JSON list of entries in one file named
+after the playlist. When volco runs on the Volumio box, playlists are read
+from and written to these files directly: a planned playlist is written in
+one go instead of one socket.io call per track.
+"""
+
+import asyncio
+import json
+import logging
+import shutil
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+from typing import Any
+
+from .catalog import Catalog
+from .constants import VOLUMIO_PLAYLIST_DIR
+from .controller import VolumioController
+from .models import ListItem, strip_uri
+from .planner import PlaylistPlan
+
+logger = logging.getLogger(__name__)
+
+# Fields Volumio stores for a playlist entry
+ENTRY_FIELDS = ("service", "uri", "title", "artist", "album", "albumart")
+
+
+class PlaylistFiles:
+    def __init__(
+        self,
+        directory: Path = VOLUMIO_PLAYLIST_DIR,
+        vc: VolumioController | None = None,
+    ):
+        self.directory = directory
+        self.vc = vc
+
+    async def list_playlists(self) -> list[str]:
+        return sorted(
+            path.name
+            for path in self.directory.iterdir()
+            if path.is_file() and not path.name.startswith(".")
+        )
+
+    async def list_tracks(self, playlist: str) -> list[ListItem]:
+        if not self._path(playlist).exists():
+            return []
+        return [_to_list_item(entry) for entry in self._read(playlist)]
+
+    async def apply_plans(
+        self, plans: Iterable[PlaylistPlan], catalog: Catalog | None = None
+    ) -> None:
+        """Write the target of every plan, then let Volumio know"""
+        if await asyncio.to_thread(self._write_plans, plans, catalog):
+            await self.reload()
+
+    def _write_plans(
+        self, plans: Iterable[PlaylistPlan], catalog: Catalog | None
+    ) -> int:
+        written = 0
+        for plan in plans:
+            if not plan.call_count:
+                continue
+            logger.info(
+                f"Writing playlist `{plan.playlist}` with {len(plan.target)} tracks."
+            )
+            self.write_tracks(plan.playlist, plan.target)
+            if catalog is not None:
+                catalog.set_playlist_tracks(plan.playlist, plan.target)
+            written += 1
+        return written
+
+    def write_tracks(self, playlist: str, tracks: Sequence[ListItem]) -> None:
+        """Replace the contents of a playlist, creating it if needed"""
+        path = self._path(playlist)
+        # Keep entries already in the file as they are, Volumio may add fields
+        existing: dict[str, dict[str, Any]] = {}
+        if path.exists():
+            for entry in self._read(playlist):
+                existing.setdefault(strip_uri(entry.get("uri")), entry)
+
+        entries = [
+            existing.get(track.stripped_uri) or _to_entry(track) for track in tracks
+        ]
+
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_text(json.dumps(entries))
+        if path.exists():
+            shutil.copymode(path, tmp_path)
+        tmp_path.replace(path)
+
+    async def reload(self) -> None:
+        """Have Volumio list playlists again so new files show up"""
+        if self.vc is None or not self.vc.connected:
+            return
+        # Volumio reads playlist files on every access, listing them is enough
+        await self.vc.list_playlists()
+
+    def _path(self, playlist: str) -> Path:
+        if not playlist or "/" in playlist or playlist.startswith("."):
+            raise ValueError(f"Invalid playlist name `{playlist}`.")
+        return self.directory / playlist
+
+    def _read(self, playlist: str) -> list[dict[str, Any]]:
+        return json.loads(self._path(playlist).read_text())
+
+
+def _to_list_item(entry: dict[str, Any]) -> ListItem:
+    # Entries in files have no type, browsing a playlist reports them as songs
+    return ListItem.parse_obj({"type": "song", **entry})
+
+
+def _to_entry(track: ListItem) -> dict[str, Any]:
+    entry = {field: getattr(track, field) for field in ENTRY_FIELDS}
+    return {field: value for field, value in entry.items() if value is not None}
@@ -0,0 +1,206 @@
+"""Incremental track progress aggregation
+
+The JSON state log grows by a line per minute of playback. Instead of
+re-parsing it in full on every refresh, the aggregated max seek positions and
+durations are persisted together with the byte offset they cover, so each run
+only parses the newly appended tail.
+
+Samples recorded since go to the compact state log, which is small and fast
+enough to aggregate in full on top of that. Merging keeps the highest seek,
+so samples converted from the JSON log into the compact one count once.
+"""
+
+import gzip
+import hashlib
+import logging
+import mmap
+import multiprocessing
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import IO
+
+from .constants import (
+    COMPACT_STATE_LOG_PATH,
+    PROGRESS_CHECKPOINT_PATH,
+    STATE_LOG_PATH,
+)
+from .models import ProgressCheckpoint
+from .renderer import aggregate_logs, calculate_progress
+from .statelog import CompactStateLog, aggregate_state_log, rotated_shards
+
+logger = logging.getLogger(__name__)
+
+# Number of leading bytes used to recognise a log file after rotation
+HEAD_SIZE = 256
+
+_SPAWN = multiprocessing.get_context("spawn")
+
+
+def update_progress(
+    log_path: Path = STATE_LOG_PATH,
+    checkpoint_path: Path = PROGRESS_CHECKPOINT_PATH,
+    compact_log_path: Path = COMPACT_STATE_LOG_PATH,
+) -> dict[str, int]:
+    """Merge new state log lines into the checkpoint and return track progress"""
+    checkpoint = load_checkpoint(checkpoint_path)
+    checkpoint = advance_checkpoint(checkpoint, log_path)
+    save_checkpoint(checkpoint, checkpoint_path)
+
+    max_seek_positions, durations = aggregate_state_log(
+        CompactStateLog(compact_log_path),
+        dict(checkpoint.max_seek_positions),
+        dict(checkpoint.durations),
+    )
+    return calculate_progress(max_seek_positions, durations)
+
+
+def load_checkpoint(path: Path) -> ProgressCheckpoint:
+    if not path.exists():
+        return ProgressCheckpoint()
+    try:
+        return ProgressCheckpoint.parse_file(path)
+    except ValueError:
+        logger.warning(f"Could not read progress checkpoint {path}, rebuilding.")
+        return ProgressCheckpoint()
+
+
+def save_checkpoint(checkpoint: ProgressCheckpoint, path: Path) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    tmp_path.write_text(checkpoint.json())
+    tmp_path.replace(path)
+
+
+def advance_checkpoint(
+    checkpoint: ProgressCheckpoint, log_path: Path
+) -> ProgressCheckpoint:
+    """Consume everything logged since the checkpoint was taken.
+
+    If the log was rotated, the rest of the previous file is read from its
+    rotated copy. If that copy can't be found, or the log was truncated,
+    the aggregate is rebuilt from all rotated shards and the current log.
+    """
+    if _is_same_file(checkpoint, log_path):
+        _consume(checkpoint, log_path)
+        return checkpoint
+
+    previous_file = _find_previous_file(checkpoint, log_path)
+    if previous_file is not None:
+        logger.info(f"State log was rotated, finishing {previous_file} first.")
+        _consume(checkpoint, previous_file, include_partial=True)
+        checkpoint.offset = 0
+    else:
+        logger.info("Rebuilding track progress from all state logs.")
+        max_seek_positions, durations = aggregate_files(rotated_shards(log_path))
+        checkpoint = ProgressCheckpoint(
+            max_seek_positions=max_seek_positions, durations=durations
+        )
+
+    checkpoint.inode = None
+    checkpoint.head_size = 0
+    checkpoint.head_digest = ""
+    if log_path.exists():
+        _consume(checkpoint, log_path)
+
+    return checkpoint
+
+
+def aggregate_files(
+    paths: Sequence[Path],
+) -> tuple[dict[str, int], dict[str, int]]:
+    """Aggregate whole log files, in parallel if there are several.
+
+    Files are merged in the given order, so durations from later files win.
+    """
+    if len(paths) > 1:
+        # Workers are spawned, the app may be the one calling, and forking a
+        # process with threads running can deadlock the child
+        with ProcessPoolExecutor(mp_context=_SPAWN) as executor:
+            results = list(executor.map(aggregate_file, paths))
+    else:
+        results = [aggregate_file(path) for path in paths]
+
+    max_seek_positions: dict[str, int] = {}
+    durations: dict[str, int] = {}
+    for file_max_seek_positions, file_durations in results:
+        for uri, seek in file_max_seek_positions.items():
+            max_seek_positions[uri] = max(seek, max_seek_positions.get(uri, 0))
+        durations.update(file_durations)
+
+    return max_seek_positions, durations
+
+
+def aggregate_file(path: Path) -> tuple[dict[str, int], dict[str, int]]:
+    if path.suffix == ".gz":
+        with gzip.open(path, "rb") as f:
+            return aggregate_logs(f)
+
+    with path.open("rb") as f:
+        if path.stat().st_size == 0:
+            return {}, {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return aggregate_logs(mm)
+
+
+def _consume(
+    checkpoint: ProgressCheckpoint, path: Path, include_partial: bool = False
+) -> None:
+    with _open_log(path) as f:
+        f.seek(checkpoint.offset)
+        aggregate_logs(
+            _read_lines(f, checkpoint, include_partial),
+            checkpoint.max_seek_positions,
+            checkpoint.durations,
+        )
+
+    if path.suffix != ".gz":
+        checkpoint.inode = path.stat().st_ino
+        checkpoint.head_size = min(HEAD_SIZE, checkpoint.offset)
+        checkpoint.head_digest = _head_digest(path, checkpoint.head_size)
+
+
+def _read_lines(
+    f: IO[bytes], checkpoint: ProgressCheckpoint, include_partial: bool
+) -> Iterator[str]:
+    """Yield lines while advancing the checkpoint offset past them.
+
+    A trailing line without a newline may still be being written, so it is
+    left for the next run unless `include_partial` is set.
+    """
+    for line in f:
+        if not line.endswith(b"\n") and not include_partial:
+            break
+        checkpoint.offset += len(line)
+        yield line.decode(errors="replace")
+
+
+def _is_same_file(checkpoint: ProgressCheckpoint, log_path: Path) -> bool:
+    if checkpoint.inode is None or not log_path.exists():
+        return False
+    stat = log_path.stat()
+    return (
+        stat.st_ino == checkpoint.inode
+        and stat.st_size >= checkpoint.offset
+        and _head_digest(log_path, checkpoint.head_size) == checkpoint.head_digest
+    )
+
+
+def _find_previous_file(checkpoint: ProgressCheckpoint, log_path: Path) -> Path | None:
+    """Find the rotated copy of the file the checkpoint was taken from"""
+    if checkpoint.offset == 0:
+        return None
+    for shard in reversed(rotated_shards(log_path)):
+        if _head_digest(shard, checkpoint.head_size) == checkpoint.head_digest:
+            return shard
+    return None
+
+
+def _head_digest(path: Path, size: int) -> str:
+    with _open_log(path) as f:
+        return hashlib.sha1(f.read(size)).hexdigest()
+
+
+def _open_log(path: Path) -> IO[bytes]:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rb")
+    return path.open("rb")
@@ -0,0 +1,141 @@
+"""Playback state recorder
+
+Listens to Volumio `pushState` events on the shared controller and appends
+playing states to the compact state log, replacing the per-minute curl script.
+
+Samples are collapsed per listening session (uninterrupted playback of one
+URI) to the one with the highest seek position, and written in batches.
+"""
+
+import asyncio
+import contextlib
+import logging
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import pydantic
+
+from .constants import (
+    COMPACT_STATE_LOG_PATH,
+    STATE_FLUSH_INTERVAL,
+    STATE_POLL_INTERVAL,
+)
+from .controller import VolumioController
+from .models import State
+from .statelog import CompactStateLog, Sample
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the poll and flush timers
+TICK_INTERVAL = 1
+
+
+class StateRecorder:
+    def __init__(
+        self,
+        vc: VolumioController,
+        log_path: Path = COMPACT_STATE_LOG_PATH,
+        poll_interval: float = STATE_POLL_INTERVAL,
+        flush_interval: float = STATE_FLUSH_INTERVAL,
+    ):
+        self.vc = vc
+        self.log = CompactStateLog(log_path)
+        self.poll_interval = poll_interval
+        self.flush_interval = flush_interval
+
+        self._task: asyncio.Task[None] | None = None
+        self._flush_listeners: list[Callable[[list[Sample]], None]] = []
+
+        # Best sample of the session in progress and whether it's been written
+        self._session: Sample | None = None
+        self._session_dirty = False
+        # Best samples of finished sessions waiting for the next flush
+        self._pending: list[Sample] = []
+
+    def start(self) -> None:
+        self.vc.on("pushState", self.record)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        self.flush()
+
+    def add_flush_listener(self, listener: Callable[[list[Sample]], None]) -> None:
+        """Call `listener` with the samples written by every flush"""
+        self._flush_listeners.append(listener)
+
+    def record(self, data: dict[str, Any]) -> None:
+        """Handle a state pushed by Volumio"""
+        try:
+            state = State.parse_obj(data)
+        except pydantic.error_wrappers.ValidationError:
+            logger.debug("Ignoring incomplete player state.")
+            return
+
+        if state.status != "play":
+            self._end_session()
+            return
+
+        sample = Sample(
+            int(time.time()),
+            state.service,
+            state.uri,
+            state.seek,
+            state.duration,
+            state.status,
+        )
+        if self._session is not None and self._session.uri == sample.uri:
+            if sample.seek > self._session.seek:
+                self._session = sample
+                self._session_dirty = True
+            return
+
+        self._end_session()
+        self._session = sample
+        self._session_dirty = True
+
+    def flush(self) -> None:
+        """Append collected samples to the state log"""
+        samples = self._pending
+        self._pending = []
+        if self._session is not None and self._session_dirty:
+            samples.append(self._session)
+            self._session_dirty = False
+
+        if not samples:
+            return
+
+        self.log.append(samples)
+        logger.debug(f"Recorded {len(samples)} playback samples.")
+
+        for listener in self._flush_listeners:
+            listener(samples)
+
+    def _end_session(self) -> None:
+        if self._session is not None and self._session_dirty:
+            self._pending.append(self._session)
+        self._session = None
+        self._session_dirty = False
+
+    async def _run(self) -> None:
+        last_poll = last_flush = 0.0
+        while True:
+            now = time.monotonic()
+            if now - last_poll >= self.poll_interval and self.vc.connected:
+                # Volumio only pushes on changes, so ask for the seek position
+                try:
+                    await self.vc.call("getState")
+                except Exception as e:
+                    logger.warning(f"Could not poll Volumio state: {e}")
+                last_poll = now
+            if now - last_flush >= self.flush_interval:
+                self.flush()
+                last_flush = now
+
+            await asyncio.sleep(TICK_INTERVAL)
@@ -1,33 +1,130 @@
+import hashlib
+import json
 import logging
+import mmap
 from collections.abc import Iterable, Mapping, Sequence
 from datetime import datetime
+from typing import Any
 
 import jinja2
 import pydantic
+from pydantic.datetime_parse import datetime_re
 
 from volco.models import ListItem, StateLog, strip_uri
 
 logger = logging.getLogger(__name__)
 
 
-def extract_progress(logs: Iterable[str]) -> dict[str, int]:
-    max_seek_positions: dict[str, int] = {}
-    durations: dict[str, int] = {}
+PROGRESS_SERVICES = frozenset({"mixcloud", "soundcloud"})
 
-    # Extract max seek position for each URI
-    for line in logs:
-        try:
-            log = StateLog.parse_raw(line)
-        except pydantic.error_wrappers.ValidationError:
-            continue
+LogLines = Iterable[str] | Iterable[bytes] | mmap.mmap
 
-        if log.state.service not in {"mixcloud", "soundcloud"}:
-            continue
 
-        uri = strip_uri(log.state.uri)
-        max_seek_positions[uri] = max(log.state.seek, max_seek_positions.get(uri, 0))
-        durations[uri] = log.state.duration
+def extract_progress(logs: LogLines) -> dict[str, int]:
+    max_seek_positions, durations = aggregate_logs(logs)
+    return calculate_progress(max_seek_positions, durations)
+
+
+def aggregate_logs(
+    logs: LogLines,
+    max_seek_positions: dict[str, int] | None = None,
+    durations: dict[str, int] | None = None,
+) -> tuple[dict[str, int], dict[str, int]]:
+    """Merge state log lines into max seek positions and durations per URI.
+
+    Lines are streamed, so `logs` can be a file, a generator or a memory-mapped
+    file. Existing aggregates can be passed in to continue from a previous run.
+    """
+    if isinstance(logs, mmap.mmap):
+        logs = iter(logs.readline, b"")
+
+    fields = (decode_progress_fields(line) for line in logs)
+    return aggregate_fields(
+        (sample for sample in fields if sample is not None),
+        max_seek_positions,
+        durations,
+    )
+
+
+def aggregate_fields(
+    samples: Iterable[tuple[str, str, int, int]],
+    max_seek_positions: dict[str, int] | None = None,
+    durations: dict[str, int] | None = None,
+) -> tuple[dict[str, int], dict[str, int]]:
+    """Merge (service, URI, seek, duration) samples per stripped URI.
+
+    The highest seek position and the last duration seen are kept.
+    """
+    max_seek_positions = {} if max_seek_positions is None else max_seek_positions
+    durations = {} if durations is None else durations
+    stripped_uris: dict[str, str] = {}
+
+    # Extract max seek position for each URI
+    for service, uri, seek, duration in samples:
+        if service not in PROGRESS_SERVICES:
+            continue
 
+        stripped_uri = stripped_uris.get(uri)
+        if stripped_uri is None:
+            stripped_uri = stripped_uris[uri] = strip_uri(uri)
+
+        max_seek_positions[stripped_uri] = max(
+            seek, max_seek_positions.get(stripped_uri, 0)
+        )
+        durations[stripped_uri] = duration
+
+    return max_seek_positions, durations
+
+
+def decode_progress_fields(line: str | bytes) -> tuple[str, str, int, int] | None:
+    """Get service, URI, seek and duration from a state log line.
+
+    Well-formed lines are decoded without building a `StateLog`, anything
+    else goes through the validated model, so the outcome is the same.
+    Returns None for lines that are not valid state logs.
+    """
+    try:
+        log = json.loads(line)
+        state = log["state"]
+        service = state["service"]
+        uri = state["uri"]
+        seek = state["seek"]
+        duration = state["duration"]
+        if (
+            type(service) is str
+            and type(uri) is str
+            and type(seek) is int
+            and type(duration) is int
+            and type(state["status"]) is str
+            and type(state["title"]) is str
+            and type(state["artist"]) is str
+            and _is_timestamp(log["ts"])
+        ):
+            return service, uri, seek, duration
+    except json.JSONDecodeError:
+        return None
+    except (KeyError, TypeError, ValueError):
+        pass
+
+    try:
+        state_log = StateLog.parse_raw(line)
+    except pydantic.error_wrappers.ValidationError:
+        return None
+    state = state_log.state
+    return state.service, state.uri, state.seek, state.duration
+
+
+def _is_timestamp(value: Any) -> bool:
+    """Whether `StateLog` would accept the value as is"""
+    if type(value) is not str or not datetime_re.match(value):
+        return False
+    datetime.fromisoformat(value)
+    return True
+
+
+def calculate_progress(
+    max_seek_positions: Mapping[str, int], durations: Mapping[str, int]
+) -> dict[str, int]:
     # Calculate progress percentage
     progress: dict[str, int] = {}
     for uri, duration in durations.items():
@@ -50,9 +147,13 @@ def render_playlist_page(
     tracks: Sequence[ListItem],
     track_progress: Mapping[str, int],
     template: jinja2.Template,
+    ts: datetime | None = None,
+    total: int | None = None,
+    next_cursor: str | None = None,
 ) -> str:
+    """Render a playlist page, with `next_cursor` for the tracks not on it"""
     track_data = [
-        {**track.dict(), "progress": track_progress.get(track.stripped_uri, 0)}
+        {**track._asdict(), "progress": track_progress.get(track.stripped_uri, 0)}
         for track in tracks
     ]
 
@@ -60,13 +161,40 @@ def render_playlist_page(
         {
             "playlist_name": title,
             "tracks": track_data,
-            "ts": datetime.now(),
+            "ts": ts or datetime.now(),
+            "total": len(tracks) if total is None else total,
+            "next_cursor": next_cursor,
         }
     )
 
     return rendered
 
 
+def playlist_page_digest(
+    title: str,
+    tracks: Sequence[ListItem],
+    track_progress: Mapping[str, int],
+    template_digest: str,
+) -> str:
+    """Hash of everything a playlist page shows except its timestamp"""
+    digest = hashlib.sha256(f"{template_digest}\0{title}".encode())
+    for track in tracks:
+        progress = track_progress.get(track.stripped_uri, 0)
+        digest.update(f"\0{track!r}\0{progress}".encode())
+    return digest.hexdigest()
+
+
+def template_digest(environment: jinja2.Environment, name: str) -> str:
+    source, _, _ = environment.loader.get_source(environment, name)
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def generate_filename(name: str) -> str:
+    name = name.replace(" ", "_")
+    name = name.replace(",", "_")
+    return f"{name}.html"
+
+
 def render_index_file(
     playlist_files: Mapping[str, str],
     template: jinja2.Template,
@@ -5,10 +5,14 @@ https://github.com/patrickkfkan/soundcloud-fetch/blob/3cca5ead28bd84d59a1da7fd93
 https://github.com/Tenpi/soundcloud.ts/blob/3cd9b864412e485aa7a8c3885d0695cc10f3485e/API.ts  # noqa: E501
 """
 
+import asyncio
 import re
 
 import httpx
 
+from .cache import PersistentCache
+from .constants import SC_CLIENT_ID_CACHE_PATH, SC_CLIENT_ID_TTL
+
 WEB_URL = "https://soundcloud.com"
 MOBILE_URL = "https://m.soundcloud.com"
 
@@ -26,11 +30,35 @@ HEADERS = {
 }
 
 
+_cache = PersistentCache(SC_CLIENT_ID_CACHE_PATH, ttl=SC_CLIENT_ID_TTL)
+_refresh_lock = asyncio.Lock()
+
+
 async def get_client_id(client: httpx.AsyncClient) -> str:
-    try:
-        return await get_client_id_web(client)
-    except RuntimeError:
-        return await get_client_id_mobile(client)
+    """Get a cached client ID, or look up a new one"""
+    client_id = _cache.get("client_id")
+    if client_id is not None:
+        return client_id
+
+    # Only one lookup at a time, the others wait for its result
+    async with _refresh_lock:
+        client_id = _cache.get("client_id")
+        if client_id is not None:
+            return client_id
+
+        try:
+            client_id = await get_client_id_web(client)
+        except RuntimeError:
+            client_id = await get_client_id_mobile(client)
+
+        _cache.set("client_id", client_id)
+        return client_id
+
+
+def invalidate_client_id(client_id: str) -> None:
+    """Forget a client ID rejected by the API, unless it was already replaced"""
+    if _cache.get("client_id") == client_id:
+        _cache.delete("client_id")
 
 
 async def get_client_id_web(client: httpx.AsyncClient) -> str:
@@ -41,18 +69,33 @@ async def get_client_id_web(client: httpx.AsyncClient) -> str:
     if not script_url_matches:
         raise RuntimeError("Could not find script URLs")
 
-    for script_url_match in script_url_matches:
-        url = script_url_match.group()
-        response = await client.get(url)
+    # Fetch all scripts at once, first one with a client ID wins
+    tasks = [
+        asyncio.create_task(_find_client_id_in_script(client, match.group()))
+        for match in script_url_matches
+    ]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            client_id = await next_done
+            if client_id is not None:
+                return client_id
+    finally:
+        for task in tasks:
+            task.cancel()
 
-        client_id_match = re.search(CLIENT_ID_PATTERN_WEB, response.text)
-        if not client_id_match:
-            continue
-        client_id = client_id_match.group(1)
+    raise RuntimeError("Could not find client ID in script URLs")
 
-        return client_id
 
-    raise RuntimeError("Could not find client ID in script URLs")
+async def _find_client_id_in_script(client: httpx.AsyncClient, url: str) -> str | None:
+    try:
+        response = await client.get(url)
+    except httpx.HTTPError:
+        return None
+
+    client_id_match = re.search(CLIENT_ID_PATTERN_WEB, response.text)
+    if not client_id_match:
+        return None
+    return client_id_match.group(1)
 
 
 async def get_client_id_mobile(client: httpx.AsyncClient) -> str:
@@ -0,0 +1,207 @@
+"""Resident refresh scheduler
+
+Runs refresh in a long-lived process, the app or `refresh-scheduler`, instead
+of a fresh process from cron, so the socket.io connection and HTTP clients
+stay open between runs. In the app, catalog, matching and rendering work runs
+in threads, so requests are still served during a refresh.
+
+Every source is checked on its own schedule, estimated from when its new
+tracks showed up before. NTS accounts publish once a week, so each one is left
+alone until its next show is due, then checked less and less often the longer
+it's overdue. Playlists and pages are only updated when a check finds new
+tracks.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import logging
+import statistics
+import time
+from collections.abc import Sequence
+from datetime import datetime
+
+import httpx
+
+from .catalog import Catalog
+from .clients import create_client
+from .constants import (
+    PLAYLIST_BACKEND,
+    PLAYLIST_PATTERN_PATH,
+    PUBLICATION_GAP,
+    PUBLICATION_HISTORY,
+    SOURCE_DEFAULT_INTERVAL,
+    SOURCE_EARLY_CHECK,
+    SOURCE_MAX_INTERVAL,
+    SOURCE_MIN_INTERVAL,
+    TRACK_SOURCES,
+    VOLUMIO_TIMEOUT,
+)
+from .controller import VolumioController
+from .metrics import refresh_run
+from .playlist_files import PlaylistFiles
+from .updater import find_candidate_tracks, refresh_lock, update_pages, update_playlists
+
+logger = logging.getLogger(__name__)
+
+# Longest sleep between looking for due sources, in seconds
+TICK_INTERVAL = 60
+
+
+class RefreshScheduler:
+    def __init__(
+        self,
+        vc: VolumioController,
+        client: httpx.AsyncClient,
+        sources: Sequence[str] = TRACK_SOURCES,
+        backend: str = PLAYLIST_BACKEND,
+    ):
+        self.vc = vc
+        self.client = client
+        self.playlist_files = PlaylistFiles(vc=vc) if backend == "files" else None
+        # Epoch time each source is checked next, all of them right away
+        self.next_checks = dict.fromkeys(sources, 0.0)
+
+        self._task: asyncio.Task[None] | None = None
+        # New tracks were found but playlists or pages failed to update
+        self._stale = False
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def run(self) -> None:
+        while True:
+            now = time.time()
+            due = [source for source, at in self.next_checks.items() if at <= now]
+            if due and self.vc.connected:
+                await self.check(due)
+
+            delay = min(self.next_checks.values()) - time.time()
+            await asyncio.sleep(min(max(delay, 1), TICK_INTERVAL))
+
+    async def check(self, sources: Sequence[str]) -> None:
+        """Browse sources, update playlists and pages if they have new tracks"""
+        with refresh_lock() as locked:
+            if not locked:
+                logger.info("Another refresh is running, checking sources later.")
+                self._postpone(sources)
+                return
+
+            try:
+                with refresh_run(), await asyncio.to_thread(Catalog) as catalog:
+                    await self._check(sources, catalog)
+            except Exception as e:
+                logger.warning(f"Could not check {', '.join(sources)}: {e}")
+                self._postpone(sources)
+
+    async def _check(self, sources: Sequence[str], catalog: Catalog) -> None:
+        feed_tracks, new_tracks = await find_candidate_tracks(
+            catalog, self.client, sources=sources
+        )
+        checked_at = time.time()
+        for source in sources:
+            self.next_checks[source] = next_check_time(
+                catalog.first_seen_times(source), checked_at
+            )
+            logger.info(
+                f"Checking {source} next at "
+                f"{datetime.fromtimestamp(self.next_checks[source]):%Y-%m-%d %H:%M}."
+            )
+
+        if not new_tracks and not self._stale:
+            return
+
+        # Tracks are in the catalog now, so they won't be new next time
+        self._stale = True
+        playlist_patterns = json.loads(PLAYLIST_PATTERN_PATH.read_text())
+        await update_playlists(
+            feed_tracks,
+            playlist_patterns=playlist_patterns,
+            vc=self.vc,
+            catalog=catalog,
+            client=self.client,
+            playlist_files=self.playlist_files,
+        )
+        await update_pages(self.vc, catalog, self.playlist_files)
+        self._stale = False
+
+    def _postpone(self, sources: Sequence[str]) -> None:
+        for source in sources:
+            self.next_checks[source] = time.time() + SOURCE_MIN_INTERVAL
+
+
+def next_check_time(first_seen: Sequence[datetime], checked_at: float) -> float:
+    """When to check a source next, from the times its new tracks were seen.
+
+    The next publication is expected a median gap between publications after
+    the last one. Checks start SOURCE_EARLY_CHECK before that and back off
+    the more overdue it is.
+    """
+    publications = _publications(first_seen)
+    if len(publications) < 2:
+        return checked_at + SOURCE_DEFAULT_INTERVAL
+
+    gaps = [newer - older for newer, older in itertools.pairwise(publications)]
+    start = publications[0] + statistics.median(gaps) - SOURCE_EARLY_CHECK
+    if checked_at < start:
+        return min(start, checked_at + SOURCE_MAX_INTERVAL)
+
+    interval = (checked_at - start) / 4
+    return checked_at + min(max(interval, SOURCE_MIN_INTERVAL), SOURCE_MAX_INTERVAL)
+
+
+def _publications(first_seen: Sequence[datetime]) -> list[float]:
+    """Epoch times of the latest publications, newest first"""
+    publications: list[float] = []
+    for seen_at in first_seen:
+        ts = seen_at.timestamp()
+        if publications and publications[-1] - ts < PUBLICATION_GAP:
+            # Part of the same publication, which started earlier
+            publications[-1] = ts
+        elif len(publications) == PUBLICATION_HISTORY:
+            break
+        else:
+            publications.append(ts)
+    return publications
+
+
+async def serve(backend: str = PLAYLIST_BACKEND) -> None:
+    async with (
+        VolumioController.connect() as vc,
+        create_client(VOLUMIO_TIMEOUT, "volumio") as client,
+    ):
+        await RefreshScheduler(vc, client, backend=backend).run()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Refresh playlists and pages whenever sources publish."
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["files", "socketio"],
+        default=PLAYLIST_BACKEND,
+        help="edit playlist files directly or go through Volumio's socket.io API",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        filename="logs/refresh.log",
+    )
+    asyncio.run(serve(args.backend))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,51 +1,221 @@
+import asyncio
+import hashlib
 import logging
-from collections.abc import Callable, Collection
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Collection, Sequence, Set
 from functools import partial
+from typing import Any
 
 import httpx
 
-from .constants import VOLUMIO_API_URL
+from .clients import create_client
+from .constants import (
+    BROWSE_CONCURRENCY,
+    FEED_FINGERPRINT_SIZE,
+    VOLUMIO_API_URL,
+    VOLUMIO_TIMEOUT,
+)
+from .metrics import span
 from .models import BrowseResponse, ListItem
 
 logger = logging.getLogger(__name__)
 
-StopCondition = Callable[[Collection[ListItem]], bool]
 
+class StopCondition(ABC):
+    """Decides when to stop paging through a list.
 
-def stop_on_max_tracks(tracks: Collection[ListItem], max_tracks: int = 1000) -> bool:
-    return len(tracks) > max_tracks
+    It is fed only the tracks added by each new page (starting with an empty
+    one before the first request), so every crawl needs a fresh instance.
+    """
 
+    @abstractmethod
+    def update(self, new_tracks: Collection[ListItem]) -> bool:
+        """Whether to stop after a page with these new tracks"""
 
-def stop_on_overlap(
-    tracks: Collection[ListItem],
-    existing_tracks: Collection[ListItem],
-    min_overlap: int = 1,
-) -> bool:
-    track_uris = set(t.stripped_uri for t in tracks)
-    existing_track_uris = set(t.stripped_uri for t in existing_tracks)
-    overlap = set(track_uris).intersection(existing_track_uris)
-    return len(overlap) >= min_overlap
+
+# Called once per crawl, e.g. `partial(StopOnOverlap, existing_uris)`
+StopConditionFactory = Callable[[], StopCondition]
+
+
+class StopOnMaxTracks(StopCondition):
+    def __init__(self, max_tracks: int = 1000):
+        self.max_tracks = max_tracks
+        self.n_tracks = 0
+
+    def update(self, new_tracks: Collection[ListItem]) -> bool:
+        self.n_tracks += len(new_tracks)
+        return self.n_tracks > self.max_tracks
+
+
+class StopOnAny(StopCondition):
+    """Stops as soon as any of the conditions made by `factories` does"""
+
+    def __init__(self, *factories: StopConditionFactory):
+        self.conditions = [factory() for factory in factories]
+
+    def update(self, new_tracks: Collection[ListItem]) -> bool:
+        # Every condition has to see every page
+        return any([condition.update(new_tracks) for condition in self.conditions])
+
+
+class StopOnFingerprint(StopCondition):
+    """Stops when the first tracks of a list match an earlier crawl's.
+
+    A feed whose newest tracks are unchanged has nothing new further down, so
+    it is left after its first page.
+    """
+
+    def __init__(self, fingerprint: str | None, size: int = FEED_FINGERPRINT_SIZE):
+        self.fingerprint = fingerprint
+        self.size = size
+        self.first_tracks: list[ListItem] = []
+
+    def update(self, new_tracks: Collection[ListItem]) -> bool:
+        if len(self.first_tracks) < self.size:
+            self.first_tracks += list(new_tracks)[: self.size - len(self.first_tracks)]
+        return (
+            self.fingerprint is not None
+            and feed_fingerprint(self.first_tracks, self.size) == self.fingerprint
+        )
+
+
+class StopOnOverlap(StopCondition):
+    """Stops once a list reaches tracks seen before.
+
+    That is `min_overlap` known tracks, or the high water mark: the newest
+    track of the list when it was last crawled, everything after it is known.
+    """
+
+    def __init__(
+        self,
+        existing_uris: Set[str],
+        min_overlap: int = 1,
+        high_water_uri: str | None = None,
+    ):
+        self.existing_uris = existing_uris
+        self.min_overlap = min_overlap
+        self.high_water_uri = high_water_uri
+        self.overlap: set[str] = set()
+        self.reached_high_water_mark = False
+
+    def update(self, new_tracks: Collection[ListItem]) -> bool:
+        for track in new_tracks:
+            if track.stripped_uri == self.high_water_uri:
+                self.reached_high_water_mark = True
+            if track.stripped_uri in self.existing_uris:
+                self.overlap.add(track.stripped_uri)
+        return self.reached_high_water_mark or len(self.overlap) >= self.min_overlap
+
+
+def feed_fingerprint(
+    tracks: Sequence[ListItem], size: int = FEED_FINGERPRINT_SIZE
+) -> str | None:
+    """Digest of the first `size` tracks of a list, None if it's shorter"""
+    if len(tracks) < size:
+        return None
+    uris = "\n".join(track.stripped_uri for track in tracks[:size])
+    return hashlib.sha1(uris.encode()).hexdigest()
 
 
 def browse_tracks(
-    uri: str, stop_condition: StopCondition | None = None
+    uri: str, stop_condition: StopConditionFactory | None = None
 ) -> list[ListItem]:
     if stop_condition is None:
-        stop_condition = partial(stop_on_max_tracks, max_tracks=5000)
+        stop_condition = partial(StopOnMaxTracks, max_tracks=5000)
+
+    crawl = _Crawl(uri, stop_condition())
+    while crawl.next_uri is not None and not crawl.should_stop():
+        r = httpx.get(f"http://{VOLUMIO_API_URL}/api/v1/browse?uri={crawl.next_uri}")
+        crawl.add_page(r.json())
+
+    return crawl.tracks
 
-    all_tracks: list[ListItem] = []
 
-    while not stop_condition(all_tracks):
-        r = httpx.get(f"http://{VOLUMIO_API_URL}/api/v1/browse?uri={uri}")
-        browse_json = r.json()
+async def browse_tracks_async(
+    uri: str,
+    client: httpx.AsyncClient,
+    stop_condition: StopConditionFactory | None = None,
+    semaphore: asyncio.Semaphore | None = None,
+) -> list[ListItem]:
+    """Same as `browse_tracks`, with page requests limited by `semaphore`"""
+    if stop_condition is None:
+        stop_condition = partial(StopOnMaxTracks, max_tracks=5000)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(1)
+
+    crawl = _Crawl(uri, stop_condition())
+    while crawl.next_uri is not None and not crawl.should_stop():
+        async with semaphore:
+            r = await client.get(
+                f"http://{VOLUMIO_API_URL}/api/v1/browse?uri={crawl.next_uri}"
+            )
+        crawl.add_page(r.json())
+
+    return crawl.tracks
+
+
+async def browse_sources(
+    uris: Sequence[str],
+    stop_condition: StopConditionFactory | Sequence[StopConditionFactory] | None = None,
+    max_concurrency: int = BROWSE_CONCURRENCY,
+    client: httpx.AsyncClient | None = None,
+) -> list[list[ListItem]]:
+    """Browse several sources concurrently, results are in the order of `uris`.
+
+    `stop_condition` is either used for all sources or is one per source.
+    """
+    if client is None:
+        async with create_client(VOLUMIO_TIMEOUT, "volumio") as client:
+            return await browse_sources(uris, stop_condition, max_concurrency, client)
+
+    if stop_condition is None or callable(stop_condition):
+        stop_conditions = [stop_condition] * len(uris)
+    else:
+        stop_conditions = list(stop_condition)
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def crawl(uri: str, stop_condition: StopConditionFactory | None):
+        with span("crawl", uri):
+            return await browse_tracks_async(uri, client, stop_condition, semaphore)
+
+    return await asyncio.gather(
+        *(
+            crawl(uri, uri_stop_condition)
+            for uri, uri_stop_condition in zip(uris, stop_conditions, strict=True)
+        )
+    )
+
+
+class _Crawl:
+    """Tracks collected from the pages of one list so far"""
+
+    def __init__(self, uri: str, stop_condition: StopCondition):
+        self.next_uri: str | None = uri
+        self.stop_condition = stop_condition
+        self.tracks: list[ListItem] = []
+        self.new_tracks: list[ListItem] = []
+        self.seen_uris: set[str] = set()
+
+    def should_stop(self) -> bool:
+        return self.stop_condition.update(self.new_tracks)
+
+    def add_page(self, browse_json: Any) -> None:
+        """Add tracks from a browse response page and find the next page"""
         browse_response = BrowseResponse.parse_obj(browse_json)
 
-        list_items = browse_response.navigation.lists[-1].items  # TODO: fix lists[-1]
+        list_items = browse_response.lists[-1]  # TODO: fix lists[-1]
 
+        self.new_tracks = []
         for item in list_items:
-            if item.type not in {"song", "folder"} or item in all_tracks:
+            if (
+                item.type not in {"song", "folder"}
+                or item.stripped_uri in self.seen_uris
+            ):
                 continue
-            all_tracks.append(item)
+            self.seen_uris.add(item.stripped_uri)
+            self.new_tracks.append(item)
+        self.tracks += self.new_tracks
 
         next_page = next(
             (
@@ -57,9 +227,8 @@ def browse_tracks(
         )
         if next_page is None:
             logger.debug("No more pages")
-            break
+            self.next_uri = None
+            return
 
         logger.debug(".")
-        uri = next_page.uri
-
-    return all_tracks
+        self.next_uri = next_page.uri
@@ -0,0 +1,392 @@
+"""Compact state log
+
+Playback samples are stored as fixed-width records of five unsigned 32-bit
+integers: timestamp, URI id, seek (ms), duration (s) and status. Services and
+URIs are interned in a dictionary file next to it, one JSON line per id.
+Both files are only appended to, except by compaction, which collapses old
+listening sessions to their furthest sample.
+
+Records are read through a memory map as columns, so aggregating them doesn't
+build an object per sample. The JSON lines log written before can be
+converted with `statelog convert`.
+"""
+
+import argparse
+import array
+import fcntl
+import gzip
+import json
+import logging
+import mmap
+import re
+import time
+from collections.abc import Iterable, Iterator, Sequence
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import NamedTuple
+
+from .constants import COMPACT_STATE_LOG_PATH, STATE_COMPACT_AGE, STATE_LOG_PATH
+from .models import StateLog
+from .renderer import aggregate_fields, decode_progress_fields
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"VSL1"
+FIELDS = ("ts", "uri_id", "seek", "duration", "status")
+# Magic followed by the number of fields per record
+HEADER = MAGIC + array.array("I", [len(FIELDS)]).tobytes()
+RECORD_SIZE = 4 * len(FIELDS)
+STATUSES = ("play", "pause", "stop")
+MAX_VALUE = 2**32 - 1
+# Samples written per batch when converting
+CONVERT_BATCH_SIZE = 10_000
+
+
+class Sample(NamedTuple):
+    ts: int
+    service: str
+    uri: str
+    seek: int
+    duration: int
+    status: str
+
+
+class StateColumns:
+    """Records of a compact state log, viewed column by column"""
+
+    def __init__(self, uris: list[tuple[str, str]], values: memoryview):
+        self.uris = uris
+        self.values = values
+        self._views: list[memoryview] = []
+
+    def __len__(self) -> int:
+        return len(self.values) // len(FIELDS)
+
+    def column(self, name: str) -> memoryview:
+        view = self.values[FIELDS.index(name) :: len(FIELDS)]
+        self._views.append(view)
+        return view
+
+    def release(self) -> None:
+        for view in self._views:
+            view.release()
+        self.values.release()
+
+
+class CompactStateLog:
+    def __init__(self, path: Path = COMPACT_STATE_LOG_PATH):
+        self.path = path
+        self.uris_path = path.with_suffix(".uris")
+        self.lock_path = path.with_name(f"{path.name}.lock")
+        self._uris: list[tuple[str, str]] = []
+        self._uri_ids: dict[tuple[str, str], int] = {}
+        # Bytes of the dictionary read so far, and the file they were read from
+        self._uris_size = 0
+        self._uris_inode: int | None = None
+
+    def append(self, samples: Iterable[Sample]) -> int:
+        """Append samples, return how many were written"""
+        with self._locked(fcntl.LOCK_EX):
+            self._load_uris()
+            values = array.array("I")
+            new_uris: list[tuple[str, str]] = []
+            for sample in samples:
+                key = (sample.service, sample.uri)
+                uri_id = self._uri_ids.get(key)
+                if uri_id is None:
+                    uri_id = self._uri_ids[key] = len(self._uris)
+                    self._uris.append(key)
+                    new_uris.append(key)
+                values.extend(
+                    (
+                        _clamp(sample.ts),
+                        uri_id,
+                        _clamp(sample.seek),
+                        _clamp(sample.duration),
+                        _status_code(sample.status),
+                    )
+                )
+
+            if not values:
+                return 0
+
+            # URIs first, so records never refer to an id that isn't written
+            if new_uris:
+                with self.uris_path.open("a") as f:
+                    f.writelines(json.dumps(uri) + "\n" for uri in new_uris)
+                stat = self.uris_path.stat()
+                self._uris_size, self._uris_inode = stat.st_size, stat.st_ino
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("ab") as f:
+                if f.tell() == 0:
+                    f.write(HEADER)
+                f.write(values.tobytes())
+
+        return len(values) // len(FIELDS)
+
+    @contextmanager
+    def read(self) -> Iterator[StateColumns]:
+        """Map the log into memory, columns are only valid inside the block"""
+        with self._locked(fcntl.LOCK_SH), self._read() as columns:
+            yield columns
+
+    def compact(self, older_than: float = STATE_COMPACT_AGE) -> int:
+        """Collapse sessions older than `older_than` seconds to their furthest
+        sample, return the number of records removed.
+
+        A session is a run of consecutive records of the same URI.
+        """
+        cutoff = time.time() - older_than
+        with self._locked(fcntl.LOCK_EX):
+            with self._read() as columns:
+                kept = _compacted_records(columns, cutoff)
+                removed = len(columns) - len(kept)
+                if not removed:
+                    return 0
+
+                # Drop URIs no longer referred to, renumbering the rest
+                uri_ids: dict[int, int] = {}
+                values = array.array("I")
+                for index in kept:
+                    record = columns.values[
+                        index * len(FIELDS) : (index + 1) * len(FIELDS)
+                    ].tolist()
+                    record[1] = uri_ids.setdefault(record[1], len(uri_ids))
+                    values.extend(record)
+                uris = [columns.uris[uri_id] for uri_id in uri_ids]
+
+            _replace(self.uris_path, "".join(json.dumps(uri) + "\n" for uri in uris))
+            _replace(self.path, HEADER + values.tobytes())
+            self._reset_uris()
+
+        logger.info(f"Compacted state log, removed {removed} records.")
+        return removed
+
+    @contextmanager
+    def _read(self) -> Iterator[StateColumns]:
+        self._load_uris()
+        if not self.path.exists() or self.path.stat().st_size <= len(HEADER):
+            yield StateColumns(list(self._uris), memoryview(array.array("I")))
+            return
+
+        with self.path.open("rb") as f:
+            if f.read(len(HEADER)) != HEADER:
+                raise ValueError(f"{self.path} is not a compact state log.")
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                # A record may still be being written
+                end = len(HEADER) + (len(mm) - len(HEADER)) // RECORD_SIZE * RECORD_SIZE
+                with memoryview(mm) as view:
+                    columns = StateColumns(
+                        list(self._uris), view[len(HEADER) : end].cast("I")
+                    )
+                    try:
+                        yield columns
+                    finally:
+                        columns.release()
+
+    def _load_uris(self) -> None:
+        """Read URIs added to the dictionary since it was last read"""
+        try:
+            stat = self.uris_path.stat()
+        except FileNotFoundError:
+            self._reset_uris()
+            return
+
+        # Compaction replaces the dictionary, ids read from the old one are stale.
+        # Its size can't tell, appends may have grown it back since.
+        if stat.st_ino != self._uris_inode or stat.st_size < self._uris_size:
+            self._reset_uris()
+            self._uris_inode = stat.st_ino
+        if stat.st_size == self._uris_size:
+            return
+
+        with self.uris_path.open("rb") as f:
+            f.seek(self._uris_size)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                service, uri = json.loads(line)
+                self._uri_ids[(service, uri)] = len(self._uris)
+                self._uris.append((service, uri))
+                self._uris_size += len(line)
+
+    def _reset_uris(self) -> None:
+        self._uris, self._uri_ids = [], {}
+        self._uris_size, self._uris_inode = 0, None
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with self.lock_path.open("a") as lock:
+            fcntl.flock(lock, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def aggregate_state_log(
+    log: CompactStateLog,
+    max_seek_positions: dict[str, int] | None = None,
+    durations: dict[str, int] | None = None,
+) -> tuple[dict[str, int], dict[str, int]]:
+    """Merge a compact state log into max seek positions and durations per URI"""
+    with log.read() as columns:
+        uri_max_seeks = [-1] * len(columns.uris)
+        uri_durations = [0] * len(columns.uris)
+        for uri_id, seek, duration in zip(
+            columns.column("uri_id"),
+            columns.column("seek"),
+            columns.column("duration"),
+            strict=True,
+        ):
+            if seek > uri_max_seeks[uri_id]:
+                uri_max_seeks[uri_id] = seek
+            uri_durations[uri_id] = duration
+
+        return aggregate_fields(
+            (
+                (service, uri, uri_max_seeks[uri_id], uri_durations[uri_id])
+                for uri_id, (service, uri) in enumerate(columns.uris)
+                if uri_max_seeks[uri_id] >= 0
+            ),
+            max_seek_positions,
+            durations,
+        )
+
+
+def convert_json_logs(paths: Sequence[Path], log: CompactStateLog) -> int:
+    """Append JSON lines state logs to a compact log, return samples written"""
+    written = 0
+    for path in paths:
+        opener = gzip.open if path.suffix == ".gz" else open
+        with opener(path, "rb") as f:
+            samples = (decode_sample(line) for line in f)
+            batch: list[Sample] = []
+            for sample in samples:
+                if sample is None:
+                    continue
+                batch.append(sample)
+                if len(batch) == CONVERT_BATCH_SIZE:
+                    written += log.append(batch)
+                    batch = []
+            written += log.append(batch)
+        logger.info(f"Converted {path}.")
+    return written
+
+
+def decode_sample(line: str | bytes) -> Sample | None:
+    """Get a sample from a JSON state log line, None if it isn't valid"""
+    fields = decode_progress_fields(line)
+    if fields is None:
+        return None
+
+    try:
+        log = json.loads(line)
+        ts = datetime.fromisoformat(log["ts"])
+        status = log["state"]["status"]
+        if type(status) is not str:
+            raise TypeError(status)
+    except (KeyError, TypeError, ValueError):
+        # Only the validated model accepts the line
+        state_log = StateLog.parse_raw(line)
+        ts, status = state_log.ts, state_log.state.status
+
+    return Sample(int(ts.timestamp()), *fields, status)
+
+
+def rotated_shards(log_path: Path) -> list[Path]:
+    """Rotated copies of a log (`state.log.1`, `state.log.2.gz`, ...), oldest first"""
+    pattern = re.compile(rf"^{re.escape(log_path.name)}\.(\d+)(\.gz)?$")
+
+    shards: list[tuple[int, Path]] = []
+    for path in log_path.parent.glob(f"{log_path.name}.*"):
+        match = pattern.match(path.name)
+        if match:
+            shards.append((int(match.group(1)), path))
+
+    return [path for _, path in sorted(shards, reverse=True)]
+
+
+def _compacted_records(columns: StateColumns, cutoff: float) -> list[int]:
+    """Indexes of the records left after compaction"""
+    kept: list[int] = []
+    best: int | None = None
+    ts_column = columns.column("ts")
+    uri_column = columns.column("uri_id")
+    seek_column = columns.column("seek")
+
+    for index, (ts, uri_id, seek) in enumerate(
+        zip(ts_column, uri_column, seek_column, strict=True)
+    ):
+        if ts >= cutoff:
+            if best is not None:
+                kept.append(best)
+                best = None
+            kept.append(index)
+        elif best is None or uri_id != uri_column[best]:
+            if best is not None:
+                kept.append(best)
+            best = index
+        elif seek > seek_column[best]:
+            best = index
+
+    if best is not None:
+        kept.append(best)
+    return kept
+
+
+def _replace(path: Path, content: str | bytes) -> None:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    if isinstance(content, bytes):
+        tmp_path.write_bytes(content)
+    else:
+        tmp_path.write_text(content)
+    tmp_path.replace(path)
+
+
+def _clamp(value: int) -> int:
+    return min(max(value, 0), MAX_VALUE)
+
+
+def _status_code(status: str) -> int:
+    return STATUSES.index(status) if status in STATUSES else len(STATUSES)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    parser = argparse.ArgumentParser(description="Manage the compact state log.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser(
+        "convert", help="append the JSON lines state logs to the compact log"
+    )
+    convert.add_argument(
+        "--remove", action="store_true", help="delete the JSON logs once converted"
+    )
+    compact = commands.add_parser("compact", help="collapse old listening sessions")
+    compact.add_argument(
+        "--older-than-days",
+        type=float,
+        default=STATE_COMPACT_AGE / 86400,
+        help="only compact sessions older than this",
+    )
+    args = parser.parse_args()
+
+    log = CompactStateLog()
+    if args.command == "convert":
+        paths = [*rotated_shards(STATE_LOG_PATH), STATE_LOG_PATH]
+        paths = [path for path in paths if path.exists()]
+        written = convert_json_logs(paths, log)
+        logger.info(f"Wrote {written} samples to {log.path}.")
+        if args.remove:
+            for path in paths:
+                path.unlink()
+    else:
+        log.compact(args.older_than_days * 86400)
+
+
+if __name__ == "__main__":
+    main()
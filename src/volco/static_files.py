@@ -0,0 +1,138 @@
+"""Static file serving with caching and precompressed pages
+
+Pages are written with a gzipped sibling (`page.html.gz`), which is sent
+instead of the page to clients accepting gzip. Responses carry a strong ETag
+and a Cache-Control header, so revisits of unchanged pages get a 304.
+
+Pages and rules are rewritten in place, so they are revalidated on every
+visit. Only assets that change with a release, like stylesheets, may be
+cached for a while without asking.
+"""
+
+import mimetypes
+import os
+from typing import Any
+
+from starlette.datastructures import Headers
+from starlette.middleware.gzip import GZipMiddleware, GZipResponder
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+from starlette.types import Message, Receive, Scope, Send
+
+GZIP_SUFFIX = ".gz"
+# Files only changed by a new release
+ASSET_SUFFIXES = frozenset({".css", ".js", ".ico", ".png", ".svg", ".woff2"})
+
+
+class CachedStaticFiles(StaticFiles):
+    def __init__(
+        self,
+        *,
+        cache_control: str = "no-cache",
+        asset_cache_control: str | None = None,
+        **kwargs: Any,
+    ):
+        super().__init__(**kwargs)
+        self.cache_control = cache_control
+        self.asset_cache_control = asset_cache_control or cache_control
+
+    def file_response(
+        self,
+        full_path: str | os.PathLike[str],
+        stat_result: os.stat_result,
+        scope: Scope,
+        status_code: int = 200,
+    ) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = {
+            "cache-control": self._cache_control(full_path),
+            "vary": "Accept-Encoding",
+        }
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+
+        gzip_path = f"{full_path}{GZIP_SUFFIX}"
+        gzip_stat = None
+        if "gzip" in request_headers.get("accept-encoding", ""):
+            gzip_stat = _stat(gzip_path)
+        # A sibling older than the page is left over from a previous version
+        if gzip_stat is not None and gzip_stat.st_mtime_ns >= stat_result.st_mtime_ns:
+            full_path, stat_result = gzip_path, gzip_stat
+            headers["content-encoding"] = "gzip"
+
+        headers["etag"] = _etag(stat_result, headers.get("content-encoding"))
+        response = FileResponse(
+            full_path,
+            status_code=status_code,
+            headers=headers,
+            media_type=media_type,
+            stat_result=stat_result,
+            method=scope["method"],
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def _cache_control(self, full_path: str | os.PathLike[str]) -> str:
+        if os.path.splitext(full_path)[1] in ASSET_SUFFIXES:
+            return self.asset_cache_control
+        return self.cache_control
+
+    def is_not_modified(
+        self, response_headers: Headers, request_headers: Headers
+    ) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            # Takes precedence over If-Modified-Since
+            return etag_matches(if_none_match, response_headers.get("etag"))
+        return super().is_not_modified(response_headers, request_headers)
+
+
+class JSONGZipMiddleware(GZipMiddleware):
+    """Gzip JSON responses above `minimum_size`.
+
+    Static files are compressed ahead of time and event streams must not be
+    buffered, so other responses pass through untouched.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "http":
+            headers = Headers(scope=scope)
+            if "gzip" in headers.get("Accept-Encoding", ""):
+                responder = _JSONGZipResponder(
+                    self.app, self.minimum_size, compresslevel=self.compresslevel
+                )
+                await responder(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+class _JSONGZipResponder(GZipResponder):
+    async def send_with_gzip(self, message: Message) -> None:
+        await super().send_with_gzip(message)
+        if message["type"] == "http.response.start":
+            content_type = Headers(raw=message["headers"]).get("content-type", "")
+            if not content_type.startswith("application/json"):
+                # Makes the responder forward the body as is
+                self.content_encoding_set = True
+
+
+def etag_matches(if_none_match: str, etag: str | None) -> bool:
+    """Check an If-None-Match header, which may list several ETags"""
+    etags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in etags or etag in etags
+
+
+def _etag(stat_result: os.stat_result, encoding: str | None = None) -> str:
+    # Pages are replaced by rename when their contents change, so the inode,
+    # mtime and size change with every new version
+    etag = f"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"
+    if encoding is not None:
+        etag = f"{etag}-{encoding}"
+    return f'"{etag}"'
+
+
+def _stat(path: str) -> os.stat_result | None:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
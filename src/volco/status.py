@@ -0,0 +1,103 @@
+"""Cached playback status
+
+Concurrent status requests share a single upstream `getState` call and its
+result is reused for a short time. States pushed by Volumio replace the
+cached one right away and are forwarded to stream subscribers.
+"""
+
+import asyncio
+import logging
+import time
+from collections.abc import AsyncIterator
+from typing import Any
+
+import httpx
+import pydantic
+
+from .constants import STATUS_CACHE_TTL, VOLUMIO_API_URL
+from .models import State
+
+logger = logging.getLogger(__name__)
+
+# Number of undelivered states kept per subscriber, older ones are dropped
+SUBSCRIBER_QUEUE_SIZE = 8
+
+
+class StatusCache:
+    def __init__(self, client: httpx.AsyncClient, ttl: float = STATUS_CACHE_TTL):
+        self.client = client
+        self.ttl = ttl
+
+        self._state: State | None = None
+        self._fetched_at = 0.0
+        self._generation = 0
+        self._inflight: asyncio.Task[State] | None = None
+        self._subscribers: set[asyncio.Queue[State]] = set()
+
+    async def get(self) -> State:
+        if self._state is not None and time.monotonic() - self._fetched_at < self.ttl:
+            return self._state
+
+        if self._inflight is None:
+            self._inflight = asyncio.create_task(self._fetch())
+            self._inflight.add_done_callback(self._clear_inflight)
+
+        # Shield so that one cancelled caller doesn't cancel it for the others
+        return await asyncio.shield(self._inflight)
+
+    def invalidate(self) -> None:
+        self._state = None
+        self._generation += 1
+
+    def publish(self, data: dict[str, Any]) -> None:
+        """Take a state pushed by Volumio"""
+        try:
+            state = State.parse_obj(data)
+        except pydantic.error_wrappers.ValidationError:
+            self.invalidate()
+            return
+
+        self._set(state)
+        self._generation += 1
+
+    async def subscribe(self) -> AsyncIterator[State]:
+        """Yield the current state and then every state change"""
+        queue: asyncio.Queue[State] = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        try:
+            try:
+                state = await self.get()
+            except (httpx.HTTPError, ValueError) as e:
+                logger.warning(f"Could not get playback status: {e}")
+            else:
+                yield state
+
+            while True:
+                yield await queue.get()
+        finally:
+            self._subscribers.discard(queue)
+
+    async def _fetch(self) -> State:
+        generation = self._generation
+        r = await self.client.get(f"http://{VOLUMIO_API_URL}/api/v1/getState")
+        state = State.parse_obj(r.json())
+
+        # Don't overwrite a state pushed while the request was in flight
+        if generation == self._generation:
+            self._set(state)
+        return state
+
+    def _set(self, state: State) -> None:
+        changed = state != self._state
+        self._state = state
+        self._fetched_at = time.monotonic()
+        if not changed:
+            return
+
+        for queue in self._subscribers:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(state)
+
+    def _clear_inflight(self, _task: asyncio.Task[State]) -> None:
+        self._inflight = None
@@ -4,37 +4,115 @@ Very specific module to find links to NTS show tracklists
 for currenly playing tracks.
 """
 
+import asyncio
+import logging
 import re
+from collections.abc import AsyncIterator
 from urllib.parse import quote_plus
 
 import httpx
 from fastapi import HTTPException
 
-from .models import MixcloudResult, State
-from .sc_client_id import get_client_id
+from .cache import PersistentCache
+from .clients import HttpClients
+from .constants import TRACKLIST_CACHE_PATH, TRACKLIST_LINK_TTL, TRACKLIST_MISS_TTL
+from .models import MixcloudResult, State, strip_uri
+from .sc_client_id import get_client_id, invalidate_client_id
+
+logger = logging.getLogger(__name__)
+
+
+_cache = PersistentCache(TRACKLIST_CACHE_PATH, ttl=TRACKLIST_LINK_TTL)
+_inflight: dict[str, asyncio.Task[str]] = {}
 
 
 async def get_tracklist_link(
     state: State,
-    client: httpx.AsyncClient,
+    clients: HttpClients,
 ) -> str:
-    """Get NTS tracklist URL from given state"""
+    """Get NTS tracklist URL from given state, cached by track URI"""
+    key = strip_uri(state.uri)
+
+    cached = _cache.get(key)
+    if cached is not None:
+        if "link" in cached:
+            return cached["link"]
+        raise HTTPException(cached["status_code"], cached["detail"])
+
+    # Share the lookup with a prefetch or another request for the same track
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_find_tracklist_link(key, state, clients))
+        task.add_done_callback(lambda _: _inflight.pop(key, None))
+        _inflight[key] = task
+    return await asyncio.shield(task)
+
+
+async def prefetch_tracklist_links(
+    states: AsyncIterator[State],
+    clients: HttpClients,
+) -> None:
+    """Look up tracklist links as soon as a new NTS track starts playing"""
+    last_uri = None
+    async for state in states:
+        uri = strip_uri(state.uri)
+        if uri == last_uri:
+            continue
+        last_uri = uri
+
+        if "NTS" not in state.artist:
+            continue
+
+        try:
+            await get_tracklist_link(state, clients)
+        except (HTTPException, httpx.HTTPError) as e:
+            logger.info(f"Could not prefetch tracklist for `{state.title}`: {e}")
+        except Exception as e:
+            # Nothing awaits this task, an error would end prefetching silently
+            logger.warning(
+                f"Tracklist prefetch for `{state.title}` failed: {e!r}", exc_info=True
+            )
+
+
+async def _find_tracklist_link(key: str, state: State, clients: HttpClients) -> str:
     if state.uri.startswith("mixcloud"):
-        return await get_nts_link_from_mixcloud(state.title, client)
+        lookup = get_nts_link_from_mixcloud(state.title, clients.mixcloud)
     elif state.uri.startswith("soundcloud"):
-        return await get_nts_link_from_soundcloud(state.title, client)
-    raise HTTPException(400, "Only SoundCloud and Mixcloud tracks are supported.")
+        lookup = get_nts_link_from_soundcloud(state.title, clients.soundcloud)
+    else:
+        raise HTTPException(400, "Only SoundCloud and Mixcloud tracks are supported.")
+
+    try:
+        link = await lookup
+    except HTTPException as e:
+        # Remember missing links for a while, the show may not be online yet
+        if e.status_code == 404:
+            _cache.set(
+                key,
+                {"status_code": e.status_code, "detail": e.detail},
+                ttl=TRACKLIST_MISS_TTL,
+            )
+        raise
+
+    _cache.set(key, {"link": link})
+    return link
 
 
 async def get_nts_link_from_soundcloud(name: str, client: httpx.AsyncClient) -> str:
     """Find a link to NTS show episode page via SoundCloud API"""
-    client_id = await get_client_id(client)
-    api_url = (
-        f"https://api-v2.soundcloud.com/"
-        f"search?q={quote_plus(name)}&client_id={client_id}"
-    )
+    for _ in range(2):
+        client_id = await get_client_id(client)
+        api_url = (
+            f"https://api-v2.soundcloud.com/"
+            f"search?q={quote_plus(name)}&client_id={client_id}"
+        )
+
+        r = await client.get(api_url)
+        if r.status_code not in {401, 403}:
+            break
+        # Client IDs get rotated, look up a new one and try again
+        invalidate_client_id(client_id)
 
-    r = await client.get(api_url)
     if r.status_code != 200:
         raise HTTPException(404, "Could not get link via SoundCloud API")
 
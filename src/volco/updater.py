@@ -1,195 +1,525 @@
+import argparse
+import asyncio
+import fcntl
+import gzip
+import hashlib
 import json
 import logging
-from collections import Counter
-from collections.abc import Collection, Mapping
+from collections.abc import Callable, Collection, Iterator, Mapping, Sequence, Set
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from functools import partial
+from pathlib import Path
 
+import httpx
 import jinja2
-from socketIO_client import SocketIO
 
+from volco.catalog import Catalog
+from volco.clients import create_client
 from volco.controller import VolumioController
+from volco.matcher import PlaylistMatcher
+from volco.metrics import refresh_run, span
 from volco.models import ListItem
-from volco.renderer import extract_progress, render_index_file, render_playlist_page
-from volco.scraper import browse_tracks, stop_on_overlap
+from volco.planner import (
+    PlaylistPlan,
+    append_new,
+    apply_plan,
+    deduplicate,
+    plan_playlist,
+)
+from volco.playlist_files import PlaylistFiles
+from volco.progress import update_progress
+from volco.renderer import (
+    generate_filename,
+    playlist_page_digest,
+    render_index_file,
+    render_playlist_page,
+    template_digest,
+)
+from volco.scraper import (
+    StopOnAny,
+    StopOnFingerprint,
+    StopOnOverlap,
+    browse_sources,
+    browse_tracks_async,
+    feed_fingerprint,
+)
+from volco.statelog import CompactStateLog
+from volco.static_files import GZIP_SUFFIX
 
 from .constants import (
     INDEX_PATH,
     INDEX_TEMPLATE_HTML,
     LATEST_50_NAME,
     N_LATEST,
+    PAGE_HASHES_PATH,
+    PLAYLIST_BACKEND,
     PLAYLIST_HTML_DIR,
     PLAYLIST_PATTERN_PATH,
     PLAYLIST_TEMPLATE_HTML,
-    SOCKETIO_PORT,
+    REFRESH_LOCK_PATH,
     STATE_LOG_PATH,
     TEMPLATE_DIR,
     TRACK_PROGRESS_PATH,
     TRACK_SOURCES,
-    VOLUMIO_URL,
+    VOLUMIO_TIMEOUT,
 )
 
 logger = logging.getLogger(__name__)
 
 
-def remove_playlist_duplicates(playlist: str, controller: VolumioController) -> None:
-    playlist_tracks = browse_tracks(f"playlists/{playlist}")
-
-    track_counter = Counter(playlist_tracks)
-    for track, count in track_counter.items():
-        for _ in range(count - 1):
-            logger.info(f"Removing {track.title} from playlist {playlist}.")
-            controller.remove_from_playlist(
-                playlist, service=track.service, uri=track.uri
-            )
+async def remove_playlist_duplicates(
+    playlist: str, controller: VolumioController
+) -> None:
+    playlist_tracks = await controller.list_tracks(playlist)
+    plan = plan_playlist(playlist, playlist_tracks, deduplicate(playlist_tracks))
+    await apply_plan(plan, controller)
 
 
 def filter_tracks(
-    tracks: Collection[ListItem], patterns: Collection[str]
-) -> list[ListItem]:
-    return [
-        track
-        for track in tracks
-        if any(pattern in track.title.lower() for pattern in patterns)
-    ]
-
+    tracks: Collection[ListItem], matcher: PlaylistMatcher
+) -> dict[str, list[ListItem]]:
+    """Find matching tracks for all playlists in one pass over the tracks"""
+    return matcher.filter(tracks)
 
-def update_new_additions_playlist(
-    tracks: Collection[ListItem], vc: VolumioController
-) -> None:
-    new_tracks = list(tracks)[:N_LATEST]
-    current_tracks = browse_tracks(f"playlists/{LATEST_50_NAME}")
-
-    # Add new tracks
-    for track in new_tracks:
-        logger.info(f"Adding track {track.title} to playlist {LATEST_50_NAME}")
-        vc.add_to_playlist(
-            playlist=LATEST_50_NAME, service=track.service, uri=track.uri
-        )
 
-    # Remove oldest tracks to reach N_LATEST
-    extra = len(current_tracks) + len(new_tracks) - N_LATEST
-    for idx in range(extra):
-        track = current_tracks[idx]
-        vc.remove_from_playlist(
-            playlist=LATEST_50_NAME, service=track.service, uri=track.uri
-        )
+def plan_new_additions_playlist(
+    tracks: Collection[ListItem], current_tracks: list[ListItem]
+) -> PlaylistPlan:
+    """Append new tracks and drop the oldest ones beyond N_LATEST"""
+    new_tracks = append_new(current_tracks, tracks)[:N_LATEST]
+    target = (current_tracks + new_tracks)[-N_LATEST:]
+    return plan_playlist(LATEST_50_NAME, current_tracks, target)
 
 
-def generate_html_files(
+async def generate_html_files(
     vc: VolumioController,
+    catalog: Catalog,
     track_progress: Mapping[str, int] | None = None,
+    playlist_files: PlaylistFiles | None = None,
 ) -> None:
+    """Render the pages whose contents changed since they were last written"""
     logger.info("Generating HTML pages for playlists.")
 
+    source = playlist_files or vc
+    playlists = await source.list_playlists()
+    tracks_per_playlist = await asyncio.gather(
+        *(list_playlist_tracks(source, playlist) for playlist in playlists)
+    )
+
+    # The event loop may be the app's, so the rest runs in a thread
+    await asyncio.to_thread(
+        write_html_files,
+        catalog,
+        dict(zip(playlists, tracks_per_playlist, strict=True)),
+        track_progress or {},
+    )
+
+
+def write_html_files(
+    catalog: Catalog,
+    tracks_per_playlist: Mapping[str, list[ListItem]],
+    track_progress: Mapping[str, int],
+) -> None:
     loader = jinja2.FileSystemLoader(TEMPLATE_DIR)
     environment = jinja2.Environment(loader=loader)
     template = environment.get_template(PLAYLIST_TEMPLATE_HTML)
+    playlist_template_digest = template_digest(environment, PLAYLIST_TEMPLATE_HTML)
+
+    page_hashes = load_page_hashes()
+    new_page_hashes: dict[str, str] = {}
+    filenames: dict[str, str] = {}
+    renders: list[Callable[[], None]] = []
+    for playlist, tracks in tracks_per_playlist.items():
+        # Keep the catalog in sync with Volumio, even when the page is the same:
+        # it may have missed a failed edit or one made outside of refresh
+        if catalog.playlist_tracks(playlist) != tracks:
+            catalog.set_playlist_tracks(playlist, tracks)
 
-    playlists = vc.list_playlists()
+        filename = generate_filename(playlist)
+        filenames[playlist] = filename
 
-    playlist_files: dict[str, str] = {}
-    for playlist in playlists:
-        tracks = vc.list_tracks(playlist)
+        digest = playlist_page_digest(
+            playlist, tracks, track_progress, playlist_template_digest
+        )
+        new_page_hashes[filename] = digest
+        output_path = PLAYLIST_HTML_DIR / filename
+        if page_hashes.get(filename) == digest and _page_exists(output_path):
+            continue
+
+        renders.append(
+            partial(
+                write_page,
+                output_path,
+                render_playlist_page,
+                title=playlist,
+                tracks=tracks,
+                track_progress=track_progress,
+                template=template,
+            )
+        )
 
-        rendered = render_playlist_page(
-            title=playlist,
-            tracks=tracks,
-            track_progress=track_progress or {},
-            template=template,
+    index_template = environment.get_template(INDEX_TEMPLATE_HTML)
+    index_digest = hashlib.sha256(
+        template_digest(environment, INDEX_TEMPLATE_HTML).encode()
+        + json.dumps(filenames).encode()
+    ).hexdigest()
+    new_page_hashes[INDEX_PATH.name] = index_digest
+    if page_hashes.get(INDEX_PATH.name) != index_digest or not _page_exists(INDEX_PATH):
+        renders.append(
+            partial(
+                write_page, INDEX_PATH, render_index_file, filenames, index_template
+            )
         )
 
-        filename = generate_filename(playlist)
+    # Pages are independent, rendering them in threads overlaps their writes
+    with span("render"), ThreadPoolExecutor() as executor:
+        for future in [executor.submit(render) for render in renders]:
+            future.result()
+    logger.info(f"Rendered {len(renders)} of {len(new_page_hashes)} pages.")
 
-        playlist_files[playlist] = filename
-        output_path = PLAYLIST_HTML_DIR / filename
-        output_path.write_text(rendered)
+    if new_page_hashes != page_hashes:
+        save_page_hashes(new_page_hashes)
+
+
+def write_page(path: Path, render: Callable[..., str], *args, **kwargs) -> None:
+    """Render a page and replace it and its gzipped sibling atomically"""
+    rendered = render(*args, **kwargs).encode()
+    gzip_path = path.with_name(f"{path.name}{GZIP_SUFFIX}")
+    # The page goes first, it's served plain until its sibling is newer
+    for output_path, content in (
+        (path, rendered),
+        (gzip_path, gzip.compress(rendered, mtime=0)),
+    ):
+        tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+        tmp_path.write_bytes(content)
+        tmp_path.replace(output_path)
+
+
+def _page_exists(path: Path) -> bool:
+    return path.exists() and path.with_name(f"{path.name}{GZIP_SUFFIX}").exists()
 
-    index_template = environment.get_template(INDEX_TEMPLATE_HTML)
-    rendered_index = render_index_file(playlist_files, index_template)
-    INDEX_PATH.write_text(rendered_index)
 
+def load_page_hashes() -> dict[str, str]:
+    try:
+        return json.loads(PAGE_HASHES_PATH.read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
 
-def generate_filename(name: str) -> str:
-    name = name.replace(" ", "_")
-    name = name.replace(",", "_")
-    return f"{name}.html"
 
+def save_page_hashes(page_hashes: Mapping[str, str]) -> None:
+    PAGE_HASHES_PATH.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = PAGE_HASHES_PATH.with_name(f".{PAGE_HASHES_PATH.name}.tmp")
+    tmp_path.write_text(json.dumps(page_hashes))
+    tmp_path.replace(PAGE_HASHES_PATH)
 
-def find_candidate_tracks() -> list[ListItem]:
+
+async def get_playlist_tracks(
+    playlists: Sequence[str], catalog: Catalog, client: httpx.AsyncClient
+) -> dict[str, list[ListItem]]:
+    """Get playlist contents from the catalog, browse Volumio for unknown ones"""
+    tracks_per_playlist = await asyncio.to_thread(
+        lambda: {playlist: catalog.playlist_tracks(playlist) for playlist in playlists}
+    )
+    unknown = [
+        playlist for playlist, tracks in tracks_per_playlist.items() if tracks is None
+    ]
+    browsed = await asyncio.gather(
+        *(browse_playlist(playlist, client) for playlist in unknown)
+    )
+    for playlist, tracks in zip(unknown, browsed, strict=True):
+        await asyncio.to_thread(catalog.set_playlist_tracks, playlist, tracks)
+        tracks_per_playlist[playlist] = tracks
+    return tracks_per_playlist
+
+
+async def browse_playlist(playlist: str, client: httpx.AsyncClient) -> list[ListItem]:
     # TODO: this uses REST API
-    existing_tracks = browse_tracks(f"playlists/{LATEST_50_NAME}")
-    stop_condition = partial(
-        stop_on_overlap, existing_tracks=existing_tracks, min_overlap=5
+    with span("browse_playlist", playlist):
+        return await browse_tracks_async(f"playlists/{playlist}", client)
+
+
+async def list_playlist_tracks(
+    source: VolumioController | PlaylistFiles, playlist: str
+) -> list[ListItem]:
+    with span("browse_playlist", playlist):
+        return await source.list_tracks(playlist)
+
+
+async def find_candidate_tracks(
+    catalog: Catalog,
+    client: httpx.AsyncClient,
+    dry_run: bool = False,
+    sources: Sequence[str] = TRACK_SOURCES,
+) -> tuple[list[ListItem], list[ListItem]]:
+    """Browse sources, return the tracks found and the ones not seen before"""
+    # Feeds are browsed until they reach tracks seen in earlier runs, or only
+    # their first page if it starts like last time
+    existing_tracks = await get_playlist_tracks([LATEST_50_NAME], catalog, client)
+    known_uris = await asyncio.to_thread(catalog.known_uris)
+    existing_uris = frozenset(
+        known_uris | {track.stripped_uri for track in existing_tracks[LATEST_50_NAME]}
+    )
+    fingerprints = [catalog.fingerprint(source) for source in sources]
+    stop_conditions = [
+        partial(
+            StopOnAny,
+            partial(
+                StopOnOverlap,
+                existing_uris,
+                min_overlap=5,
+                high_water_uri=catalog.high_water_mark(source),
+            ),
+            partial(StopOnFingerprint, fingerprint),
+        )
+        for source, fingerprint in zip(sources, fingerprints, strict=True)
+    ]
+
+    tracks_per_source = await browse_sources(
+        sources, stop_condition=stop_conditions, client=client
     )
 
+    return await asyncio.to_thread(
+        record_source_tracks,
+        catalog,
+        sources,
+        tracks_per_source,
+        fingerprints,
+        existing_uris,
+        dry_run,
+    )
+
+
+def record_source_tracks(
+    catalog: Catalog,
+    sources: Sequence[str],
+    tracks_per_source: Sequence[list[ListItem]],
+    fingerprints: Sequence[str | None],
+    existing_uris: Set[str],
+    dry_run: bool = False,
+) -> tuple[list[ListItem], list[ListItem]]:
+    """Add crawled tracks to the catalog, return them and the ones not seen before"""
     all_tracks: list[ListItem] = []
-    for track_source in TRACK_SOURCES:
-        source_tracks = browse_tracks(track_source, stop_condition=stop_condition)
-        logger.info(f"Got {len(source_tracks)} tracks from {track_source}")
+    all_new_tracks: list[ListItem] = []
+    for track_source, source_tracks, fingerprint in zip(
+        sources, tracks_per_source, fingerprints, strict=True
+    ):
+        new_fingerprint = feed_fingerprint(source_tracks)
+        if new_fingerprint is not None and new_fingerprint == fingerprint:
+            logger.info(f"{track_source} is unchanged.")
+        else:
+            logger.info(f"Got {len(source_tracks)} tracks from {track_source}")
+        # A dry run must not mark tracks as seen, the next run would skip them
+        if dry_run:
+            new_tracks = [
+                track
+                for track in source_tracks
+                if track.stripped_uri not in existing_uris
+            ]
+        else:
+            new_tracks = catalog.add_tracks(track_source, source_tracks)
+            if source_tracks:
+                catalog.set_high_water_mark(track_source, source_tracks[0].stripped_uri)
+            if new_fingerprint is not None and new_fingerprint != fingerprint:
+                catalog.set_fingerprint(track_source, new_fingerprint)
+        logger.info(f"{len(new_tracks)} of them are new.")
         all_tracks += source_tracks
+        all_new_tracks += new_tracks
 
-    return all_tracks
+    return all_tracks, all_new_tracks
 
 
-def update_playlists(
+async def update_playlists(
     new_feed_tracks: Collection[ListItem],
     playlist_patterns: Mapping[str, Collection[str]],
     vc: VolumioController,
+    catalog: Catalog,
+    client: httpx.AsyncClient,
+    dry_run: bool = False,
+    playlist_files: PlaylistFiles | None = None,
 ) -> None:
-    all_new_tracks: set[ListItem] = set()
+    with span("filter"):
+        matcher = await asyncio.to_thread(PlaylistMatcher, playlist_patterns)
+        tracks_per_playlist = await asyncio.to_thread(
+            filter_tracks, new_feed_tracks, matcher
+        )
 
-    for playlist, patterns in playlist_patterns.items():
+    playlists = [*tracks_per_playlist, LATEST_50_NAME]
+    if playlist_files is not None:
+        # Files are cheap to read and always up to date
+        current_per_playlist = await asyncio.gather(
+            *(list_playlist_tracks(playlist_files, playlist) for playlist in playlists)
+        )
+        current_tracks = dict(zip(playlists, current_per_playlist, strict=True))
+    else:
+        current_tracks = await get_playlist_tracks(playlists, catalog, client)
+
+    plans: list[PlaylistPlan] = []
+    all_new_tracks: dict[str, ListItem] = {}
+    for playlist, matching_tracks in tracks_per_playlist.items():
         logger.info(f"Handling playlist `{playlist}`")
-        current_tracks = browse_tracks(f"playlists/{playlist}")
-        current_uris = set(track.stripped_uri for track in current_tracks)
-        matching_tracks = filter_tracks(new_feed_tracks, patterns)
+        new_tracks = append_new(current_tracks[playlist], matching_tracks)
+        target = current_tracks[playlist] + [
+            track._replace(uri=track.stripped_uri) for track in new_tracks
+        ]
+        plans.append(plan_playlist(playlist, current_tracks[playlist], target))
+
+        for track in new_tracks:
+            all_new_tracks.setdefault(track.stripped_uri, track)
+
+    plans.append(
+        plan_new_additions_playlist(
+            all_new_tracks.values(), current_tracks[LATEST_50_NAME]
+        )
+    )
 
-        for track in matching_tracks:
-            if track.stripped_uri in current_uris:
-                logger.debug(
-                    f"Skipping track `{track.title}` as "
-                    f"it already is in playlist `{playlist}`."
-                )
-                continue
+    plans = [plan for plan in plans if plan.call_count]
+    total_calls = sum(plan.call_count for plan in plans)
+    if playlist_files is not None:
+        summary = (
+            f"{len(plans)} playlists with one file write each "
+            f"instead of {total_calls} calls"
+        )
+    else:
+        summary = f"{len(plans)} playlists with {total_calls} calls"
+
+    if dry_run:
+        for plan in plans:
+            logger.info(plan.describe())
+        logger.info(f"Dry run: {summary} planned.")
+        return
+
+    logger.info(f"Updating {summary}.")
+    if playlist_files is not None:
+        with span("write_playlists"):
+            await playlist_files.apply_plans(plans, catalog)
+    else:
+        # The controller still sends the edits one at a time, since their
+        # toasts can't be told apart; the files backend doesn't have that limit
+        await asyncio.gather(
+            *(apply_playlist_plan(plan, vc, catalog) for plan in plans)
+        )
 
-            logger.info(f"Adding track `{track.title}` to playlist `{playlist}`.")
-            vc.add_to_playlist(playlist, service=track.service, uri=track.stripped_uri)
 
-            all_new_tracks.add(track)
+async def apply_playlist_plan(
+    plan: PlaylistPlan, vc: VolumioController, catalog: Catalog
+) -> None:
+    with span("apply_playlist", plan.playlist):
+        await apply_plan(plan, vc, catalog)
 
-    update_new_additions_playlist(all_new_tracks, vc=vc)
 
+async def update_pages(
+    vc: VolumioController,
+    catalog: Catalog,
+    playlist_files: PlaylistFiles | None = None,
+) -> None:
+    """Aggregate track progress and render the playlist pages"""
+    track_progress = await asyncio.to_thread(write_track_progress)
+    await generate_html_files(
+        vc=vc,
+        catalog=catalog,
+        track_progress=track_progress,
+        playlist_files=playlist_files,
+    )
 
-def main(update_tracks=True):
+
+def write_track_progress() -> dict[str, int]:
+    STATE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+    TRACK_PROGRESS_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+    with span("progress"):
+        CompactStateLog().compact()
+        track_progress = update_progress()
+        TRACK_PROGRESS_PATH.write_text(json.dumps(track_progress))
+    return track_progress
+
+
+@contextmanager
+def refresh_lock() -> Iterator[bool]:
+    """Take the refresh lock if it's free, yield whether it was taken"""
+    REFRESH_LOCK_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with REFRESH_LOCK_PATH.open("a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+async def refresh(
+    update_tracks: bool = True,
+    dry_run: bool = False,
+    backend: str = PLAYLIST_BACKEND,
+) -> None:
+    with refresh_lock() as locked:
+        if not locked:
+            logger.warning("Another refresh is running, skipping this one.")
+            return
+
+        with refresh_run():
+            async with (
+                VolumioController.connect() as vc,
+                create_client(VOLUMIO_TIMEOUT, "volumio") as client,
+            ):
+                playlist_files = PlaylistFiles(vc=vc) if backend == "files" else None
+
+                with Catalog() as catalog:
+                    if update_tracks:
+                        feed_tracks, _ = await find_candidate_tracks(
+                            catalog, client, dry_run=dry_run
+                        )
+
+                        playlist_patterns = json.loads(
+                            PLAYLIST_PATTERN_PATH.read_text()
+                        )
+                        await update_playlists(
+                            feed_tracks,
+                            playlist_patterns=playlist_patterns,
+                            vc=vc,
+                            catalog=catalog,
+                            client=client,
+                            dry_run=dry_run,
+                            playlist_files=playlist_files,
+                        )
+
+                    if dry_run:
+                        return
+
+                    await update_pages(vc, catalog, playlist_files)
+
+
+def main(update_tracks=True, dry_run=False, backend=PLAYLIST_BACKEND):
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s %(levelname)s %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
-        filename="logs/refresh.log",
+        # Dry runs are for reading, so log to the terminal
+        filename=None if dry_run else "logs/refresh.log",
     )
 
-    with SocketIO(VOLUMIO_URL, SOCKETIO_PORT) as socketio:
-        vc = VolumioController(socketio)
+    asyncio.run(refresh(update_tracks, dry_run=dry_run, backend=backend))
 
-        if update_tracks:
-            new_feed_tracks = find_candidate_tracks()
 
-            playlist_patterns = json.loads(PLAYLIST_PATTERN_PATH.read_text())
-            update_playlists(
-                new_feed_tracks, playlist_patterns=playlist_patterns, vc=vc
-            )
-
-        STATE_LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-        TRACK_PROGRESS_PATH.parent.mkdir(parents=True, exist_ok=True)
-
-        logs = (
-            STATE_LOG_PATH.read_text().splitlines() if STATE_LOG_PATH.exists() else []
-        )
-        track_progress = extract_progress(logs)
-        TRACK_PROGRESS_PATH.write_text(json.dumps(track_progress))
-
-        generate_html_files(vc=vc, track_progress=track_progress)
+def cli():
+    parser = argparse.ArgumentParser(description="Refresh playlists and pages.")
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="log the planned playlist changes and their call count, change nothing",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=["files", "socketio"],
+        default=PLAYLIST_BACKEND,
+        help="edit playlist files directly or go through Volumio's socket.io API",
+    )
+    args = parser.parse_args()
+    main(dry_run=args.dry_run, backend=args.backend)
 
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -0,0 +1,74 @@
+import sqlite3
+
+from volco.catalog import Catalog
+from volco.constants import FEED_FINGERPRINT_SIZE
+from volco.models import ListItem
+from volco.scraper import feed_fingerprint
+from volco.updater import record_source_tracks
+
+SOURCE = "soundcloud/tracks@userId=1"
+
+
+def test_fingerprint_survives_high_water_mark_updates(tmp_path):
+    with Catalog(tmp_path / "catalog.db") as catalog:
+        assert catalog.fingerprint(SOURCE) is None
+        catalog.set_high_water_mark(SOURCE, "soundcloud/track@trackId=1")
+        catalog.set_fingerprint(SOURCE, "abc")
+        catalog.set_high_water_mark(SOURCE, "soundcloud/track@trackId=2")
+
+        assert catalog.fingerprint(SOURCE) == "abc"
+        assert catalog.high_water_mark(SOURCE) == "soundcloud/track@trackId=2"
+
+
+def test_sources_table_gets_fingerprints(tmp_path):
+    path = tmp_path / "catalog.db"
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE sources (source TEXT PRIMARY KEY, "
+            "high_water_uri TEXT NOT NULL, updated_at TEXT NOT NULL)"
+        )
+        connection.execute(
+            "INSERT INTO sources VALUES (?, ?, ?)",
+            (SOURCE, "soundcloud/track@trackId=1", "2024-01-01T00:00:00"),
+        )
+    connection.close()
+
+    with Catalog(path) as catalog:
+        assert catalog.fingerprint(SOURCE) is None
+        catalog.set_fingerprint(SOURCE, "abc")
+        assert catalog.fingerprint(SOURCE) == "abc"
+        assert catalog.high_water_mark(SOURCE) == "soundcloud/track@trackId=1"
+
+
+def test_fingerprints_are_recorded_for_crawled_feeds(tmp_path):
+    tracks = [
+        ListItem.parse_obj(
+            {
+                "service": "soundcloud",
+                "type": "song",
+                "title": str(i),
+                "uri": f"soundcloud/track@trackId={i}",
+            }
+        )
+        for i in range(FEED_FINGERPRINT_SIZE)
+    ]
+    short_source = "soundcloud/tracks@userId=2"
+
+    with Catalog(tmp_path / "catalog.db") as catalog:
+        record_source_tracks(
+            catalog, [SOURCE], [tracks], [None], frozenset(), dry_run=True
+        )
+        assert catalog.fingerprint(SOURCE) is None
+
+        _, new_tracks = record_source_tracks(
+            catalog,
+            [SOURCE, short_source],
+            [tracks, tracks[:1]],
+            [None, None],
+            frozenset(),
+        )
+        assert new_tracks == tracks
+        assert catalog.fingerprint(SOURCE) == feed_fingerprint(tracks)
+        assert catalog.high_water_mark(SOURCE) == tracks[0].stripped_uri
+        # Too short to tell whether it changed
+        assert catalog.fingerprint(short_source) is None
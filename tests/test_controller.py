@@ -0,0 +1,174 @@
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+
+import pytest
+import socketio
+import uvicorn
+
+from volco.controller import VolumioController, VolumioTimeoutError
+
+
+class FakeVolumio:
+    """socket.io server answering browses and playlist edits like Volumio"""
+
+    def __init__(self):
+        self.sio = socketio.AsyncServer(async_mode="asgi")
+        self.app = socketio.ASGIApp(self.sio)
+        self.browses: list[str] = []
+        self.all_browsed = asyncio.Event()
+        self.expected_browses = 1
+        self.edits_in_flight = 0
+        self.max_edits_in_flight = 0
+
+        @self.sio.on("browseLibrary")
+        async def browse(sid, data):
+            self.browses.append(data["uri"])
+            if len(self.browses) == self.expected_browses:
+                self.all_browsed.set()
+            # Answer once every browse arrived, the last one first
+            await self.all_browsed.wait()
+            await asyncio.sleep(
+                0.01 * (self.expected_browses - self.browses.index(data["uri"]))
+            )
+            if data["uri"].endswith("without uri"):
+                await self.sio.emit("pushBrowseLibrary", browse_reply(None, []), to=sid)
+            else:
+                items = [track(f"{data['uri']}/track")]
+                await self.sio.emit(
+                    "pushBrowseLibrary", browse_reply(data["uri"], items), to=sid
+                )
+
+        @self.sio.on("addToPlaylist")
+        async def add(sid, data):
+            self.edits_in_flight += 1
+            self.max_edits_in_flight = max(
+                self.max_edits_in_flight, self.edits_in_flight
+            )
+            await asyncio.sleep(0.02)
+            self.edits_in_flight -= 1
+            toast = {"type": "success", "title": "Added", "message": data["uri"]}
+            await self.sio.emit("pushToastMessage", toast, to=sid)
+
+        @self.sio.on("getState")
+        async def never_answer(_sid, *_):
+            pass
+
+
+def track(uri: str) -> dict:
+    return {"service": "mpd", "type": "song", "title": uri, "uri": uri}
+
+
+def browse_reply(uri: str | None, items: list[dict]) -> dict:
+    navigation = {
+        "prev": {"uri": "playlists"},
+        "lists": [{"availableListViews": ["list"], "items": items}],
+    }
+    if uri is not None:
+        navigation["info"] = {
+            "service": "mpd",
+            "type": "play-playlist",
+            "title": uri,
+            "uri": uri,
+        }
+    return {"navigation": navigation}
+
+
+@asynccontextmanager
+async def connected(fake: FakeVolumio, **kwargs):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(
+        uvicorn.Config(fake.app, host="127.0.0.1", port=port, log_level="warning")
+    )
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        async with VolumioController.connect(
+            f"http://127.0.0.1:{port}", **kwargs
+        ) as vc:
+            yield vc
+    finally:
+        server.should_exit = True
+        await serving
+
+
+def test_pipelined_browses_get_their_own_replies():
+    async def main():
+        fake = FakeVolumio()
+        fake.expected_browses = 3
+        async with connected(fake) as vc:
+            results = await asyncio.gather(
+                *(vc.list_tracks(name) for name in ("a", "b", "c"))
+            )
+        return results
+
+    results = asyncio.run(main())
+    assert [[item.uri for item in tracks] for tracks in results] == [
+        ["playlists/a/track"],
+        ["playlists/b/track"],
+        ["playlists/c/track"],
+    ]
+
+
+def test_browse_reply_without_uri_is_not_taken():
+    async def main():
+        fake = FakeVolumio()
+        fake.expected_browses = 2
+        async with connected(fake, timeout=0.5) as vc:
+            return await asyncio.gather(
+                vc.list_tracks("a"),
+                vc.list_tracks("without uri"),
+                return_exceptions=True,
+            )
+
+    tracks, error = asyncio.run(main())
+    assert [item.uri for item in tracks] == ["playlists/a/track"]
+    assert isinstance(error, VolumioTimeoutError)
+
+
+def test_toast_calls_wait_for_each_other():
+    async def main():
+        fake = FakeVolumio()
+        async with connected(fake) as vc:
+            toasts = await asyncio.gather(
+                *(vc.add_to_playlist("p", "mpd", f"uri {i}") for i in range(4))
+            )
+        return fake, toasts
+
+    fake, toasts = asyncio.run(main())
+    assert [toast.message for toast in toasts] == [f"uri {i}" for i in range(4)]
+    assert fake.max_edits_in_flight == 1
+
+
+def test_unanswered_call_times_out():
+    async def main():
+        fake = FakeVolumio()
+        async with connected(fake, timeout=0.1) as vc:
+            with pytest.raises(VolumioTimeoutError):
+                await vc.get_state()
+            return dict(vc._waiting)
+
+    waiting = asyncio.run(main())
+    assert not any(waiting.values())
+
+
+def test_failing_listener_does_not_hold_up_calls():
+    async def main():
+        fake = FakeVolumio()
+        seen = []
+
+        def fail(*_):
+            raise RuntimeError("listener failed")
+
+        async with connected(fake, timeout=1) as vc:
+            vc.on("pushBrowseLibrary", fail)
+            vc.on("pushBrowseLibrary", seen.append)
+            tracks = await vc.list_tracks("a")
+        return tracks, seen
+
+    tracks, seen = asyncio.run(main())
+    assert [item.uri for item in tracks] == ["playlists/a/track"]
+    assert len(seen) == 1
@@ -0,0 +1,98 @@
+import itertools
+import re
+from collections.abc import Collection, Mapping
+
+import pytest
+
+from volco.matcher import InvalidPatternError, PlaylistMatcher
+from volco.models import ListItem
+
+
+def track(title: str) -> ListItem:
+    return ListItem.parse_obj(
+        {"service": "mixcloud", "type": "song", "title": title, "uri": title}
+    )
+
+
+def reference_matches(title: str, patterns: Collection[str]) -> bool:
+    """Substring matching as before the matcher, plus the prefixed rules"""
+    for pattern in patterns:
+        if pattern.startswith("re:"):
+            if re.search(pattern.removeprefix("re:"), title, re.IGNORECASE):
+                return True
+        elif pattern.startswith("word:"):
+            word = re.escape(pattern.removeprefix("word:"))
+            if re.search(rf"\b{word}\b", title, re.IGNORECASE):
+                return True
+        elif pattern in title.lower():
+            return True
+    return False
+
+
+def reference_filter(
+    tracks: list[ListItem], playlist_patterns: Mapping[str, Collection[str]]
+) -> dict[str, list[ListItem]]:
+    return {
+        playlist: [
+            track for track in tracks if reference_matches(track.title, patterns)
+        ]
+        for playlist, patterns in playlist_patterns.items()
+    }
+
+
+def strings(alphabet: str, max_length: int):
+    for length in range(max_length + 1):
+        for chars in itertools.product(alphabet, repeat=length):
+            yield "".join(chars)
+
+
+def test_overlapping_patterns_match_like_substrings():
+    patterns = list(strings("ab", 3))
+    # Each pattern on its own, and patterns sharing prefixes and suffixes
+    playlist_patterns = {pattern: [pattern] for pattern in patterns if pattern}
+    playlist_patterns |= {
+        "nested": ["aba", "b"],
+        "suffixes": ["bab", "ab"],
+        "repeated": ["aaa", "aa", "aaa"],
+        "none": [],
+    }
+    tracks = [track(title) for title in strings("aAb ", 5)]
+
+    assert PlaylistMatcher(playlist_patterns).filter(tracks) == reference_filter(
+        tracks, playlist_patterns
+    )
+
+
+def test_prefixed_and_cased_patterns_match_like_the_reference():
+    playlist_patterns = {
+        "plain": ["Dub", "techno"],
+        "regex": ["re:^the .+ show$", "re:b(oo|a)m"],
+        "word": ["word:dub", "word:c++"],
+        "mixed": ["jazz", "re:\\d{4}", "word:ok"],
+        "empty": [""],
+    }
+    titles = [
+        "The Dub Show",
+        "dubstep techno",
+        "The breakfast show",
+        "Boom bam",
+        "C++ talk",
+        "c++",
+        "Jazz 1999",
+        "OK computer",
+        "Look",
+        "",
+    ]
+    tracks = [track(title) for title in titles]
+
+    filtered = PlaylistMatcher(playlist_patterns).filter(tracks)
+
+    assert filtered == reference_filter(tracks, playlist_patterns)
+    # Plain patterns match the lowercased title, like they used to
+    assert [track.title for track in filtered["plain"]] == ["dubstep techno"]
+    assert len(filtered["empty"]) == len(titles)
+
+
+def test_invalid_regex_is_rejected():
+    with pytest.raises(InvalidPatternError, match="`re:\\(` for playlist `broken`"):
+        PlaylistMatcher({"fine": ["dub"], "broken": ["re:("]})
@@ -0,0 +1,156 @@
+import json
+
+import pytest
+
+from volco.models import BrowseResponse, ListItem
+
+# A page of an NTS feed, as Volumio's REST API returns it
+BROWSE_PAGE = {
+    "navigation": {
+        "prev": {"uri": "soundcloud"},
+        "info": {
+            "service": "soundcloud",
+            "type": "folder",
+            "title": "NTS Monday",
+            "uri": "soundcloud/tracks@userId=995174173",
+            "albumart": "https://i1.sndcdn.com/avatars-000-large.jpg",
+        },
+        "lists": [
+            {
+                "title": "Tracks",
+                "availableListViews": ["list", "grid"],
+                "items": [
+                    {
+                        "service": "soundcloud",
+                        "type": "song",
+                        "title": "Charlie Bones - 04.03.24",
+                        "artist": "NTS Latest",
+                        "album": "",
+                        "albumart": "https://i1.sndcdn.com/artworks-000-large.jpg",
+                        "duration": 7199,
+                        "uri": (
+                            "soundcloud/tracks@userId=995174173"
+                            "/track@trackId=1757123456@fromPage=0"
+                        ),
+                    },
+                    {
+                        "service": "mixcloud",
+                        "type": "song",
+                        "title": "Time Is Away - 03.03.24",
+                        "artist": "NTSRadio",
+                        "year": 2024,
+                        "uri": (
+                            "mixcloud/user@username=NTSRadio"
+                            "/cloudcast@cloudcastId=time-is-away-030324"
+                            "@showMoreFrom=1"
+                        ),
+                    },
+                    {
+                        "service": "mpd",
+                        "type": "folder",
+                        "title": "Local",
+                        "icon": "fa fa-folder-open-o",
+                        "uri": "music-library/NAS",
+                    },
+                    {
+                        "service": "soundcloud",
+                        "type": "soundcloudNextPageItem",
+                        "title": "More ...",
+                        "uri": "soundcloud/tracks@userId=995174173@pageRef=abc",
+                    },
+                ],
+            }
+        ],
+    }
+}
+
+
+def test_browse_page_is_parsed():
+    response = BrowseResponse.parse_obj(BROWSE_PAGE)
+
+    assert len(response.lists) == 1
+    items = response.lists[-1]
+    assert [item.type for item in items] == [
+        "song",
+        "song",
+        "folder",
+        "soundcloudNextPageItem",
+    ]
+    song = items[0]
+    assert song.title == "Charlie Bones - 04.03.24"
+    assert song.duration == 7199
+    assert song.artist == "NTS Latest"
+    assert items[1].year == 2024
+    assert items[2].icon == "fa fa-folder-open-o"
+    assert items[3].duration is None
+
+
+def test_stripped_uri_identifies_a_track_across_lists():
+    items = BrowseResponse.parse_obj(BROWSE_PAGE).lists[-1]
+
+    assert [item.stripped_uri for item in items] == [
+        "soundcloud/track@trackId=1757123456",
+        "mixcloud/cloudcast@cloudcastId=time-is-away-030324",
+        "music-library/NAS",
+        "soundcloud/tracks@userId=995174173@pageRef=abc",
+    ]
+    # Playlists hold stripped URIs, they must strip to themselves
+    for item in items[:2]:
+        stripped = item._replace(uri=item.stripped_uri)
+        assert ListItem.parse_raw(stripped.json()) == stripped
+
+
+def test_catalog_json_round_trips():
+    for item in BrowseResponse.parse_obj(BROWSE_PAGE).lists[-1]:
+        data = item.json()
+
+        assert "stripped_uri" not in json.loads(data)
+        assert ListItem.parse_raw(data) == item
+        assert ListItem.parse_raw(data.encode()) == item
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"title": None},
+        {"title": 1999},
+        {"uri": None},
+        {"uri": ["soundcloud/track@trackId=1"]},
+        {"service": None},
+        {"type": 1},
+        {"duration": "long"},
+    ],
+)
+def test_invalid_fields_are_rejected(changes):
+    item = {**BROWSE_PAGE["navigation"]["lists"][0]["items"][0], **changes}
+
+    with pytest.raises(ValueError, match="Invalid list item"):
+        ListItem.parse_obj(item)
+
+
+@pytest.mark.parametrize("field", ["service", "type", "title", "uri"])
+def test_missing_fields_are_rejected(field):
+    item = dict(BROWSE_PAGE["navigation"]["lists"][0]["items"][0])
+    del item[field]
+
+    with pytest.raises(ValueError, match="Invalid list item"):
+        ListItem.parse_obj(item)
+
+
+@pytest.mark.parametrize(
+    "response",
+    [
+        {},
+        {"navigation": {"lists": [{"title": "Tracks"}]}},
+        {"navigation": {"lists": [{"items": [None]}]}},
+        {"navigation": {"lists": [{"items": ["soundcloud/track@trackId=1"]}]}},
+    ],
+)
+def test_invalid_browse_responses_are_rejected(response):
+    with pytest.raises(ValueError):
+        BrowseResponse.parse_obj(response)
+
+
+def test_invalid_json_is_rejected():
+    with pytest.raises(ValueError):
+        ListItem.parse_raw("{not json")
@@ -0,0 +1,97 @@
+import base64
+
+import pytest
+from fastapi.testclient import TestClient
+
+from volco.app import app, get_pages
+from volco.catalog import Catalog
+from volco.models import ListItem
+from volco.pages import InvalidCursorError, PlaylistPages
+
+
+def track(track_id: int) -> ListItem:
+    return ListItem.parse_obj(
+        {
+            "service": "soundcloud",
+            "type": "song",
+            "title": str(track_id),
+            "uri": f"soundcloud/nts/track@trackId={track_id}",
+        }
+    )
+
+
+@pytest.fixture
+def catalog_path(tmp_path):
+    path = tmp_path / "catalog.db"
+    with Catalog(path) as catalog:
+        catalog.set_playlist_tracks("mixes", [track(i) for i in range(7)])
+    return path
+
+
+@pytest.fixture
+def pages(catalog_path, tmp_path) -> PlaylistPages:
+    return PlaylistPages(catalog_path, tmp_path / "progress.json")
+
+
+def all_titles(pages: PlaylistPages, limit: int) -> list[str]:
+    titles: list[str] = []
+    cursor = None
+    while True:
+        page = pages.track_page("mixes", cursor, limit)
+        assert page.total == 7
+        titles += [track.title for track in page.tracks]
+        cursor = page.next_cursor
+        if cursor is None:
+            return titles
+
+
+def test_cursors_page_through_every_track(pages):
+    for limit in (1, 3, 7, 10):
+        assert all_titles(pages, limit) == [str(i) for i in range(7)]
+
+
+def test_cursor_follows_its_track_when_the_playlist_changes(pages, catalog_path):
+    cursor = pages.track_page("mixes", limit=3).next_cursor
+
+    with Catalog(catalog_path) as catalog:
+        catalog.set_playlist_tracks("mixes", [track(i) for i in (8, 9, *range(7))])
+    pages.invalidate()
+
+    page = pages.track_page("mixes", cursor, limit=2)
+    assert [track.title for track in page.tracks] == ["3", "4"]
+
+
+def test_cursor_of_a_removed_track_keeps_its_position(pages, catalog_path):
+    cursor = pages.track_page("mixes", limit=3).next_cursor
+
+    with Catalog(catalog_path) as catalog:
+        catalog.set_playlist_tracks("mixes", [track(i) for i in (0, 1, 2, 4, 5)])
+    pages.invalidate()
+
+    page = pages.track_page("mixes", cursor, limit=2)
+    assert [track.title for track in page.tracks] == ["4", "5"]
+
+
+@pytest.mark.parametrize(
+    "cursor",
+    [
+        "not base64!",
+        base64.urlsafe_b64encode(b"not json").decode(),
+        base64.urlsafe_b64encode(b"[-1, 0]").decode(),
+        base64.urlsafe_b64encode(b'["1", 0]').decode(),
+        base64.urlsafe_b64encode(b"[1]").decode(),
+        base64.urlsafe_b64encode(b"7").decode(),
+    ],
+)
+def test_invalid_cursors_are_rejected(pages, cursor):
+    with pytest.raises(InvalidCursorError):
+        pages.track_page("mixes", cursor)
+
+    app.dependency_overrides[get_pages] = lambda: pages
+    try:
+        response = TestClient(app).get(
+            "/api/playlists/mixes/tracks", params={"cursor": cursor}
+        )
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 400
@@ -0,0 +1,85 @@
+import itertools
+import time
+
+from volco.models import ListItem
+from volco.planner import _kept_prefix_length, plan_playlist
+
+
+def track(name: str) -> ListItem:
+    return ListItem.parse_obj(
+        {
+            "service": "soundcloud",
+            "type": "song",
+            "title": name,
+            "uri": f"soundcloud/nts/track@trackId={name}",
+        }
+    )
+
+
+def applied(current: list[ListItem], plan) -> list[str]:
+    """Titles left after Volumio runs the plan, removing drops every copy"""
+    if plan.rewrite:
+        return [track.title for track in plan.add]
+    removed = {track.uri for track in plan.remove}
+    kept = [track for track in current if track.uri not in removed]
+    return [track.title for track in kept + plan.add]
+
+
+def reference_kept_prefix_length(current: list[str], target: list[str]) -> int:
+    for kept in range(min(len(current), len(target)), 0, -1):
+        kept_uris = set(target[:kept])
+        if [uri for uri in current if uri in kept_uris] == target[:kept]:
+            return kept
+    return 0
+
+
+def playlists(max_length: int):
+    for length in range(max_length + 1):
+        yield from itertools.product("abc", repeat=length)
+
+
+def test_kept_prefix_matches_its_definition():
+    for current in playlists(4):
+        for target in playlists(4):
+            assert _kept_prefix_length(list(current), list(target)) == (
+                reference_kept_prefix_length(list(current), list(target))
+            ), (current, target)
+
+
+def test_plans_reach_targets_with_duplicates():
+    for current_names in playlists(4):
+        for target_names in playlists(4):
+            current = [track(name) for name in current_names]
+            target = [track(name) for name in target_names]
+            plan = plan_playlist("p", current, target)
+            assert applied(current, plan) == list(target_names)
+
+
+def test_duplicates_of_a_kept_track_are_not_kept():
+    current = [track(name) for name in "abcab"]
+    plan = plan_playlist("p", current, [track(name) for name in "abcd"])
+
+    # Removing the extra copies would remove the first ones too
+    assert plan.rewrite
+    assert [t.title for t in plan.add] == ["a", "b", "c", "d"]
+
+
+def test_duplicate_in_target_is_kept():
+    current = [track(name) for name in "aba"]
+    plan = plan_playlist("p", current, [track(name) for name in "abac"])
+
+    assert not plan.remove
+    assert [t.title for t in plan.add] == ["c"]
+
+
+def test_long_playlist_with_duplicates_is_planned_quickly():
+    names = [str(i) for i in range(10_000)]
+    # A copy at the end means no prefix can be kept
+    current = [track(name) for name in [*names, names[0]]]
+    target = [track(name) for name in names]
+
+    start = time.perf_counter()
+    plan = plan_playlist("p", current, target)
+
+    assert time.perf_counter() - start < 1
+    assert plan.rewrite
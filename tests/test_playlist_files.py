@@ -0,0 +1,103 @@
+import asyncio
+import json
+
+import pytest
+
+from volco.catalog import Catalog
+from volco.models import ListItem
+from volco.planner import plan_playlist
+from volco.playlist_files import PlaylistFiles
+
+MIXES = [
+    {
+        "service": "mixcloud",
+        "uri": "mixcloud/user@username=NTSRadio/cloudcast@cloudcastId=one",
+        "title": "One",
+        "albumart": "https://example.com/one.jpg",
+        # Added by Volumio, kept when the playlist is written
+        "volumio": {"added": 1},
+    },
+    {
+        "service": "soundcloud",
+        "uri": "soundcloud/nts/track@trackId=2",
+        "title": "Two",
+    },
+]
+
+
+def track(uri: str, title: str, service: str = "soundcloud") -> ListItem:
+    return ListItem.parse_obj(
+        {"service": service, "type": "song", "title": title, "uri": uri}
+    )
+
+
+@pytest.fixture
+def files(tmp_path) -> PlaylistFiles:
+    (tmp_path / "mixes").write_text(json.dumps(MIXES))
+    (tmp_path / "empty").write_text("[]")
+    (tmp_path / ".hidden").write_text("[]")
+    return PlaylistFiles(tmp_path)
+
+
+def test_list_playlists_skips_hidden_files(files):
+    assert asyncio.run(files.list_playlists()) == ["empty", "mixes"]
+
+
+def test_list_tracks(files):
+    tracks = asyncio.run(files.list_tracks("mixes"))
+
+    assert [track.title for track in tracks] == ["One", "Two"]
+    assert {track.type for track in tracks} == {"song"}
+    assert tracks[0].stripped_uri == "mixcloud/cloudcast@cloudcastId=one"
+    assert asyncio.run(files.list_tracks("missing")) == []
+
+
+def test_invalid_playlist_names_are_rejected(files):
+    for name in ("", "../mixes", ".hidden"):
+        with pytest.raises(ValueError):
+            asyncio.run(files.list_tracks(name))
+
+
+def test_apply_plans_writes_targets(files, tmp_path):
+    current = asyncio.run(files.list_tracks("mixes"))
+    # Drop the first mix, keep the second with a different URI suffix, add one
+    target = [
+        track("soundcloud/nts/track@trackId=2@fromPage=1", "Two"),
+        track("soundcloud/nts/track@trackId=3", "Three"),
+    ]
+    new = [track("soundcloud/nts/track@trackId=4", "Four")]
+    plans = [
+        plan_playlist("mixes", current, target),
+        plan_playlist("new", [], new),
+        plan_playlist("empty", [], []),
+    ]
+    (tmp_path / "mixes").chmod(0o640)
+
+    with Catalog(tmp_path / "catalog.db") as catalog:
+        asyncio.run(files.apply_plans(plans, catalog))
+        synced = catalog.playlist_tracks("mixes")
+
+    entries = json.loads((tmp_path / "mixes").read_text())
+    # The entry already in the file is kept as it was
+    assert entries == [
+        MIXES[1],
+        {
+            "service": "soundcloud",
+            "uri": "soundcloud/nts/track@trackId=3",
+            "title": "Three",
+        },
+    ]
+    assert (tmp_path / "mixes").stat().st_mode & 0o777 == 0o640
+    assert json.loads((tmp_path / "new").read_text())[0]["title"] == "Four"
+    assert (tmp_path / "empty").read_text() == "[]"
+    assert [track.title for track in synced] == ["Two", "Three"]
+    assert not list(tmp_path.glob(".*.tmp"))
+
+
+def test_apply_plans_without_changes_writes_nothing(files, tmp_path):
+    current = asyncio.run(files.list_tracks("mixes"))
+    before = (tmp_path / "mixes").stat().st_mtime_ns
+
+    asyncio.run(files.apply_plans([plan_playlist("mixes", current, current)]))
+
+    assert (tmp_path / "mixes").stat().st_mtime_ns == before
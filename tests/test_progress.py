@@ -0,0 +1,85 @@
+import gzip
+import json
+
+import pydantic
+
+from volco.models import StateLog
+from volco.progress import aggregate_file, aggregate_files
+from volco.renderer import decode_progress_fields
+from volco.statelog import rotated_shards
+
+STATE = {
+    "status": "play",
+    "service": "mixcloud",
+    "uri": "mixcloud/user@username=NTSRadio/cloudcast@cloudcastId=one",
+    "title": "One",
+    "artist": "NTS",
+    "seek": 60000,
+    "duration": 3600,
+}
+
+
+def line(ts: str = "2024-01-01T12:00:00", **state) -> str:
+    return json.dumps({"ts": ts, "state": {**STATE, **state}}) + "\n"
+
+
+def reference_fields(line: str) -> tuple[str, str, int, int] | None:
+    try:
+        state = StateLog.parse_raw(line).state
+    except pydantic.error_wrappers.ValidationError:
+        return None
+    return state.service, state.uri, state.seek, state.duration
+
+
+def test_decoder_matches_state_log_model():
+    lines = [
+        line(),
+        line(ts="2024-01-01 12:00:00.5+01:00"),
+        line(ts="1704110400"),
+        line(ts="not a time"),
+        line(seek="60000"),
+        line(seek=60000.0),
+        line(seek=None),
+        line(duration="1h"),
+        line(title=7),
+        line(artist=None),
+        json.dumps({"ts": "2024-01-01T12:00:00", "state": {"service": "mpd"}}),
+        json.dumps({"state": STATE}),
+        "[]",
+        "",
+        "{not json",
+        line()[:40],
+    ]
+
+    for log_line in lines:
+        assert decode_progress_fields(log_line) == reference_fields(log_line), log_line
+        encoded = log_line.encode()
+        assert decode_progress_fields(encoded) == reference_fields(log_line), log_line
+
+
+def test_shards_are_merged_oldest_first(tmp_path):
+    log_path = tmp_path / "state.log"
+    stripped_uri = "mixcloud/cloudcast@cloudcastId=one"
+    (tmp_path / "state.log.2.gz").write_bytes(
+        gzip.compress((line(seek=90000, duration=3000) + line()).encode())
+    )
+    (tmp_path / "state.log.1").write_text(line(seek=30000, duration=3300))
+    (tmp_path / "state.log.10").write_text("")
+    (tmp_path / "state.log.old").write_text(line(seek=99999999))
+    log_path.write_text(line())
+
+    shards = rotated_shards(log_path)
+
+    assert [shard.name for shard in shards] == [
+        "state.log.10",
+        "state.log.2.gz",
+        "state.log.1",
+    ]
+    assert aggregate_file(shards[1]) == (
+        {stripped_uri: 90000},
+        {stripped_uri: 3600},
+    )
+    # The highest seek of any shard, the duration of the newest one
+    merged = ({stripped_uri: 90000}, {stripped_uri: 3300})
+    assert aggregate_files(shards) == merged
+    assert aggregate_files(shards[1:2]) == aggregate_file(shards[1])
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from volco.constants import (
+    PUBLICATION_HISTORY,
+    SOURCE_DEFAULT_INTERVAL,
+    SOURCE_EARLY_CHECK,
+    SOURCE_MAX_INTERVAL,
+    SOURCE_MIN_INTERVAL,
+)
+from volco.scheduler import next_check_time
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+LAST = datetime(2024, 3, 4, 20, 0)
+# Newest first, the last publication came in two batches an hour apart
+FIRST_SEEN = [
+    LAST + timedelta(hours=1),
+    LAST,
+    LAST - timedelta(days=7),
+    LAST - timedelta(days=13),
+    LAST - timedelta(days=21),
+]
+# A median gap of 7 days after the last publication, minus the early start
+START = LAST.timestamp() + 7 * DAY - SOURCE_EARLY_CHECK
+
+
+def test_source_without_history_is_checked_at_default_interval():
+    checked_at = LAST.timestamp()
+
+    for first_seen in ([], [LAST], [LAST, LAST - timedelta(hours=2)]):
+        assert next_check_time(first_seen, checked_at) == (
+            checked_at + SOURCE_DEFAULT_INTERVAL
+        )
+
+
+def test_source_is_left_alone_until_its_next_publication():
+    checked_at = LAST.timestamp() + 2 * HOUR
+    assert next_check_time(FIRST_SEEN, checked_at) == checked_at + SOURCE_MAX_INTERVAL
+
+    checked_at = START - 3 * HOUR
+    assert next_check_time(FIRST_SEEN, checked_at) == START
+
+
+def test_overdue_source_is_checked_less_and_less_often():
+    for overdue, interval in [
+        (0, SOURCE_MIN_INTERVAL),
+        (4 * HOUR, HOUR),
+        (8 * HOUR, 2 * HOUR),
+        (10 * DAY, SOURCE_MAX_INTERVAL),
+    ]:
+        checked_at = START + overdue
+        assert next_check_time(FIRST_SEEN, checked_at) == checked_at + interval
+
+
+def test_only_recent_publications_count():
+    # Daily publications long ago don't make a weekly source look daily
+    old = [LAST - timedelta(days=30 + day) for day in range(PUBLICATION_HISTORY * 2)]
+    # With those, the median gap would be a day and checks would start now
+    checked_at = LAST.timestamp() + 20 * HOUR
+
+    assert next_check_time(FIRST_SEEN + old, checked_at) == (
+        checked_at + SOURCE_MAX_INTERVAL
+    )
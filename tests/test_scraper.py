@@ -0,0 +1,161 @@
+from collections.abc import Collection
+from functools import partial
+
+from volco.models import ListItem
+from volco.scraper import (
+    StopCondition,
+    StopOnAny,
+    StopOnFingerprint,
+    StopOnMaxTracks,
+    StopOnOverlap,
+    _Crawl,
+    feed_fingerprint,
+)
+
+
+def item(track_id: str, suffix: str = "", type: str = "song") -> dict:
+    return {
+        "service": "soundcloud",
+        "type": type,
+        "title": track_id,
+        "uri": f"soundcloud/nts/track@trackId={track_id}{suffix}",
+    }
+
+
+def track(track_id: str, suffix: str = "") -> ListItem:
+    return ListItem.parse_obj(item(track_id, suffix))
+
+
+def page(*items: dict, next_uri: str | None = None) -> dict:
+    items = list(items)
+    if next_uri is not None:
+        items.append(
+            {
+                "service": "soundcloud",
+                "type": "soundcloudNextPageItem",
+                "title": "More",
+                "uri": next_uri,
+            }
+        )
+    return {"navigation": {"lists": [{"items": items}]}}
+
+
+class RecordPages(StopCondition):
+    def __init__(self, stop_after: int | None = None):
+        self.pages: list[list[str]] = []
+        self.stop_after = stop_after
+
+    def update(self, new_tracks: Collection[ListItem]) -> bool:
+        self.pages.append([track.title for track in new_tracks])
+        return self.stop_after is not None and len(self.pages) >= self.stop_after
+
+
+def test_stop_on_any_feeds_every_condition_every_page():
+    stop = StopOnAny(partial(RecordPages, stop_after=2), RecordPages)
+    first, second = stop.conditions
+
+    assert not stop.update([])
+    assert stop.update([track("1"), track("2")])
+    assert stop.update([track("3")])
+
+    # The first condition stopping doesn't keep pages from the other
+    assert first.pages == second.pages == [[], ["1", "2"], ["3"]]
+
+
+def test_stop_on_any_makes_fresh_conditions():
+    factory = partial(StopOnAny, partial(StopOnMaxTracks, max_tracks=1))
+
+    stop = factory()
+    assert stop.update([track("1"), track("2")])
+    assert not factory().update([track("1")])
+
+
+def test_stop_on_overlap_counts_distinct_known_tracks():
+    existing_uris = {track("1").stripped_uri, track("2").stripped_uri}
+    stop = StopOnOverlap(existing_uris, min_overlap=2)
+
+    assert not stop.update([])
+    assert not stop.update([track("3"), track("1")])
+    # The same track again, under another URI suffix
+    assert not stop.update([track("1", "@fromPage=2")])
+    assert stop.update([track("2")])
+
+
+def test_crawl_skips_tracks_of_earlier_pages():
+    crawl = _Crawl("soundcloud/nts", RecordPages())
+
+    assert not crawl.should_stop()
+    crawl.add_page(page(item("1"), item("2"), next_uri="soundcloud/nts@page=2"))
+    assert crawl.next_uri == "soundcloud/nts@page=2"
+    assert not crawl.should_stop()
+    # Feeds shift while paged, so pages can repeat tracks
+    crawl.add_page(
+        page(
+            item("2", "@fromPage=2"),
+            item("3"),
+            item("3"),
+            item("folder", type="folder"),
+            item("other", type="playlist"),
+        )
+    )
+    assert not crawl.should_stop()
+
+    assert crawl.next_uri is None
+    assert [track.title for track in crawl.tracks] == ["1", "2", "3", "folder"]
+    assert crawl.stop_condition.pages == [[], ["1", "2"], ["3", "folder"]]
+
+
+def test_stop_on_overlap_stops_at_high_water_mark():
+    stop = StopOnOverlap(
+        {track("1").stripped_uri},
+        min_overlap=5,
+        high_water_uri=track("2").stripped_uri,
+    )
+
+    assert not stop.update([track("4"), track("3")])
+    assert stop.update([track("2", "@fromPage=2"), track("1")])
+
+
+def test_feed_fingerprint_needs_enough_tracks():
+    tracks = [track(str(i)) for i in range(5)]
+
+    assert feed_fingerprint(tracks[:4], size=5) is None
+    assert feed_fingerprint(tracks, size=5) == feed_fingerprint(
+        [*tracks, track("extra")], size=5
+    )
+    # Only the stripped URIs count, and their order
+    assert feed_fingerprint(tracks, size=5) == feed_fingerprint(
+        [track(str(i), "@fromPage=1") for i in range(5)], size=5
+    )
+    assert feed_fingerprint(tracks, size=5) != feed_fingerprint(tracks[::-1], size=5)
+
+
+def test_stop_on_fingerprint_stops_on_an_unchanged_feed():
+    tracks = [track(str(i)) for i in range(5)]
+    stop = StopOnFingerprint(feed_fingerprint(tracks, size=3), size=3)
+
+    assert not stop.update([])
+    assert stop.update(tracks)
+
+
+def test_stop_on_fingerprint_waits_for_a_partial_first_page():
+    tracks = [track(str(i)) for i in range(5)]
+    stop = StopOnFingerprint(feed_fingerprint(tracks, size=3), size=3)
+
+    assert not stop.update(tracks[:2])
+    assert stop.update(tracks[2:])
+
+
+def test_stop_on_fingerprint_pages_on_through_changed_feeds():
+    tracks = [track(str(i)) for i in range(5)]
+    new_upload = track("new")
+
+    stop = StopOnFingerprint(feed_fingerprint(tracks, size=3), size=3)
+    assert not stop.update([new_upload, *tracks[:2]])
+    # Later pages don't change the first tracks
+    assert not stop.update(tracks[2:])
+
+    # Sources without a fingerprint yet, or shorter than one
+    assert not StopOnFingerprint(None, size=3).update(tracks)
+    short_feed = StopOnFingerprint(feed_fingerprint(tracks[:2], size=3), size=3)
+    assert not short_feed.update(tracks[:2])
@@ -0,0 +1,53 @@
+from volco.statelog import CompactStateLog, Sample, aggregate_state_log
+
+# Old enough to be compacted
+OLD = 1_000_000
+
+
+def sample(ts: int, uri: str, seek: int) -> Sample:
+    return Sample(ts, "mixcloud", uri, seek, 3600, "play")
+
+
+def test_append_after_compact_on_same_instance(tmp_path):
+    log = CompactStateLog(tmp_path / "state.dat")
+    log.append([sample(OLD, "a", 1000), sample(OLD + 60, "a", 2000)])
+    log.append([sample(OLD + 120, "b", 1000)])
+    assert log.compact(100) == 1
+
+    log.append([sample(OLD + 180, "c", 3000)])
+
+    with CompactStateLog(log.path).read() as columns:
+        assert columns.uris == [("mixcloud", "a"), ("mixcloud", "b"), ("mixcloud", "c")]
+        assert columns.column("uri_id").tolist() == [0, 1, 2]
+    max_seeks, _ = aggregate_state_log(CompactStateLog(log.path))
+    assert max_seeks == {"a": 2000, "b": 1000, "c": 3000}
+
+
+def test_append_after_compact_by_another_instance(tmp_path):
+    path = tmp_path / "state.dat"
+    recorder = CompactStateLog(path)
+    recorder.append([sample(OLD, "a", 1000), sample(OLD + 60, "a", 2000)])
+    recorder.append([sample(OLD + 120, "b", 1000)])
+
+    other = CompactStateLog(path)
+    assert other.compact(100) == 1
+    # The dictionary grows back past the size the recorder has read
+    other.append([sample(OLD + 180, f"new {i}", 1000) for i in range(5)])
+
+    recorder.append([sample(OLD + 240, "c", 3000)])
+
+    max_seeks, _ = aggregate_state_log(CompactStateLog(path))
+    assert max_seeks["a"] == 2000
+    assert max_seeks["c"] == 3000
+    assert len(max_seeks) == 8
+
+
+def test_compact_keeps_recent_samples(tmp_path):
+    log = CompactStateLog(tmp_path / "state.dat")
+    log.append([sample(OLD, "a", 1000), sample(OLD + 60, "a", 2000)])
+    log.append([sample(2**31, "a", 500)])
+
+    assert log.compact(100) == 1
+
+    with log.read() as columns:
+        assert columns.column("seek").tolist() == [2000, 500]
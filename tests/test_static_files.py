@@ -0,0 +1,56 @@
+import gzip
+
+import pytest
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+
+from volco.static_files import CachedStaticFiles
+
+
+@pytest.fixture
+def client(tmp_path) -> TestClient:
+    (tmp_path / "style.css").write_text("body {}")
+    (tmp_path / "playlist_patterns.json").write_text("{}")
+    (tmp_path / "page.html").write_text("<p>page</p>")
+    (tmp_path / "page.html.gz").write_bytes(gzip.compress(b"<p>page</p>"))
+    static_files = CachedStaticFiles(
+        directory=tmp_path, asset_cache_control="public, max-age=3600"
+    )
+    return TestClient(Starlette(routes=[Mount("/static", app=static_files)]))
+
+
+def test_only_assets_are_cached_without_revalidation(client):
+    assert (
+        client.get("/static/style.css").headers["cache-control"]
+        == "public, max-age=3600"
+    )
+    for path in ("/static/playlist_patterns.json", "/static/page.html"):
+        response = client.get(path)
+        assert response.headers["cache-control"] == "no-cache"
+        assert response.headers["etag"]
+
+
+def test_rewritten_file_gets_a_new_etag(client, tmp_path):
+    etag = client.get("/static/playlist_patterns.json").headers["etag"]
+    revisit = client.get(
+        "/static/playlist_patterns.json", headers={"if-none-match": etag}
+    )
+    assert revisit.status_code == 304
+
+    tmp_path.joinpath(".rules.tmp").write_text('{"dub": ["dub"]}')
+    tmp_path.joinpath(".rules.tmp").replace(tmp_path / "playlist_patterns.json")
+
+    response = client.get(
+        "/static/playlist_patterns.json", headers={"if-none-match": etag}
+    )
+    assert response.status_code == 200
+    assert response.json() == {"dub": ["dub"]}
+
+
+def test_gzipped_sibling_is_sent_to_clients_accepting_it(client):
+    response = client.get("/static/page.html", headers={"accept-encoding": "gzip"})
+
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.text == "<p>page</p>"
+    assert response.headers["etag"].endswith('-gzip"')
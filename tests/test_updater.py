@@ -0,0 +1,56 @@
+import asyncio
+import json
+from pathlib import Path
+
+import pytest
+
+from volco import updater
+from volco.catalog import Catalog
+from volco.playlist_files import PlaylistFiles
+
+TRACKS = [
+    {
+        "service": "soundcloud",
+        "uri": f"soundcloud/nts/track@trackId={track_id}",
+        "title": f"Track {track_id}",
+    }
+    for track_id in range(3)
+]
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch) -> Path:
+    site = tmp_path / "static"
+    (site / "playlists").mkdir(parents=True)
+    monkeypatch.setattr(updater, "PLAYLIST_HTML_DIR", site / "playlists")
+    monkeypatch.setattr(updater, "INDEX_PATH", site / "index.html")
+    monkeypatch.setattr(updater, "PAGE_HASHES_PATH", tmp_path / "page_hashes.json")
+    monkeypatch.setattr(
+        updater, "TEMPLATE_DIR", Path(__file__).parents[1] / "templates"
+    )
+    return site
+
+
+def test_catalog_is_synced_when_pages_are_unchanged(site, tmp_path):
+    playlist_dir = tmp_path / "playlists"
+    playlist_dir.mkdir()
+    (playlist_dir / "mixes").write_text(json.dumps(TRACKS))
+    files = PlaylistFiles(playlist_dir)
+
+    with Catalog(tmp_path / "catalog.db") as catalog:
+        asyncio.run(updater.generate_html_files(None, catalog, playlist_files=files))
+        page = next((site / "playlists").glob("*.html"))
+        rendered_at = page.stat().st_mtime_ns
+        volumio_tracks = catalog.playlist_tracks("mixes")
+
+        # An edit recorded in the catalog that never made it to Volumio
+        catalog.set_playlist_tracks("mixes", volumio_tracks[:1])
+        asyncio.run(updater.generate_html_files(None, catalog, playlist_files=files))
+
+        assert page.stat().st_mtime_ns == rendered_at
+        assert catalog.playlist_tracks("mixes") == volumio_tracks
+    assert [track.title for track in volumio_tracks] == [
+        "Track 0",
+        "Track 1",
+        "Track 2",
+    ]